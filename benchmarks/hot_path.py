@@ -0,0 +1,335 @@
+"""
+Measure the classification hot path: `Preprocessor`, `ImageClassifier`
+predictions and `predict_category`, and the persistence of `ImageORM` rows in
+a SQLite stand-in database with their blobs, over sweeps of batch sizes, torch threads, input
+resolutions and image formats of the fixtures in `tests/data`.
+
+Each case reports its p50/p95/p99 latency, images/sec and peak RSS. The
+results are written as JSON with `--output`, and compared to a previous run
+with `--baseline`: the exit status is 1 if a case got slower by more than
+`--tolerance`.
+
+Usage: SECRET_KEY=benchmark PYTHONPATH=src python benchmarks/hot_path.py \
+    [--output results.json] [--baseline baseline.json]
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import torch
+from PIL import Image
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import app.models as models
+from app.core.blobs import FileSystemBlobStore, store_blobs
+from app.core.ml.cnn_model import ImageClassifier, Preprocessor
+from app.db.database import Base
+
+DATA_DIR = "tests/data"
+IMAGE_PATH = os.path.join(DATA_DIR, "dog.jpg")
+MODEL_PATH = os.path.join(DATA_DIR, "mobilenet_v3_large.pth")
+LABEL_PATH = os.path.join(DATA_DIR, "imagenet_classes.txt")
+BENCHMARKS = ["preprocess", "predict", "predict_category", "persist"]
+
+
+def int_list(value):
+    return [int(item) for item in value.split(",")]
+
+
+def resolution_list(value):
+    return [
+        tuple(int(side) for side in item.lower().split("x"))
+        for item in value.split(",")
+    ]
+
+
+def encode(size, image_format):
+    image = Image.open(IMAGE_PATH).convert("RGB").resize(size)
+    buf = io.BytesIO()
+    image.save(buf, format=image_format)
+    return buf.getvalue()
+
+
+def reset_peak_rss():
+    # Linux resets VmHWM, the peak RSS of the process, on writing 5 here
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # Peak of the whole run elsewhere: kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def case_key(case):
+    params = ",".join(f"{key}={value}" for key, value in case["params"].items())
+    return f"{case['name']}[{params}]"
+
+
+def measure(name, params, fn, images, repeat, warmup):
+    """
+    Time `repeat` calls of `fn`, each processing `images` images.
+    """
+    for _ in range(warmup):
+        fn()
+    reset_peak_rss()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99]) * 1000
+    case = {
+        "name": name,
+        "params": params,
+        "p50_ms": round(float(p50), 4),
+        "p95_ms": round(float(p95), 4),
+        "p99_ms": round(float(p99), 4),
+        "images_per_sec": round(images * len(timings) / sum(timings), 2),
+        "peak_rss_mb": round(peak_rss_bytes() / 2**20, 1),
+    }
+    print(
+        f"{case_key(case):<64}{case['p50_ms']:>10.2f}{case['p95_ms']:>10.2f}"
+        f"{case['p99_ms']:>10.2f}{case['images_per_sec']:>12.1f}"
+        f"{case['peak_rss_mb']:>10.1f}"
+    )
+    return case
+
+
+def bench_preprocess(args, classifier, inputs):
+    preprocessor = Preprocessor(fast=True, draft=args.jpeg_draft)
+    for (size, image_format), image_data in inputs.items():
+        yield measure(
+            "preprocess",
+            {"resolution": "x".join(map(str, size)), "format": image_format},
+            lambda: preprocessor(Image.open(io.BytesIO(image_data))),
+            1,
+            args.repeat,
+            args.warmup,
+        )
+
+
+def bench_predict(args, classifier, inputs):
+    tensor = classifier.preprocess(Image.open(IMAGE_PATH))
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        for batch_size in args.batch_sizes:
+            batch = tensor.unsqueeze(0).repeat(batch_size, 1, 1, 1)
+            yield measure(
+                "predict",
+                {"batch_size": batch_size, "threads": threads},
+                lambda: classifier.predict_batch(batch),
+                batch_size,
+                args.repeat,
+                args.warmup,
+            )
+
+
+def bench_predict_category(args, classifier, inputs):
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        for (size, image_format), image_data in inputs.items():
+            yield measure(
+                "predict_category",
+                {
+                    "resolution": "x".join(map(str, size)),
+                    "format": image_format,
+                    "threads": threads,
+                },
+                lambda: classifier.predict_category(
+                    Image.open(io.BytesIO(image_data))
+                ),
+                1,
+                args.repeat,
+                args.warmup,
+            )
+
+
+def bench_persist(args, classifier, inputs):
+    images = list(inputs.values())
+    with tempfile.TemporaryDirectory() as directory:
+        store = FileSystemBlobStore(os.path.join(directory, "blobs"))
+        engine = create_engine(f"sqlite:///{directory}/benchmark.db")
+        Base.metadata.create_all(bind=engine)
+        with sessionmaker(bind=engine)() as db:
+            user = models.UserORM(
+                username="benchmark",
+                email="benchmark@example.com",
+                hashed_password="",
+            )
+            db.add(user)
+            db.commit()
+
+            for batch_size in args.batch_sizes:
+
+                def persist():
+                    # New content every time, so that every blob is written
+                    batch = [
+                        images[i % len(images)] + os.urandom(8)
+                        for i in range(batch_size)
+                    ]
+                    db.add_all(
+                        models.ImageORM(
+                            filename="dog.jpg",
+                            label="dog",
+                            probability=0.99,
+                            user_id=user.id,
+                            **blob,
+                        )
+                        for blob in store_blobs(db, store, batch)
+                    )
+                    db.commit()
+
+                yield measure(
+                    "persist",
+                    {"batch_size": batch_size},
+                    persist,
+                    batch_size,
+                    args.repeat,
+                    args.warmup,
+                )
+        engine.dispose()
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the changes from the baseline, and return the regressed cases.
+    """
+    previous = {case_key(case): case for case in baseline["results"]}
+    regressions = []
+    print(f"\n{'case':<64}{'p50':>10}{'images/s':>12}")
+    for case in results:
+        before = previous.get(case_key(case))
+        if before is None:
+            continue
+        latency = case["p50_ms"] / before["p50_ms"] - 1
+        throughput = case["images_per_sec"] / before["images_per_sec"] - 1
+        regressed = latency > tolerance or throughput < -tolerance
+        if regressed:
+            regressions.append(case_key(case))
+        print(
+            f"{case_key(case):<64}{latency:>+10.1%}{throughput:>+12.1%}"
+            + ("  REGRESSION" if regressed else "")
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "--benchmarks", type=lambda value: value.split(","), default=BENCHMARKS
+    )
+    parser.add_argument("--batch-sizes", type=int_list, default=[1, 8, 32])
+    parser.add_argument("--threads", type=int_list, default=[1, 4])
+    parser.add_argument(
+        "--resolutions",
+        type=resolution_list,
+        default=[(224, 224), (640, 480), (1920, 1080)],
+    )
+    parser.add_argument(
+        "--formats",
+        type=lambda value: value.upper().split(","),
+        default=["JPEG", "PNG", "WEBP"],
+    )
+    parser.add_argument("--backend", default="torch")
+    parser.add_argument("--jpeg-draft", action="store_true")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare to")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Relative slowdown reported as a regression",
+    )
+    args = parser.parse_args()
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    classifier = ImageClassifier(
+        MODEL_PATH,
+        LABEL_PATH,
+        device="cpu",
+        fast_preprocessing=True,
+        jpeg_draft=args.jpeg_draft,
+        backend=args.backend,
+    )
+    inputs = {
+        (size, image_format): encode(size, image_format)
+        for size in args.resolutions
+        for image_format in args.formats
+    }
+
+    print(
+        f"{'case':<64}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+        f"{'images/s':>12}{'RSS MB':>10}"
+    )
+    benchmarks = {
+        "preprocess": bench_preprocess,
+        "predict": bench_predict,
+        "predict_category": bench_predict_category,
+        "persist": bench_persist,
+    }
+    default_threads = torch.get_num_threads()
+    results = []
+    for name in args.benchmarks:
+        results.extend(benchmarks[name](args, classifier, inputs))
+        torch.set_num_threads(default_threads)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+        },
+        "model_version": classifier.version,
+        "backend": args.backend,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["machine"] != report["machine"]:
+            print("\nWarning: the baseline was measured on another machine")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) regressed")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
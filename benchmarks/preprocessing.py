@@ -0,0 +1,62 @@
+"""
+Compare the reference torchvision preprocessing with the fast paths of
+`Preprocessor` on JPEGs of increasing resolution.
+
+Usage: PYTHONPATH=src python benchmarks/preprocessing.py [--repeat 20]
+"""
+
+import argparse
+import io
+import time
+
+from PIL import Image
+
+from app.core.ml.cnn_model import Preprocessor
+
+IMAGE_SIZES = [(640, 480), (1920, 1080), (4032, 3024)]
+
+
+def make_jpeg(size):
+    image = Image.open("tests/data/dog.jpg").convert("RGB").resize(size)
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def time_preprocessor(preprocessor, image_data, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        preprocessor(Image.open(io.BytesIO(image_data)))
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    preprocessors = {
+        "reference": Preprocessor(fast=False),
+        "fast": Preprocessor(fast=True),
+        "fast+draft": Preprocessor(fast=True, draft=True),
+    }
+
+    header = f"{'size':>10}" + "".join(f"{name:>14}" for name in preprocessors)
+    print(header + f"{'speedup':>10}")
+    for size in IMAGE_SIZES:
+        image_data = make_jpeg(size)
+        medians = {
+            name: time_preprocessor(preprocessor, image_data, args.repeat)
+            for name, preprocessor in preprocessors.items()
+        }
+        row = f"{size[0]:>5}x{size[1]:<4}" + "".join(
+            f"{median * 1000:>12.2f}ms" for median in medians.values()
+        )
+        speedup = medians["reference"] / medians["fast+draft"]
+        print(row + f"{speedup:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
 from fastapi import APIRouter
 
 from ..api.v1 import router as v1_router
+from .metrics import router as metrics_router
 
-router = APIRouter(prefix="/api")
-router.include_router(v1_router)
+api_router = APIRouter(prefix="/api")
+api_router.include_router(v1_router)
+
+router = APIRouter()
+router.include_router(api_router)
+# Where Prometheus scrapes by default
+router.include_router(metrics_router)
@@ -1,48 +1,61 @@
+import asyncio
 from typing import Annotated, Any
 
 from fastapi import Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import app.models as models
+from app.core.metrics import time_stage
 from app.core.security import oauth2_scheme, verify_password, verify_token
 from app.db.database import get_db
 
 
-def get_user(username: str | None, db: Session) -> Any:
-    return (
-        db.query(models.UserORM)
-        .filter(models.UserORM.username == username)
-        .first()
-    )
+async def get_user(username: str | None, db: AsyncSession) -> Any:
+    with time_stage("get_user"):
+        return await db.scalar(
+            select(models.UserORM)
+            .where(models.UserORM.username == username)
+            .limit(1)
+        )
 
 
-def user_already_registered(user: models.UserORM, db: Session) -> bool:
+async def user_already_registered(
+    user: models.UserORM, db: AsyncSession
+) -> bool:
     return (
-        db.query(models.UserORM)
-        .filter(
-            models.UserORM.username == user.username
-            or models.UserORM.email == user.email
+        await db.scalar(
+            select(models.UserORM.id)
+            .where(
+                models.UserORM.username == user.username
+                or models.UserORM.email == user.email
+            )
+            .limit(1)
         )
-        .first()
         is not None
     )
 
 
-def authenticate_user(
-    username: str, password: str, db: Session
+async def authenticate_user(
+    username: str, password: str, db: AsyncSession
 ) -> models.UserORM | None:
-    user = get_user(username, db)
+    user = await get_user(username, db)
     if not user:
         return None
-    return user if verify_password(password, user.hashed_password) else None
+    # bcrypt is slow by design, it would stall the other requests
+    verified = await asyncio.to_thread(
+        verify_password, password, user.hashed_password
+    )
+    return user if verified else None
 
 
-def get_current_user(
+async def get_current_user(
     token: Annotated[str, Depends(oauth2_scheme)],
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_db)],
 ):
-    token_data = verify_token(token, db)
-    user = get_user(token_data.username, db)
+    with time_stage("verify_token"):
+        token_data = await verify_token(token, db)
+    user = await get_user(token_data.username, db)
 
     if user is None:
         raise HTTPException(
@@ -60,3 +73,14 @@ async def get_current_active_user(
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
+
+
+async def get_current_admin_user(
+    current_user: Annotated[models.UserORM, Depends(get_current_active_user)],
+):
+    if not current_user.is_superuser:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin privileges required",
+        )
+    return current_user
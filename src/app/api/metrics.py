@@ -0,0 +1,26 @@
+import asyncio
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.core.metrics import registry
+
+router: APIRouter = APIRouter(tags=["Info"])
+
+# Version of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    response_description="Metrics in the Prometheus text format",
+)
+async def get_metrics() -> PlainTextResponse:
+    """
+    Latency histograms of the requests by route, and of the stages of the
+    classification and authentication, summed over the serving workers.
+    """
+    # Reads the series flushed by the other workers
+    text = await asyncio.to_thread(registry.render)
+    return PlainTextResponse(text, media_type=CONTENT_TYPE)
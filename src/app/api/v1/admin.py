@@ -0,0 +1,107 @@
+from enum import Enum
+from typing import Annotated, Any
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+
+import app.models as models
+from app.api.dependencies import get_current_admin_user
+from app.core import profiling
+from app.core.config import settings
+from app.core.tracing import recorder
+
+router: APIRouter = APIRouter(prefix="/admin", tags=["Admin"])
+
+
+class ProfileKind(str, Enum):
+    Torch = "torch"
+    Python = "python"
+
+
+@router.post(
+    "/profile",
+    response_class=Response,
+    response_description="The profile, as a downloadable file",
+    responses={409: {"description": "A capture is already in progress"}},
+)
+async def capture_profile(
+    current_user: Annotated[models.UserORM, Depends(get_current_admin_user)],
+    kind: Annotated[
+        ProfileKind,
+        Query(
+            description="`torch`: operator traces of the forward passes, "
+            "`python`: sampled stacks of the request path"
+        ),
+    ],
+    seconds: Annotated[
+        float,
+        Query(
+            description="Longest capture",
+            gt=0,
+            le=settings.PROFILE_MAX_SECONDS,
+        ),
+    ] = 10,
+    requests: Annotated[
+        int | None,
+        Query(description="Stop after this many requests finished", ge=1),
+    ] = None,
+) -> Response:
+    """
+    Profile this worker for the next `requests` requests or `seconds`,
+    whichever comes first.
+
+    The `torch` profile is a zip of Chrome traces, to open in Perfetto, with
+    a summary of the CPU time by operator. The `python` profile is collapsed
+    stacks, to open in speedscope. Nothing is recorded between captures.
+    """
+    capture: profiling.Capture
+    if kind == ProfileKind.Torch:
+        if settings.INFERENCE_EXECUTOR == "process":
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="The forward passes of process workers cannot be "
+                "profiled.",
+            )
+        capture = profiling.TorchCapture(seconds, requests)
+    else:
+        capture = profiling.SamplingCapture(
+            seconds, requests, settings.PROFILE_SAMPLE_INTERVAL_MS / 1000
+        )
+
+    try:
+        artifact = await capture.run()
+    except profiling.CaptureInProgress as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A capture is already in progress.",
+        ) from e
+    return Response(
+        artifact,
+        media_type=capture.media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{capture.filename}"'
+        },
+    )
+
+
+@router.get(
+    "/slow-requests",
+    response_description="The slowest recent requests",
+)
+async def get_slow_requests(
+    current_user: Annotated[models.UserORM, Depends(get_current_admin_user)],
+    limit: Annotated[
+        int | None, Query(description="Number of requests to fetch", ge=1)
+    ] = None,
+    clear: Annotated[
+        bool, Query(description="Forget the requests once fetched")
+    ] = False,
+) -> list[dict[str, Any]]:
+    """
+    The recent requests of this worker slower than `SLOW_REQUEST_MS`, the
+    slowest first, with the duration of their stages, the size of their
+    images and the batches they were classified in.
+    """
+    records = recorder.dump(limit)
+    if clear:
+        recorder.clear()
+    return records
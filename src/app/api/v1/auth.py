@@ -1,10 +1,11 @@
+import asyncio
 from datetime import timedelta
 from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from jose import JWTError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import app.models as models
 from app.api.dependencies import authenticate_user, user_already_registered
@@ -29,20 +30,22 @@ router: APIRouter = APIRouter(prefix="/auth", tags=["Auth"])
     response_description="Registration confirmation",
 )
 async def register_new_user(
-    user: schemas.UserCreate, db: Annotated[Session, Depends(get_db)]
+    user: schemas.UserCreate, db: Annotated[AsyncSession, Depends(get_db)]
 ) -> schemas.RegisterResponse:
     """
     Register a new user.
     """
 
-    hashed_password = get_password_hash(user.password.get_secret_value())
+    hashed_password = await asyncio.to_thread(
+        get_password_hash, user.password.get_secret_value()
+    )
     new_user = models.UserORM(
         username=user.username,
         email=user.email,
         hashed_password=hashed_password,
     )
 
-    if user_already_registered(new_user, db):
+    if await user_already_registered(new_user, db):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Client already registered.",
@@ -50,14 +53,13 @@ async def register_new_user(
 
     try:
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
         message = f"User {new_user.username} registered successfully."
         return schemas.RegisterResponse(
             status=schemas.Status.Success, message=message
         )
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An error occurred while registering the user.",
@@ -70,9 +72,9 @@ async def register_new_user(
 )
 async def login(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_db)],
 ) -> Token:
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await authenticate_user(form_data.username, form_data.password, db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -94,7 +96,7 @@ async def login(
 )
 async def logout(
     access_token: Annotated[str, Depends(oauth2_scheme)],
-    db: Annotated[Session, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_db)],
 ) -> dict[str, str]:
     unauthorized_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -102,9 +104,9 @@ async def logout(
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        if is_blacklisted(access_token, db):
+        if await is_blacklisted(access_token, db):
             raise unauthorized_exception
-        blacklist_token(access_token, db)
+        await blacklist_token(access_token, db)
     except JWTError:
         unauthorized_exception
     return {"message": "Logged out successfully"}
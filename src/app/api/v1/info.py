@@ -2,7 +2,9 @@ import os
 import sys
 
 import torch
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, status
+
+from app.core import serving
 
 router: APIRouter = APIRouter(tags=["Info"])
 
@@ -19,6 +21,37 @@ async def healthchecker():
     return {"message": "The API is LIVE!"}
 
 
+@router.get(
+    "/ready",
+    summary="API Readiness Checker",
+    response_description="Confirmation",
+    responses={503: {"description": "The model is warming up, or saturated"}},
+)
+async def readiness_checker():
+    """
+    Check that the model is loaded and warmed up, and that the inference
+    queue is not saturated, to route traffic to this instance only when its
+    requests are fast.
+    """
+    from app.core.setup import is_ready, ml_models
+
+    if not is_ready():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The model is warming up.",
+        )
+    admission = ml_models["admission"]
+    if admission.saturated:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The inference queue is saturated.",
+            headers={
+                "Retry-After": str(max(1, round(admission.estimated_wait())))
+            },
+        )
+    return {"message": "The API is READY!"}
+
+
 @router.get(
     "/about",
     response_description="System information",
@@ -45,3 +78,15 @@ async def show_system_info():
             else "CUDA not available"
         ),
     }
+
+
+@router.get(
+    "/about/workers",
+    response_description="Memory of the serving processes",
+)
+async def show_workers_memory():
+    """
+    Get the RSS and PSS of the gunicorn master and workers, in kB, to verify
+    that the model weights are shared between the workers.
+    """
+    return serving.workers_memory()
@@ -0,0 +1,259 @@
+import asyncio
+import logging
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import app.models as models
+from app.api.dependencies import get_current_active_user
+from app.api.v1.ml import (
+    ModelQuery,
+    classify_image,
+    get_model_registry,
+    index_images,
+    quota_error,
+    read_image_file,
+    upload_error,
+)
+from app.core.blobs import save_blob
+from app.core.config import settings
+from app.core.jobs import FINISHED, JobQueue
+from app.core.ml.admission import Overloaded
+from app.core.ml.registry import ModelRegistry
+from app.core.quotas import QuotaExceeded
+from app.core.uploads import UploadError
+from app.db.database import AsyncSessionLocal, get_db
+from app.schemas import schemas
+
+router: APIRouter = APIRouter(prefix="/ml/jobs", tags=["ML"])
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def job_response(job: models.JobORM) -> schemas.JobResponse:
+    return schemas.JobResponse(
+        id=job.public_id,
+        status=job.status,
+        attempts=job.attempts,
+        results=(
+            schemas.InferenceResult.model_validate(job.result)
+            if job.result is not None
+            else None
+        ),
+        message=job.error,
+        submitted_at=job.creationdate,
+        finished_at=job.finishdate,
+    )
+
+
+async def renew_lease(queue: JobQueue, job_id: int, attempt: int) -> None:
+    """
+    Renew the lease of a job while it is processed, until it is claimed
+    again by another worker.
+    """
+    while True:
+        await asyncio.sleep(queue.lease_seconds / 3)
+        try:
+            async with AsyncSessionLocal() as db:
+                if not await db.run_sync(queue.renew, job_id, attempt):
+                    return
+        except Exception:
+            logger.exception("Lease renewal of job %s failed", job_id)
+
+
+async def process_next_job(
+    queue: JobQueue, db: AsyncSession, registry: ModelRegistry
+) -> bool:
+    """
+    Claim and classify one job, if one is queued.
+    """
+    job = await db.run_sync(queue.claim)
+    if job is None:
+        return False
+    heartbeat = asyncio.create_task(renew_lease(queue, job.id, job.attempts))
+    try:
+        return await process_job(queue, db, registry, job)
+    finally:
+        heartbeat.cancel()
+
+
+async def process_job(
+    queue: JobQueue,
+    db: AsyncSession,
+    registry: ModelRegistry,
+    job: models.JobORM,
+) -> bool:
+    """
+    Classify a claimed job, and store its results.
+    """
+    from app.core.setup import ml_models
+
+    # Read now, the job is expired by a rollback
+    public_id = job.public_id
+    job_id, attempt = job.id, job.attempts
+    image_data = job.image_data
+    user = await db.get(models.UserORM, job.user_id)
+
+    try:
+        if image_data is None:
+            raise ValueError("The image of the job was released.")
+        async with registry.acquire(job.model) as served:
+            results = await classify_image(
+                job.filename,
+                image_data,
+                served,
+                flow=job.user_id,
+                weight=ml_models["quotas"].limits(user).weight,
+            )
+    except Overloaded as e:
+        # Leave it to a less loaded worker, or to this one later
+        await db.run_sync(queue.release, job_id, attempt)
+        await asyncio.sleep(e.retry_after)
+        return True
+    except Exception:
+        logger.exception("Job %s failed", public_id)
+        await db.run_sync(
+            queue.fail,
+            job_id,
+            attempt,
+            "An error occurred while classifying the image.",
+        )
+        return True
+
+    try:
+        blob = await save_blob(db, ml_models["blob_store"], image_data)
+        image = models.ImageORM(
+            filename=job.filename,
+            **blob,
+            label=results.prediction,
+            probability=results.probability,
+            model_version=results.model_version,
+            embedding=results.embedding,
+            user_id=job.user_id,
+        )
+        db.add(image)
+        completed = await db.run_sync(
+            queue.complete, job_id, attempt, results.model_dump(mode="json")
+        )
+    except Exception:
+        await db.rollback()
+        logger.exception("Job %s failed", public_id)
+        await db.run_sync(
+            queue.fail,
+            job_id,
+            attempt,
+            "An error occurred while saving the image.",
+        )
+        return True
+    if not completed:
+        logger.warning("Job %s was claimed again before completing", public_id)
+        return True
+    await index_images([image])
+    return True
+
+
+async def run_job_worker(
+    queue: JobQueue, registry: ModelRegistry, poll_interval: float
+) -> None:
+    """
+    Classify the queued jobs until cancelled, polling the queue when idle.
+    """
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                while await process_next_job(queue, db, registry):
+                    pass
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Job worker failed")
+        await queue.wait_for_submission(poll_interval)
+
+
+def get_job_queue() -> JobQueue:
+    from app.core.setup import ml_models
+
+    queue: JobQueue = ml_models["job_queue"]
+    return queue
+
+
+@router.post(
+    "",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_description="Queue an image to classify in the background",
+)
+async def submit_job(
+    file: UploadFile,
+    db: Annotated[AsyncSession, Depends(get_db)],
+    current_user: Annotated[models.UserORM, Depends(get_current_active_user)],
+    queue: Annotated[JobQueue, Depends(get_job_queue)],
+    registry: Annotated[ModelRegistry, Depends(get_model_registry)],
+    model: ModelQuery = None,
+) -> schemas.JobResponse:
+    """
+    Store the image and return the job id at once, without waiting for the
+    classification: poll `GET /ml/jobs/{id}` for the results.
+    """
+    from app.core.setup import ml_models
+
+    try:
+        image_data = await read_image_file(file)
+    except UploadError as e:
+        raise upload_error(e) from e
+
+    try:
+        with ml_models["quotas"].acquire(current_user):
+            job = await db.run_sync(
+                queue.submit,
+                current_user.id,
+                str(file.filename),
+                image_data,
+                model,
+            )
+    except QuotaExceeded as e:
+        raise quota_error(e) from e
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while queueing the image.",
+        ) from e
+    return job_response(job)
+
+
+@router.get(
+    "/{job_id}",
+    response_description="Status and results of a classification job",
+)
+async def get_job(
+    job_id: str,
+    db: Annotated[AsyncSession, Depends(get_db)],
+    current_user: Annotated[models.UserORM, Depends(get_current_active_user)],
+    queue: Annotated[JobQueue, Depends(get_job_queue)],
+    wait: Annotated[
+        float,
+        Query(
+            description="Seconds to wait for the job to finish (long poll)",
+            ge=0,
+            le=settings.JOB_MAX_WAIT,
+        ),
+    ] = 0,
+) -> schemas.JobResponse:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    while True:
+        job = await db.run_sync(queue.get, job_id, current_user.id)
+        if job is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Job not found.",
+            )
+        timeout = deadline - loop.time()
+        if job.status in FINISHED or timeout <= 0:
+            return job_response(job)
+        # End the read transaction, to see the job once finished
+        await db.commit()
+        await queue.wait_for_completion(
+            min(timeout, settings.JOB_POLL_INTERVAL)
+        )
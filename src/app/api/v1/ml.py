@@ -1,67 +1,638 @@
-import io
-from typing import Annotated
+import asyncio
+from collections.abc import AsyncIterator, Hashable, Sequence
+from contextlib import ExitStack
+from typing import Annotated, Any
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, status
-from PIL import Image
-from sqlalchemy.orm import Session
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+    status,
+)
+from fastapi.responses import StreamingResponse
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import app.models as models
-from app.api.dependencies import get_current_active_user
-from app.db.database import get_db
+from app.api.dependencies import get_current_active_user, get_current_admin_user
+from app.core.blobs import put_blobs, save_blob, save_blobs
+from app.core.config import settings
+from app.core.metrics import observe_stage, time_stage
+from app.core.ml.admission import AdmissionController, Overloaded
+from app.core.ml.batching import QueueTimeout
+from app.core.ml.cache import Prediction
+from app.core.ml.executor import decode_and_preprocess
+from app.core.ml.registry import ModelRegistry, ServedModel
+from app.core.quotas import OverBurst, QuotaExceeded
+from app.core.tracing import current_trace
+from app.core.uploads import (
+    SIGNATURE_SIZE,
+    UploadError,
+    UploadTooLarge,
+    check_image_signature,
+    iter_upload_file,
+    probe_image,
+    read_archive,
+    read_upload,
+)
+from app.core.writebehind import WriteBehindFull
+from app.db.database import AsyncSessionLocal, get_db
 from app.schemas import schemas
 
 router: APIRouter = APIRouter(prefix="/ml", tags=["ML"])
 
+ModelQuery = Annotated[
+    str | None,
+    Query(description="Name of the model, the default model if omitted"),
+]
 
-@router.post(
-    "/predict",
-    status_code=status.HTTP_200_OK,
-    response_description="Classify an image using CNN",
-)
-async def predict(
-    file: UploadFile,
-    db: Annotated[Session, Depends(get_db)],
-    current_user: Annotated[models.UserORM, Depends(get_current_active_user)],
+
+def get_model_registry(model: ModelQuery = None) -> ModelRegistry:
+    from app.core.setup import ml_models
+
+    registry: ModelRegistry = ml_models["model_registry"]
+    if model is not None and model not in registry.names:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown model: {model}",
+        )
+    return registry
+
+
+async def classify_image(
+    filename: str,
+    image_data: bytes,
+    served: ServedModel,
+    flow: Hashable = None,
+    weight: float = 1.0,
+) -> schemas.InferenceResult:
+    from app.core.setup import ml_models
+
+    near_duplicate_index = served.near_duplicate_index
+    admission = ml_models["admission"]
+
+    async def compute() -> Prediction:
+        # Only cache misses take a place in the inference queue
+        with admission.admit():
+            (
+                (width, height),
+                input_tensor,
+                image_hash,
+                timings,
+            ) = await asyncio.get_running_loop().run_in_executor(
+                ml_models["inference_executor"],
+                decode_and_preprocess,
+                image_data,
+                near_duplicate_index is not None,
+                served.key,
+            )
+            for stage, seconds in timings.items():
+                observe_stage(stage, seconds)
+            trace = current_trace.get()
+            if trace is not None:
+                trace.images.append(
+                    {"width": width, "height": height, "bytes": len(image_data)}
+                )
+            if near_duplicate_index is not None and image_hash is not None:
+                # Only the images of the same user are reused
+                near_duplicate = near_duplicate_index.search(image_hash, flow)
+                if near_duplicate is not None:
+                    near_duplicate_index.reused += 1
+                    category, prob, embedding = near_duplicate[1]
+                    return Prediction(
+                        width, height, category, prob, True, embedding
+                    )
+
+            try:
+                (
+                    category,
+                    prob,
+                    embedding,
+                ) = await served.batch_scheduler.submit(
+                    input_tensor, flow, weight
+                )
+            except QueueTimeout:
+                raise admission.reject("timed_out") from None
+        if near_duplicate_index is not None and image_hash is not None:
+            near_duplicate_index.add(
+                image_hash, (category, prob, embedding), flow
+            )
+        return Prediction(width, height, category, prob, embedding=embedding)
+
+    prediction = await served.prediction_cache.get_or_compute(
+        image_data, compute
+    )
+    return schemas.InferenceResult(
+        filename=filename,
+        width=prediction.width,
+        height=prediction.height,
+        prediction=prediction.label,
+        probability=prediction.probability,
+        reused=prediction.reused,
+        model=served.name,
+        model_version=served.version,
+        embedding=prediction.embedding,
+    )
+
+
+def upload_error(error: UploadError) -> HTTPException:
+    return HTTPException(status_code=error.status_code, detail=str(error))
+
+
+def overloaded_error(error: Overloaded) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="The server is overloaded, retry later.",
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+def write_behind_error(error: WriteBehindFull) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="The server is overloaded, retry later.",
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+def quota_error(error: QuotaExceeded) -> HTTPException:
+    if isinstance(error, OverBurst):
+        return HTTPException(
+            status_code=error.status_code,
+            detail=f"At most {error.burst} images can be classified at once "
+            "within the quota.",
+        )
+    return HTTPException(
+        status_code=error.status_code,
+        detail="Quota exceeded, retry later.",
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+def check_declared_size(size: int | None, max_bytes: int) -> None:
+    """
+    Reject an upload whose declared size is over the limit, before reading it.
+    """
+    if size is not None and size > max_bytes:
+        raise UploadTooLarge(f"The upload exceeds {max_bytes} bytes.")
+
+
+async def read_image_file(file: UploadFile) -> bytes:
+    """
+    Read an uploaded image within the size limits, checking that it is an
+    image whose header can be read.
+    """
+    check_declared_size(file.size, settings.MAX_UPLOAD_BYTES)
+    image_data = await read_upload(
+        iter_upload_file(file), settings.MAX_UPLOAD_BYTES
+    )
+    probe_image(image_data, settings.MAX_IMAGE_PIXELS)
+    return image_data
+
+
+async def index_images(images: Sequence[models.ImageORM]) -> None:
+    """
+    Add the embeddings of saved images to the similarity indexes of this
+    process, so that its next searches do not read them back.
+    """
+    from app.core.setup import ml_models
+
+    rows: dict[tuple[int, str], list[tuple[int, bytes]]] = {}
+    for image in images:
+        if image.model_version is not None and image.embedding is not None:
+            rows.setdefault((image.user_id, image.model_version), []).append(
+                (image.id, image.embedding)
+            )
+    for (user_id, model_version), embeddings in rows.items():
+        await ml_models["similarity"].add(user_id, model_version, embeddings)
+
+
+async def save_prediction(
+    filename: str,
+    image_data: bytes,
+    db: AsyncSession,
+    current_user: models.UserORM,
+    registry: ModelRegistry,
+    model: str | None,
 ) -> schemas.InferenceResponse:
     from app.core.setup import ml_models
 
     try:
-        image_data = await file.read()
-
-        image = Image.open(io.BytesIO(image_data))
-        width, height = image.size
-        category, prob = ml_models["image_classifier"].predict_category(image)
-        results = schemas.InferenceResult(
-            filename=str(file.filename),
-            width=width,
-            height=height,
-            prediction=category,
-            probability=prob,
-        )
+        with ml_models["quotas"].acquire(current_user) as limits:
+            async with registry.acquire(model) as served:
+                results = await classify_image(
+                    filename,
+                    image_data,
+                    served,
+                    flow=current_user.id,
+                    weight=limits.weight,
+                )
+        category, prob = results.prediction, results.probability
+    except QuotaExceeded as e:
+        raise quota_error(e) from e
+    except Overloaded as e:
+        raise overloaded_error(e) from e
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An error occurred while classifying the image.",
         ) from e
 
+    row = {
+        "filename": filename,
+        "label": category,
+        "probability": prob,
+        "model_version": results.model_version,
+        "embedding": results.embedding,
+        "user_id": current_user.id,
+    }
+    writer = ml_models.get("write_behind")
+    # The images written behind are read by the next search instead
+    saved: list[models.ImageORM] = []
     try:
-        new_image = models.ImageORM(
-            filename=file.filename,
-            image_data=image_data,
-            label=category,
-            probability=prob,
-            user_id=current_user.id,
-        )
-        db.add(new_image)
-        db.commit()
-        db.refresh(new_image)
+        if writer is not None:
+            with time_stage("blob_store"):
+                (blob,) = await put_blobs(ml_models["blob_store"], [image_data])
+            with time_stage("write_behind"):
+                await writer.put({**row, **blob})
+        else:
+            with time_stage("blob_store"):
+                blob = await save_blob(db, ml_models["blob_store"], image_data)
+            image = models.ImageORM(**row, **blob)
+            db.add(image)
+            with time_stage("db_commit"):
+                await db.commit()
+            saved.append(image)
+    except WriteBehindFull as e:
+        raise write_behind_error(e) from e
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An error occurred while saving the image.",
         ) from e
+    await index_images(saved)
 
     return schemas.InferenceResponse(
         status=schemas.Status.Success, results=results
     )
+
+
+@router.post(
+    "/predict",
+    status_code=status.HTTP_200_OK,
+    response_description="Classify an image using CNN",
+)
+async def predict(
+    file: UploadFile,
+    db: Annotated[AsyncSession, Depends(get_db)],
+    current_user: Annotated[models.UserORM, Depends(get_current_active_user)],
+    registry: Annotated[ModelRegistry, Depends(get_model_registry)],
+    model: ModelQuery = None,
+) -> schemas.InferenceResponse:
+    try:
+        with time_stage("upload"):
+            image_data = await read_image_file(file)
+    except UploadError as e:
+        raise upload_error(e) from e
+
+    return await save_prediction(
+        str(file.filename), image_data, db, current_user, registry, model
+    )
+
+
+@router.post(
+    "/predict/raw",
+    status_code=status.HTTP_200_OK,
+    response_description="Classify an image sent as the raw request body",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/octet-stream": {
+                    "schema": {"type": "string", "format": "binary"}
+                }
+            },
+        }
+    },
+)
+async def predict_raw(
+    request: Request,
+    db: Annotated[AsyncSession, Depends(get_db)],
+    current_user: Annotated[models.UserORM, Depends(get_current_active_user)],
+    registry: Annotated[ModelRegistry, Depends(get_model_registry)],
+    model: ModelQuery = None,
+    filename: Annotated[
+        str, Query(description="Filename stored in the history")
+    ] = "image",
+) -> schemas.InferenceResponse:
+    """
+    Classify the `application/octet-stream` request body, streamed without
+    multipart parsing.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/"):
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Send the image as application/octet-stream.",
+        )
+    try:
+        with time_stage("upload"):
+            content_length = request.headers.get("content-length")
+            check_declared_size(
+                int(content_length) if content_length else None,
+                settings.MAX_UPLOAD_BYTES,
+            )
+            image_data = await read_upload(
+                request.stream(), settings.MAX_UPLOAD_BYTES
+            )
+            probe_image(image_data, settings.MAX_IMAGE_PIXELS)
+    except UploadError as e:
+        raise upload_error(e) from e
+
+    return await save_prediction(
+        filename, image_data, db, current_user, registry, model
+    )
+
+
+@router.post(
+    "/predict/batch",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    response_description="Classify many images using CNN, one NDJSON line "
+    "per image",
+)
+async def predict_batch(
+    files: list[UploadFile],
+    current_user: Annotated[models.UserORM, Depends(get_current_active_user)],
+    registry: Annotated[ModelRegistry, Depends(get_model_registry)],
+    model: ModelQuery = None,
+) -> StreamingResponse:
+    """
+    Classify several images, or a single zip/tar archive of images.
+
+    Results are streamed as they finish, so lines may be out of order: use
+    `index` to match them with the uploaded images.
+    """
+    try:
+        check_declared_size(
+            sum(file.size or 0 for file in files),
+            settings.MAX_BATCH_UPLOAD_BYTES,
+        )
+        images = None
+        if len(files) == 1:
+            images = await asyncio.to_thread(
+                read_archive,
+                files[0].file,
+                settings.MAX_UPLOAD_BYTES,
+                settings.MAX_BATCH_UPLOAD_BYTES,
+            )
+        if images is None:
+            images = [
+                (
+                    str(file.filename),
+                    await read_upload(
+                        iter_upload_file(file),
+                        settings.MAX_UPLOAD_BYTES,
+                        check_signature=False,
+                    ),
+                )
+                for file in files
+            ]
+    except UploadError as e:
+        raise upload_error(e) from e
+
+    if len(images) > settings.MAX_IMAGES_PER_BATCH:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.MAX_IMAGES_PER_BATCH} images can be "
+            "classified at once.",
+        )
+
+    from app.core.setup import ml_models
+
+    quotas = ml_models["quotas"]
+    try:
+        quotas.check(current_user, len(images))
+    except QuotaExceeded as e:
+        raise quota_error(e) from e
+
+    user_id = current_user.id
+
+    async def classify(
+        index: int,
+        filename: str,
+        image_data: bytes,
+        served: ServedModel,
+        weight: float,
+    ) -> tuple[schemas.BatchInferenceResult, dict[str, Any] | None]:
+        try:
+            check_image_signature(image_data[:SIGNATURE_SIZE])
+            probe_image(image_data, settings.MAX_IMAGE_PIXELS)
+        except UploadError as e:
+            return (
+                schemas.BatchInferenceResult(
+                    index=index, status=schemas.Status.Error, message=str(e)
+                ),
+                None,
+            )
+        try:
+            results = await classify_image(
+                filename, image_data, served, flow=user_id, weight=weight
+            )
+        except Overloaded as e:
+            return (
+                schemas.BatchInferenceResult(
+                    index=index,
+                    status=schemas.Status.Error,
+                    message="The server is overloaded, retry after "
+                    f"{e.retry_after} s.",
+                ),
+                None,
+            )
+        except Exception:
+            return (
+                schemas.BatchInferenceResult(
+                    index=index,
+                    status=schemas.Status.Error,
+                    message="An error occurred while classifying the image.",
+                ),
+                None,
+            )
+        row = {
+            "filename": filename,
+            "image_data": image_data,
+            "label": results.prediction,
+            "probability": results.probability,
+            "model_version": results.model_version,
+            "embedding": results.embedding,
+            "user_id": user_id,
+        }
+        return (
+            schemas.BatchInferenceResult(
+                index=index, status=schemas.Status.Success, results=results
+            ),
+            row,
+        )
+
+    async def stream_results() -> AsyncIterator[str]:
+        rows = []
+        with ExitStack() as stack:
+            try:
+                limits = stack.enter_context(
+                    quotas.acquire(current_user, len(images))
+                )
+            except QuotaExceeded as e:
+                # Taken by a concurrent request since the check
+                error = schemas.BatchInferenceResult(
+                    index=-1,
+                    status=schemas.Status.Error,
+                    message=f"Quota exceeded, retry after {e.retry_after} s.",
+                )
+                yield error.model_dump_json() + "\n"
+                return
+
+            # The whole batch is classified by the same model version
+            async with registry.acquire(model) as served:
+                tasks = [
+                    asyncio.ensure_future(
+                        classify(
+                            index, filename, image_data, served, limits.weight
+                        )
+                    )
+                    for index, (filename, image_data) in enumerate(images)
+                ]
+                try:
+                    for next_result in asyncio.as_completed(tasks):
+                        line, row = await next_result
+                        if row is not None:
+                            rows.append(row)
+                        yield line.model_dump_json() + "\n"
+                finally:
+                    for task in tasks:
+                        task.cancel()
+
+        if not rows:
+            return
+        writer = ml_models.get("write_behind")
+        saved: list[models.ImageORM] = []
+        try:
+            contents = [row.pop("image_data") for row in rows]
+            if writer is not None:
+                blobs = await put_blobs(ml_models["blob_store"], contents)
+                for row, blob in zip(rows, blobs):
+                    await writer.put({**row, **blob})
+            else:
+                # Not the session of the request, closed once the endpoint
+                # returned, before the response is streamed
+                async with AsyncSessionLocal() as db:
+                    blobs = await save_blobs(
+                        db, ml_models["blob_store"], contents
+                    )
+                    for row, blob in zip(rows, blobs):
+                        row.update(blob)
+                    ids = (
+                        await db.scalars(
+                            insert(models.ImageORM).returning(
+                                models.ImageORM.id,
+                                sort_by_parameter_order=True,
+                            ),
+                            rows,
+                        )
+                    ).all()
+                    await db.commit()
+                saved = [
+                    models.ImageORM(id=image_id, **row)
+                    for image_id, row in zip(ids, rows)
+                ]
+        except Exception:
+            error = schemas.BatchInferenceResult(
+                index=-1,
+                status=schemas.Status.Error,
+                message="An error occurred while saving the images.",
+            )
+            yield error.model_dump_json() + "\n"
+        await index_images(saved)
+
+    return StreamingResponse(
+        stream_results(), media_type="application/x-ndjson"
+    )
+
+
+@router.get(
+    "/cache",
+    response_description="Prediction cache statistics",
+)
+async def get_cache_stats(
+    current_user: Annotated[models.UserORM, Depends(get_current_admin_user)],
+    registry: Annotated[ModelRegistry, Depends(get_model_registry)],
+    model: ModelQuery = None,
+) -> dict[str, int | str]:
+    """
+    Hit, miss and coalesce counters of the prediction cache of a model.
+    """
+    served = registry.get(model)
+    if served is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Model not loaded: {model}",
+        )
+
+    stats = served.prediction_cache.stats()
+    if served.near_duplicate_index is not None:
+        stats["near_duplicate_size"] = len(served.near_duplicate_index)
+        stats["near_duplicate_reused"] = served.near_duplicate_index.reused
+    return stats
+
+
+@router.get(
+    "/queue",
+    response_description="Inference queue statistics",
+)
+async def get_queue_stats(
+    current_user: Annotated[models.UserORM, Depends(get_current_admin_user)],
+) -> dict[str, int | float | bool]:
+    """
+    Depth, estimated wait and rejection counters of the inference queue.
+    """
+    from app.core.setup import ml_models
+
+    admission: AdmissionController = ml_models["admission"]
+    return admission.stats()
+
+
+@router.get(
+    "/persistence",
+    response_description="Persistence statistics",
+)
+async def get_persistence_stats(
+    current_user: Annotated[models.UserORM, Depends(get_current_admin_user)],
+) -> dict[str, Any]:
+    """
+    How the classification results are written: synchronously, or by the
+    write-behind writer, with its queue depth, the age of the oldest result
+    not written yet, and its write, loss and rejection counters.
+    """
+    from app.core.setup import ml_models
+
+    writer = ml_models.get("write_behind")
+    if writer is None:
+        return {"mode": "synchronous"}
+    return {"mode": "write_behind", **writer.stats()}
+
+
+@router.get(
+    "/models",
+    response_description="Served models",
+)
+async def get_models(
+    current_user: Annotated[models.UserORM, Depends(get_current_admin_user)],
+    registry: Annotated[ModelRegistry, Depends(get_model_registry)],
+) -> dict[str, Any]:
+    """
+    The available and loaded models, their versions and memory usage.
+    """
+    return registry.stats()
@@ -1,10 +1,17 @@
+import asyncio
+import base64
+import json
+from datetime import datetime
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy import literal, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import app.models as models
 from app.api.dependencies import get_current_active_user
+from app.core.blobs import BlobNotFound, release_blob
+from app.core.config import settings
 from app.db.database import get_db
 from app.schemas import schemas
 
@@ -23,36 +30,107 @@ async def get_user_info(
     return current_user
 
 
+@router.get(
+    "/me/quota",
+    response_description="Inference quota of the current user",
+)
+async def get_user_quota(
+    current_user: Annotated[models.UserORM, Depends(get_current_active_user)],
+) -> schemas.QuotaResponse:
+    from app.core.setup import ml_models
+
+    return schemas.QuotaResponse(**ml_models["quotas"].stats(current_user))
+
+
+def encode_cursor(creationdate: datetime, image_id: int) -> str:
+    """
+    The opaque cursor of the history page after an image.
+    """
+    key = json.dumps([creationdate.isoformat(), image_id])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        creationdate, image_id = json.loads(base64.urlsafe_b64decode(cursor))
+        return datetime.fromisoformat(creationdate), int(image_id)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor.",
+        ) from e
+
+
 @router.get(
     "/me/history",
     response_description="Most recent image classification history",
 )
 async def get_classification_history(
     current_user: Annotated[models.UserORM, Depends(get_current_active_user)],
-    db: Annotated[Session, Depends(get_db)],
-    limit: Annotated[int, Query(description="Number of images to fetch")] = 5,
+    db: Annotated[AsyncSession, Depends(get_db)],
+    limit: Annotated[
+        int,
+        Query(
+            description="Number of images to fetch",
+            ge=1,
+            le=settings.HISTORY_MAX_LIMIT,
+        ),
+    ] = 5,
+    cursor: Annotated[
+        str | None,
+        Query(description="`next_cursor` of the previous page"),
+    ] = None,
 ) -> schemas.InferenceResultHistoryResponse:
-    try:
-        images = (
-            db.query(models.ImageORM)
-            .filter(models.ImageORM.user_id == current_user.id)
-            .order_by(models.ImageORM.creationdate.desc())
-            .limit(limit)
-            .all()
+    """
+    The images of the current user, most recent first, a page at a time.
+    """
+    # Read from the (user_id, creationdate, id) index, from the last image
+    # of the previous page, however deep it is
+    query = (
+        select(
+            models.ImageORM.id,
+            models.ImageORM.filename,
+            models.ImageORM.label,
+            models.ImageORM.probability,
+            models.ImageORM.creationdate,
+        )
+        .where(models.ImageORM.user_id == current_user.id)
+        .order_by(
+            models.ImageORM.creationdate.desc(), models.ImageORM.id.desc()
+        )
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        creationdate, image_id = decode_cursor(cursor)
+        query = query.where(
+            tuple_(models.ImageORM.creationdate, models.ImageORM.id)
+            < tuple_(
+                literal(creationdate, models.ImageORM.creationdate.type),
+                literal(image_id, models.ImageORM.id.type),
+            )
         )
+
+    try:
+        rows = (await db.execute(query)).all()
         history = [
             schemas.InferenceResultHistory(
-                filename=image.filename,
-                label=image.label,
-                probability=image.probability,
-                upload_timestamp=image.creationdate,
+                id=row.id,
+                filename=row.filename,
+                label=row.label,
+                probability=row.probability,
+                upload_timestamp=row.creationdate,
             )
-            for image in images
+            for row in rows[:limit]
         ]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor(last.creationdate, last.id)
         return schemas.InferenceResultHistoryResponse(
             status=schemas.Status.Success,
             username=current_user.username,
             history=history,
+            next_cursor=next_cursor,
         )
 
     except Exception as e:
@@ -61,3 +139,139 @@ async def get_classification_history(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An error occurred while retrieving classification history",
         ) from e
+
+
+async def get_own_image(
+    db: AsyncSession, current_user: models.UserORM, image_id: int
+) -> models.ImageORM:
+    image = await db.get(models.ImageORM, image_id)
+    if image is None or image.user_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Image not found.",
+        )
+    return image
+
+
+@router.get(
+    "/me/images/{image_id}",
+    response_class=Response,
+    response_description="The uploaded image",
+)
+async def get_image(
+    image_id: int,
+    current_user: Annotated[models.UserORM, Depends(get_current_active_user)],
+    db: Annotated[AsyncSession, Depends(get_db)],
+) -> Response:
+    from app.core.setup import ml_models
+
+    image = await get_own_image(db, current_user, image_id)
+    try:
+        content = await asyncio.to_thread(
+            ml_models["blob_store"].get, image.blob_hash
+        )
+    except BlobNotFound as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Image not found.",
+        ) from e
+    return Response(
+        content,
+        media_type=image.mime_type,
+        # The content of an image never changes
+        headers={
+            "Cache-Control": "private, max-age=31536000, immutable",
+            "ETag": f'"{image.blob_hash}"',
+        },
+    )
+
+
+@router.delete(
+    "/me/images/{image_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    response_description="Delete an image from the history",
+)
+async def delete_image(
+    image_id: int,
+    current_user: Annotated[models.UserORM, Depends(get_current_active_user)],
+    db: Annotated[AsyncSession, Depends(get_db)],
+) -> None:
+    """
+    Delete an image and its prediction. Its content is removed from the blob
+    store by the next garbage collection, unless another image has the same.
+    """
+    from app.core.setup import ml_models
+
+    image = await get_own_image(db, current_user, image_id)
+    await db.run_sync(release_blob, image.blob_hash)
+    await db.delete(image)
+    await db.commit()
+    if image.model_version is not None:
+        ml_models["similarity"].remove(
+            image.user_id, image.model_version, [image.id]
+        )
+
+
+@router.get(
+    "/me/similar",
+    response_description="Past images most similar to an image",
+)
+async def get_similar_images(
+    current_user: Annotated[models.UserORM, Depends(get_current_active_user)],
+    db: Annotated[AsyncSession, Depends(get_db)],
+    image_id: Annotated[
+        int, Query(description="Id of the image, from the history")
+    ],
+    limit: Annotated[
+        int, Query(description="Number of images to fetch", ge=1, le=100)
+    ] = 5,
+) -> schemas.SimilarImagesResponse:
+    """
+    Search the images of the current user classified by the same model
+    version, by cosine similarity of their embeddings.
+    """
+    from app.core.setup import ml_models
+
+    image = await get_own_image(db, current_user, image_id)
+    if image.embedding is None:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="The image was classified without embeddings.",
+        )
+
+    similarity = ml_models["similarity"]
+    while True:
+        neighbours = await similarity.search(db, image, limit)
+        images = {
+            neighbour.id: neighbour
+            for neighbour in await db.scalars(
+                select(models.ImageORM).where(
+                    models.ImageORM.id.in_(
+                        [neighbour_id for neighbour_id, _ in neighbours]
+                    )
+                )
+            )
+        }
+        deleted = [
+            neighbour_id
+            for neighbour_id, _ in neighbours
+            if neighbour_id not in images
+        ]
+        if not deleted:
+            break
+        # Deleted by another worker, unnoticed by the index
+        similarity.remove(image.user_id, image.model_version, deleted)
+    return schemas.SimilarImagesResponse(
+        status=schemas.Status.Success,
+        image_id=image_id,
+        similar=[
+            schemas.SimilarImage(
+                id=neighbour_id,
+                filename=images[neighbour_id].filename,
+                label=images[neighbour_id].label,
+                score=min(1.0, max(-1.0, score)),
+                upload_timestamp=images[neighbour_id].creationdate,
+            )
+            for neighbour_id, score in neighbours
+        ],
+    )
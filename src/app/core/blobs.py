@@ -0,0 +1,386 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import Counter
+from collections.abc import Callable, Iterator
+from datetime import datetime, timedelta, timezone
+from typing import Any, cast
+
+from sqlalchemy import CursorResult, delete, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import app.models as models
+from app.core.uploads import sniff_image_format
+
+# Insert or count a new reference in one statement, even when concurrent
+UPSERTS: dict[str, Callable[[Any], postgresql.Insert | sqlite.Insert]] = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def blob_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def mime_type(data: bytes) -> str:
+    image_format = sniff_image_format(data)
+    if image_format is None:
+        return "application/octet-stream"
+    return f"image/{image_format.lower()}"
+
+
+class BlobNotFound(KeyError):
+    pass
+
+
+class BlobStore(ABC):
+    """
+    Immutable blobs addressed by the SHA-256 of their content.
+
+    Writing a blob that exists is a no-op, so a store needs no coordination
+    between writers: the references to the blobs are counted in the database.
+    """
+
+    @abstractmethod
+    def put(self, digest: str, data: bytes) -> None:
+        pass
+
+    @abstractmethod
+    def get(self, digest: str) -> bytes:
+        pass
+
+    @abstractmethod
+    def delete(self, digest: str, older_than: float | None = None) -> bool:
+        """
+        Delete a blob, unless it was written or touched by `put` at or after
+        the `older_than` timestamp, and return whether it was deleted.
+        """
+
+    @abstractmethod
+    def list(self) -> Iterator[tuple[str, float]]:
+        """
+        The hash and modification time of every blob.
+        """
+
+
+class FileSystemBlobStore(BlobStore):
+    """
+    Blobs stored in `root/ab/cd/abcd...`, so that no directory holds more
+    than a few thousand files.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        # The hash names a file, never a path outside of the root
+        if len(digest) != 64 or not all(
+            c in "0123456789abcdef" for c in digest
+        ):
+            raise BlobNotFound(digest)
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, digest: str, data: bytes) -> None:
+        path = self.path(digest)
+        if os.path.exists(path):
+            try:
+                # Touched, so that the garbage collection of the files without
+                # a committed reference spares it until the writer commits
+                os.utime(path)
+                return
+            except FileNotFoundError:
+                # Deleted since, written again
+                pass
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Written aside and renamed, so that a blob is never read partially
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, digest: str) -> bytes:
+        try:
+            with open(self.path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise BlobNotFound(digest) from None
+
+    def delete(self, digest: str, older_than: float | None = None) -> bool:
+        path = self.path(digest)
+        if older_than is None:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return False
+            return True
+
+        # Moved aside before its age is checked: a concurrent `put` either
+        # touched it before, and it is restored, or writes it again
+        aside = f"{path}.{uuid.uuid4().hex}.deleted"
+        try:
+            os.replace(path, aside)
+        except FileNotFoundError:
+            return False
+        if os.path.getmtime(aside) >= older_than:
+            os.replace(aside, path)
+            return False
+        os.remove(aside)
+        return True
+
+    def list(self) -> Iterator[tuple[str, float]]:
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if len(filename) != 64:
+                    continue
+                try:
+                    mtime = os.path.getmtime(os.path.join(directory, filename))
+                except FileNotFoundError:
+                    continue
+                yield filename, mtime
+
+
+def create_blob_store(kind: str, directory: str) -> BlobStore:
+    if kind == "file":
+        return FileSystemBlobStore(directory)
+    raise ValueError(f"Unknown blob store: {kind}")
+
+
+def reference_blobs(db: Session, blobs: dict[str, dict[str, Any]]) -> None:
+    """
+    Count the new references to each blob, `{hash: {"size", "mime_type",
+    "count"}}`, creating the rows of the new ones. Not committed.
+    """
+    now = utcnow()
+    rows = [
+        {
+            "hash": digest,
+            "size": blob["size"],
+            "mime_type": blob["mime_type"],
+            "refcount": blob["count"],
+            "creationdate": now,
+            "updatedate": now,
+        }
+        # In the same order in every transaction, so that they do not deadlock
+        for digest, blob in sorted(blobs.items())
+    ]
+    dialect = db.get_bind().dialect.name
+    if dialect in UPSERTS:
+        # The rows stay locked until committed, so a concurrent garbage
+        # collection cannot delete them in between
+        statement = UPSERTS[dialect](models.BlobORM).values(rows)
+        db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[models.BlobORM.hash],
+                set_={
+                    "refcount": models.BlobORM.refcount
+                    + statement.excluded.refcount,
+                    "updatedate": statement.excluded.updatedate,
+                },
+            )
+        )
+        return
+
+    for row in rows:
+        updated = cast(
+            CursorResult[Any],
+            db.execute(
+                update(models.BlobORM)
+                .where(models.BlobORM.hash == row["hash"])
+                .values(
+                    refcount=models.BlobORM.refcount + row["refcount"],
+                    updatedate=now,
+                )
+                .execution_options(synchronize_session=False)
+            ),
+        )
+        if updated.rowcount == 0:
+            db.execute(insert(models.BlobORM).values(row))
+
+
+def blob_fields(
+    images: list[bytes],
+) -> tuple[list[dict[str, Any]], dict[str, dict[str, Any]]]:
+    """
+    The `blob_hash`, `size` and `mime_type` of the `ImageORM` rows of images,
+    and the new references to each blob for `reference_blobs`.
+    """
+    fields = [
+        {
+            "blob_hash": blob_hash(data),
+            "size": len(data),
+            "mime_type": mime_type(data),
+        }
+        for data in images
+    ]
+    return fields, count_references(fields)
+
+
+def count_references(
+    fields: list[dict[str, Any]],
+) -> dict[str, dict[str, Any]]:
+    """
+    The new references to each blob of `ImageORM` rows, for
+    `reference_blobs`.
+    """
+    counts = Counter(field["blob_hash"] for field in fields)
+    return {
+        field["blob_hash"]: {
+            "size": field["size"],
+            "mime_type": field["mime_type"],
+            "count": counts[field["blob_hash"]],
+        }
+        for field in fields
+    }
+
+
+def write_blobs(
+    store: BlobStore, fields: list[dict[str, Any]], images: list[bytes]
+) -> None:
+    written = set()
+    for field, data in zip(fields, images):
+        if field["blob_hash"] not in written:
+            store.put(field["blob_hash"], data)
+            written.add(field["blob_hash"])
+
+
+def store_blobs(
+    db: Session, store: BlobStore, images: list[bytes]
+) -> list[dict[str, Any]]:
+    """
+    Store images, and return the `blob_hash`, `size` and `mime_type` of
+    their `ImageORM` rows. The references are counted in the transaction of
+    the caller: if it rolls back, the blobs written are collected later.
+    """
+    fields, blobs = blob_fields(images)
+    reference_blobs(db, blobs)
+    write_blobs(store, fields, images)
+    return fields
+
+
+async def save_blobs(
+    db: AsyncSession, store: BlobStore, images: list[bytes]
+) -> list[dict[str, Any]]:
+    """
+    `store_blobs` for the API, writing the blobs off the event loop.
+    """
+    fields, blobs = blob_fields(images)
+    await db.run_sync(reference_blobs, blobs)
+    await asyncio.to_thread(write_blobs, store, fields, images)
+    return fields
+
+
+async def put_blobs(
+    store: BlobStore, images: list[bytes]
+) -> list[dict[str, Any]]:
+    """
+    Write the blobs of images off the event loop, and return the fields of
+    their `ImageORM` rows, whose references are counted later by the caller.
+    Until then, a blob is only spared by the garbage collection for its
+    grace period, even if its row is unreferenced and deleted: the reference
+    creates the row again.
+    """
+    fields, _ = blob_fields(images)
+    await asyncio.to_thread(write_blobs, store, fields, images)
+    return fields
+
+
+async def save_blob(
+    db: AsyncSession, store: BlobStore, data: bytes
+) -> dict[str, Any]:
+    return (await save_blobs(db, store, [data]))[0]
+
+
+def release_blob(db: Session, digest: str) -> None:
+    """
+    Drop a reference to a blob. Not committed.
+    """
+    db.execute(
+        update(models.BlobORM)
+        .where(models.BlobORM.hash == digest)
+        .values(refcount=models.BlobORM.refcount - 1, updatedate=utcnow())
+        .execution_options(synchronize_session=False)
+    )
+
+
+def collect_garbage(
+    db: Session,
+    store: BlobStore,
+    grace_seconds: float = 3600.0,
+    batch_size: int = 500,
+) -> dict[str, int]:
+    """
+    Delete the blobs without references for `grace_seconds`, and the files
+    written by transactions that rolled back.
+    """
+    cutoff = utcnow() - timedelta(seconds=grace_seconds)
+    cutoff_time = time.time() - grace_seconds
+    unreferenced = 0
+    while True:
+        digests = db.scalars(
+            select(models.BlobORM.hash)
+            .where(
+                models.BlobORM.refcount <= 0,
+                models.BlobORM.updatedate < cutoff,
+            )
+            .limit(batch_size)
+        ).all()
+        if not digests:
+            break
+        for digest in digests:
+            # Referenced again since selected
+            deleted = cast(
+                CursorResult[Any],
+                db.execute(
+                    delete(models.BlobORM).where(
+                        models.BlobORM.hash == digest,
+                        models.BlobORM.refcount <= 0,
+                    )
+                ),
+            )
+            if deleted.rowcount:
+                # Before the commit, while a new reference waits on the row.
+                # The file of a row written behind is touched instead, and
+                # spared for the grace period
+                store.delete(digest, older_than=cutoff_time)
+                unreferenced += 1
+        db.commit()
+
+    orphans = 0
+    candidates = [
+        digest for digest, mtime in store.list() if mtime < cutoff_time
+    ]
+    for start in range(0, len(candidates), batch_size):
+        end = start + batch_size
+        batch = candidates[start:end]
+        known = set(
+            db.scalars(
+                select(models.BlobORM.hash).where(
+                    models.BlobORM.hash.in_(batch)
+                )
+            )
+        )
+        for digest in batch:
+            # Unless touched by a writer since listed
+            if digest not in known and store.delete(
+                digest, older_than=cutoff_time
+            ):
+                orphans += 1
+    db.rollback()
+    return {"unreferenced": unreferenced, "orphans": orphans}
@@ -38,10 +38,149 @@ class CNNSettings:
         "LABEL_PATH",
         default=os.path.join("core", "ml", "imagenet_classes.txt"),
     )
+    MODELS: str | None = config("MODELS", default=None)
+    DEFAULT_MODEL: str | None = config("DEFAULT_MODEL", default=None)
+    MODEL_MEMORY_BUDGET_MB: int | None = config(
+        "MODEL_MEMORY_BUDGET_MB", cast=int, default=None
+    )
+    MODEL_RELOAD_INTERVAL: float = config("MODEL_RELOAD_INTERVAL", default=10.0)
+    INFERENCE_BACKEND: str = config("INFERENCE_BACKEND", default="torch")
+    INFERENCE_ENGINE: str = config("INFERENCE_ENGINE", default="eager")
+    CHANNELS_LAST: bool = config("CHANNELS_LAST", default=False)
+    ENGINE_CACHE_DIR: str = config(
+        "ENGINE_CACHE_DIR",
+        default=os.path.join("core", "ml", "engine_cache"),
+    )
+    QUANTIZATION_BACKEND: str | None = config(
+        "QUANTIZATION_BACKEND", default=None
+    )
+    CALIBRATION_DIR: str | None = config("CALIBRATION_DIR", default=None)
+    # The approximate uint8 preprocessing and JPEG draft decoding, instead of
+    # the reference torchvision pipeline
+    FAST_PREPROCESSING: bool = config("FAST_PREPROCESSING", default=False)
+    JPEG_DRAFT_DECODE: bool = config("JPEG_DRAFT_DECODE", default=False)
+    BATCH_MAX_SIZE: int = config("BATCH_MAX_SIZE", default=8)
+    BATCH_MAX_WAIT_MS: float = config("BATCH_MAX_WAIT_MS", default=5.0)
+    ADMISSION_MAX_QUEUE_DEPTH: int = config(
+        "ADMISSION_MAX_QUEUE_DEPTH", default=64
+    )
+    ADMISSION_MAX_QUEUE_MS: float = config(
+        "ADMISSION_MAX_QUEUE_MS", default=5000.0
+    )
+    WARMUP_BATCH_SIZES: str | None = config("WARMUP_BATCH_SIZES", default=None)
+    WARMUP_PASSES: int = config("WARMUP_PASSES", default=1)
+    INFERENCE_EXECUTOR: str = config("INFERENCE_EXECUTOR", default="thread")
+    INFERENCE_WORKERS: int = config("INFERENCE_WORKERS", default=1)
+    INFERENCE_THREADS_PER_WORKER: int | None = config(
+        "INFERENCE_THREADS_PER_WORKER", cast=int, default=None
+    )
+    PREDICTION_CACHE_SIZE: int = config("PREDICTION_CACHE_SIZE", default=1024)
+    PREDICTION_CACHE_SHARED: bool = config(
+        "PREDICTION_CACHE_SHARED", default=False
+    )
+    NEAR_DUPLICATE_REUSE: bool = config("NEAR_DUPLICATE_REUSE", default=False)
+    NEAR_DUPLICATE_MAX_DISTANCE: int = config(
+        "NEAR_DUPLICATE_MAX_DISTANCE", default=4
+    )
+    NEAR_DUPLICATE_INDEX_SIZE: int = config(
+        "NEAR_DUPLICATE_INDEX_SIZE", default=100_000
+    )
+    EMBEDDINGS: bool = config("EMBEDDINGS", default=True)
+    EMBEDDING_INDEX_DIR: str | None = config(
+        "EMBEDDING_INDEX_DIR", default=None
+    )
+    EMBEDDING_INDEX_MAX_USERS: int = config(
+        "EMBEDDING_INDEX_MAX_USERS", default=256
+    )
+    EMBEDDING_IVF_THRESHOLD: int = config(
+        "EMBEDDING_IVF_THRESHOLD", default=20_000
+    )
+    EMBEDDING_IVF_NPROBE: int = config("EMBEDDING_IVF_NPROBE", default=8)
+
+
+class UploadSettings(BaseSettings):
+    MAX_IMAGES_PER_BATCH: int = config("MAX_IMAGES_PER_BATCH", default=256)
+    MAX_UPLOAD_BYTES: int = config("MAX_UPLOAD_BYTES", default=20 * 2**20)
+    MAX_BATCH_UPLOAD_BYTES: int = config(
+        "MAX_BATCH_UPLOAD_BYTES", default=200 * 2**20
+    )
+    MAX_IMAGE_PIXELS: int = config("MAX_IMAGE_PIXELS", default=40_000_000)
+
+
+class QuotaSettings(BaseSettings):
+    QUOTA_IMAGES_PER_MINUTE: float | None = config(
+        "QUOTA_IMAGES_PER_MINUTE", cast=float, default=None
+    )
+    QUOTA_BURST: int = config("QUOTA_BURST", default=256)
+    USER_MAX_CONCURRENCY: int = config("USER_MAX_CONCURRENCY", default=4)
+    USER_INFERENCE_WEIGHT: float = config("USER_INFERENCE_WEIGHT", default=1.0)
+    QUOTA_FLUSH_INTERVAL: float = config("QUOTA_FLUSH_INTERVAL", default=30.0)
+
+
+class JobSettings(BaseSettings):
+    JOB_WORKERS: int = config("JOB_WORKERS", default=1)
+    JOB_POLL_INTERVAL: float = config("JOB_POLL_INTERVAL", default=1.0)
+    JOB_LEASE_SECONDS: float = config("JOB_LEASE_SECONDS", default=60.0)
+    JOB_MAX_ATTEMPTS: int = config("JOB_MAX_ATTEMPTS", default=3)
+    JOB_MAX_WAIT: float = config("JOB_MAX_WAIT", default=30.0)
+
+
+class ServingSettings(BaseSettings):
+    SERVING_WORKERS: int = config("SERVING_WORKERS", default=1)
+    SERVING_INTEROP_THREADS: int = config("SERVING_INTEROP_THREADS", default=1)
+    SERVING_CPU_AFFINITY: bool = config("SERVING_CPU_AFFINITY", default=False)
+
+
+class BlobSettings(BaseSettings):
+    BLOB_STORE: str = config("BLOB_STORE", default="file")
+    BLOB_STORE_DIR: str = config("BLOB_STORE_DIR", default="blobs")
+    BLOB_GC_INTERVAL: float = config("BLOB_GC_INTERVAL", default=3600.0)
+    BLOB_GC_GRACE_SECONDS: float = config(
+        "BLOB_GC_GRACE_SECONDS", default=3600.0
+    )
+
+
+class MetricsSettings(BaseSettings):
+    METRICS_DIR: str | None = config("METRICS_DIR", default=None)
+    METRICS_FLUSH_INTERVAL: float = config(
+        "METRICS_FLUSH_INTERVAL", default=5.0
+    )
+    SERVER_TIMING: bool = config("SERVER_TIMING", default=True)
+    SLOW_REQUEST_MS: float = config("SLOW_REQUEST_MS", default=1000.0)
+    SLOW_REQUEST_BUFFER_SIZE: int = config(
+        "SLOW_REQUEST_BUFFER_SIZE", default=256
+    )
+    PROFILE_MAX_SECONDS: float = config("PROFILE_MAX_SECONDS", default=60.0)
+    PROFILE_SAMPLE_INTERVAL_MS: float = config(
+        "PROFILE_SAMPLE_INTERVAL_MS", default=5.0
+    )
 
 
 class DatabaseSettings(BaseSettings):
-    pass
+    # Connections of the async engine of each serving worker
+    DATABASE_POOL_SIZE: int = config("DATABASE_POOL_SIZE", default=5)
+    DATABASE_MAX_OVERFLOW: int = config("DATABASE_MAX_OVERFLOW", default=10)
+    DATABASE_POOL_TIMEOUT: float = config("DATABASE_POOL_TIMEOUT", default=30.0)
+    DATABASE_POOL_RECYCLE: int = config("DATABASE_POOL_RECYCLE", default=1800)
+    DATABASE_POOL_PRE_PING: bool = config(
+        "DATABASE_POOL_PRE_PING", default=True
+    )
+    # Images of a page of the history
+    HISTORY_MAX_LIMIT: int = config("HISTORY_MAX_LIMIT", default=100)
+    # Write the classification results after responding, in batches
+    WRITE_BEHIND: bool = config("WRITE_BEHIND", default=False)
+    WRITE_BEHIND_MAX_QUEUE: int = config(
+        "WRITE_BEHIND_MAX_QUEUE", default=10000
+    )
+    WRITE_BEHIND_BATCH_SIZE: int = config(
+        "WRITE_BEHIND_BATCH_SIZE", default=500
+    )
+    WRITE_BEHIND_INTERVAL_MS: float = config(
+        "WRITE_BEHIND_INTERVAL_MS", default=200.0
+    )
+    WRITE_BEHIND_MAX_WAIT_MS: float = config(
+        "WRITE_BEHIND_MAX_WAIT_MS", default=1000.0
+    )
 
 
 class PostgresSettings(DatabaseSettings):
@@ -78,6 +217,12 @@ class EnvironmentSettings(BaseSettings):
 class Settings(
     AppSettings,
     CNNSettings,
+    UploadSettings,
+    QuotaSettings,
+    JobSettings,
+    ServingSettings,
+    BlobSettings,
+    MetricsSettings,
     PostgresSettings,
     CryptSettings,
     EnvironmentSettings,
@@ -0,0 +1,236 @@
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, cast
+
+from sqlalchemy import CursorResult, and_, or_, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import ColumnElement
+
+import app.models as models
+from app.schemas.schemas import JobStatus
+
+FINISHED = (JobStatus.Succeeded, JobStatus.Failed)
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """
+    Classification jobs queued in the database, shared by the workers of
+    every serving process and node.
+
+    A worker claims the oldest queued job with `SELECT ... FOR UPDATE SKIP
+    LOCKED`, so concurrent workers never claim the same job, and holds it for
+    `lease_seconds`, renewed while it works on it. The job of a worker that
+    crashed is claimed again once its lease expired, up to `max_attempts`
+    times. A claim is identified by the worker and the attempt: a worker
+    whose lease expired anyway cannot change the job once it is claimed
+    again.
+    """
+
+    def __init__(
+        self,
+        worker_id: str | None = None,
+        lease_seconds: float = 60.0,
+        max_attempts: int = 3,
+    ):
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self._lease = timedelta(seconds=lease_seconds)
+        self._max_attempts = max_attempts
+        # Wake the workers and long polls of this process without waiting for
+        # their next poll
+        self._submitted = asyncio.Event()
+        self._finished = asyncio.Event()
+
+    def submit(
+        self,
+        db: Session,
+        user_id: int,
+        filename: str,
+        image_data: bytes,
+        model: str | None = None,
+    ) -> models.JobORM:
+        job = models.JobORM(
+            public_id=uuid.uuid4().hex,
+            user_id=user_id,
+            filename=filename,
+            image_data=image_data,
+            model=model,
+            status=JobStatus.Queued,
+            attempts=0,
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        self._submitted.set()
+        return job
+
+    def get(
+        self, db: Session, public_id: str, user_id: int
+    ) -> models.JobORM | None:
+        return db.execute(
+            select(models.JobORM)
+            .where(
+                models.JobORM.public_id == public_id,
+                models.JobORM.user_id == user_id,
+            )
+            .execution_options(populate_existing=True)
+        ).scalar_one_or_none()
+
+    def claim(self, db: Session) -> models.JobORM | None:
+        """
+        Claim the oldest job that is queued, or whose lease expired.
+        """
+        while True:
+            now = utcnow()
+            job = db.execute(
+                select(models.JobORM)
+                .where(
+                    or_(
+                        models.JobORM.status == JobStatus.Queued,
+                        and_(
+                            models.JobORM.status == JobStatus.Running,
+                            models.JobORM.lease_expires_at < now,
+                        ),
+                    )
+                )
+                .order_by(models.JobORM.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            ).scalar_one_or_none()
+            if job is None:
+                db.commit()
+                return None
+
+            if job.attempts >= self._max_attempts:
+                # Its workers kept crashing, e.g. out of memory
+                self._finish(
+                    db,
+                    models.JobORM.id == job.id,
+                    JobStatus.Failed,
+                    error="The job was interrupted too many times.",
+                )
+                continue
+
+            job.status = JobStatus.Running
+            job.attempts += 1
+            job.claimed_by = self.worker_id
+            job.lease_expires_at = now + self._lease
+            db.commit()
+            return job
+
+    def _held(self, job_id: int, attempt: int) -> ColumnElement[bool]:
+        """
+        Whether the job is still claimed by this worker for `attempt`.
+        """
+        return and_(
+            models.JobORM.id == job_id,
+            models.JobORM.status == JobStatus.Running,
+            models.JobORM.claimed_by == self.worker_id,
+            models.JobORM.attempts == attempt,
+        )
+
+    def renew(self, db: Session, job_id: int, attempt: int) -> bool:
+        """
+        Extend the lease of a claimed job, unless it was claimed again.
+        """
+        updated = cast(
+            CursorResult[Any],
+            db.execute(
+                update(models.JobORM)
+                .where(self._held(job_id, attempt))
+                .values(lease_expires_at=utcnow() + self._lease)
+            ),
+        )
+        db.commit()
+        return bool(updated.rowcount)
+
+    def release(self, db: Session, job_id: int, attempt: int) -> None:
+        """
+        Queue a claimed job again, without counting the attempt.
+        """
+        db.execute(
+            update(models.JobORM)
+            .where(self._held(job_id, attempt))
+            .values(
+                status=JobStatus.Queued,
+                attempts=models.JobORM.attempts - 1,
+                claimed_by=None,
+                lease_expires_at=None,
+            )
+        )
+        db.commit()
+
+    def complete(
+        self, db: Session, job_id: int, attempt: int, result: dict[str, Any]
+    ) -> bool:
+        """
+        Store the results of a claimed job with the pending changes of `db`,
+        or roll them back and return False if the job was claimed again.
+        """
+        return self._finish(
+            db, self._held(job_id, attempt), JobStatus.Succeeded, result=result
+        )
+
+    def fail(self, db: Session, job_id: int, attempt: int, error: str) -> bool:
+        return self._finish(
+            db, self._held(job_id, attempt), JobStatus.Failed, error=error
+        )
+
+    def _finish(
+        self,
+        db: Session,
+        condition: ColumnElement[bool],
+        status: JobStatus,
+        result: dict[str, Any] | None = None,
+        error: str | None = None,
+    ) -> bool:
+        updated = cast(
+            CursorResult[Any],
+            db.execute(
+                update(models.JobORM)
+                .where(condition)
+                .values(
+                    status=status,
+                    result=result,
+                    error=error,
+                    image_data=None,
+                    lease_expires_at=None,
+                    finishdate=utcnow(),
+                )
+            ),
+        )
+        if not updated.rowcount:
+            db.rollback()
+            return False
+        db.commit()
+        self._finished.set()
+        self._finished = asyncio.Event()
+        return True
+
+    async def wait_for_submission(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self._submitted.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._submitted.clear()
+
+    async def wait_for_completion(self, timeout: float) -> None:
+        """
+        Wait until a job of this process finished, or the timeout elapsed for
+        the jobs finished by other processes.
+        """
+        try:
+            await asyncio.wait_for(self._finished.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
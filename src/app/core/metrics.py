@@ -0,0 +1,295 @@
+import json
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from app.core.config import settings
+from app.core.tracing import current_trace
+
+# Seconds, from a cached prediction to a slow batch of large images
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+SeriesKey = tuple[str, tuple[str, ...]]
+
+
+class Histogram:
+    """
+    Histogram of durations in seconds, by label values.
+
+    The series of each thread are kept in its own shard of the registry, and
+    only summed when collected: observing takes no lock.
+    """
+
+    def __init__(
+        self,
+        registry: "MetricsRegistry",
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...],
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels: str) -> None:
+        shard = self._registry.shard()
+        key = (self.name, labels)
+        series = shard.get(key)
+        if series is None:
+            # The count of each bucket and of +Inf, then the sum
+            series = shard[key] = [0.0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+
+def _merge(
+    merged: dict[SeriesKey, list[float]], key: SeriesKey, series: list[float]
+) -> None:
+    if key in merged:
+        merged[key] = [a + b for a, b in zip(merged[key], series)]
+    else:
+        merged[key] = list(series)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_float(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    """
+    The histograms of this process, rendered in the Prometheus text format.
+
+    With a `directory`, each process writes its series there with `flush`,
+    and `collect` adds up the series of every process that wrote there, so
+    that the scrape of any gunicorn worker reports the whole server. The
+    series of a stopped worker are kept, so the counters never decrease.
+    """
+
+    def __init__(self, directory: str | None = None):
+        self.directory = directory
+        self._metrics: dict[str, Histogram] = {}
+        self._shards: list[dict[SeriesKey, list[float]]] = []
+        self._local = threading.local()
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...],
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        histogram = Histogram(self, name, documentation, labelnames, buckets)
+        self._metrics[name] = histogram
+        return histogram
+
+    def shard(self) -> dict[SeriesKey, list[float]]:
+        try:
+            shard: dict[SeriesKey, list[float]] = self._local.shard
+            return shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            self._shards.append(shard)
+            return shard
+
+    def snapshot(self) -> dict[SeriesKey, list[float]]:
+        """
+        The series of this process.
+        """
+        merged: dict[SeriesKey, list[float]] = {}
+        for shard in list(self._shards):
+            for key, series in list(shard.items()):
+                _merge(merged, key, series)
+        return merged
+
+    def flush(self) -> None:
+        """
+        Write the series of this process for the other workers to collect.
+        """
+        if self.directory is None:
+            return
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(
+                [
+                    [name, list(labels), series]
+                    for (name, labels), series in self.snapshot().items()
+                ],
+                f,
+            )
+        os.replace(f"{path}.tmp", path)
+
+    def clear(self) -> None:
+        """
+        Remove the series flushed by previous processes.
+        """
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".json"):
+                os.remove(os.path.join(self.directory, filename))
+
+    def collect(self) -> dict[SeriesKey, list[float]]:
+        """
+        The series of this process, and of the other processes as of their
+        last flush.
+        """
+        merged = self.snapshot()
+        if self.directory is None:
+            return merged
+
+        own = f"{os.getpid()}.json"
+        for filename in os.listdir(self.directory):
+            if filename == own or not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    series_list = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, labels, series in series_list:
+                if name in self._metrics:
+                    _merge(merged, (name, tuple(labels)), series)
+        return merged
+
+    def render(self) -> str:
+        collected = self.collect()
+        lines = []
+        for name, histogram in self._metrics.items():
+            lines.append(f"# HELP {name} {histogram.documentation}")
+            lines.append(f"# TYPE {name} histogram")
+            for (series_name, labels), series in sorted(collected.items()):
+                if series_name != name:
+                    continue
+                label_pairs = [
+                    f'{label}="{_escape(value)}"'
+                    for label, value in zip(histogram.labelnames, labels)
+                ]
+                count = 0.0
+                for bound, bucket_count in zip(
+                    (*histogram.buckets, math.inf), series
+                ):
+                    count += bucket_count
+                    bucket_labels = ",".join(
+                        [*label_pairs, f'le="{_format_float(bound)}"']
+                    )
+                    lines.append(
+                        f"{name}_bucket{{{bucket_labels}}} {count:.0f}"
+                    )
+                series_labels = ",".join(label_pairs)
+                lines.append(
+                    f"{name}_sum{{{series_labels}}} {_format_float(series[-1])}"
+                )
+                lines.append(f"{name}_count{{{series_labels}}} {count:.0f}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry(settings.METRICS_DIR)
+
+REQUEST_SECONDS = registry.histogram(
+    "imagevision_request_duration_seconds",
+    "Duration of the HTTP requests, by route.",
+    ("method", "route", "status"),
+)
+STAGE_SECONDS = registry.histogram(
+    "imagevision_stage_duration_seconds",
+    "Duration of the stages of the classification and authentication.",
+    ("stage",),
+)
+WRITE_BEHIND_SECONDS = registry.histogram(
+    "imagevision_write_behind_duration_seconds",
+    "Write-behind persistence: duration of the flushes, and delay from the "
+    "queueing of a result to its commit.",
+    ("phase",),
+)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """
+    Record a stage in `STAGE_SECONDS` and in the trace of the request.
+    """
+    STAGE_SECONDS.observe(seconds, stage)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def time_stage(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing the HTTP requests by route template, so that the
+    paths with ids do not each get their own series.
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message: Any) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                scope["method"],
+                route.path if route is not None else "unmatched",
+                str(status_code),
+            )
@@ -0,0 +1,104 @@
+import math
+import time
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    """
+    The inference path is saturated, the request can be retried after
+    `retry_after` seconds.
+    """
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class AdmissionController:
+    """
+    Bound the number of inferences waiting or running on this node.
+
+    An inference is rejected when `max_queue_depth` are already admitted, or
+    when the estimated wait exceeds `max_queue_ms`. The wait is estimated from
+    the depth and the mean interval between the last `window` completions,
+    which come in bursts when the inferences are batched.
+    """
+
+    def __init__(
+        self,
+        max_queue_depth: int = 64,
+        max_queue_ms: float = 5000.0,
+        saturation_ratio: float = 0.8,
+        window: int = 64,
+    ):
+        self._max_queue_depth = max_queue_depth
+        self._max_queue_time = max_queue_ms / 1000
+        self._saturation_ratio = saturation_ratio
+        # Seconds between completions, i.e. the inverse of the throughput
+        self._intervals: deque[float] = deque(maxlen=window)
+        self._last_completion = 0.0
+        self.depth = 0
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "queue_time": 0, "timed_out": 0}
+
+    @property
+    def max_queue_time(self) -> float:
+        return self._max_queue_time
+
+    def estimated_wait(self, depth: int | None = None) -> float:
+        if not self._intervals:
+            return 0.0
+        completion_interval = sum(self._intervals) / len(self._intervals)
+        return (self.depth if depth is None else depth) * completion_interval
+
+    @property
+    def saturated(self) -> bool:
+        """
+        Close to rejecting, so that the load balancer routes away from this
+        node in time.
+        """
+        return (
+            self.depth >= self._saturation_ratio * self._max_queue_depth
+            or self.estimated_wait()
+            >= self._saturation_ratio * self._max_queue_time
+        )
+
+    def stats(self) -> dict[str, int | float | bool]:
+        return {
+            "depth": self.depth,
+            "max_queue_depth": self._max_queue_depth,
+            "estimated_wait_ms": round(self.estimated_wait() * 1000, 1),
+            "max_queue_ms": self._max_queue_time * 1000,
+            "saturated": self.saturated,
+            "admitted": self.admitted,
+            **{f"rejected_{reason}": n for reason, n in self.rejected.items()},
+        }
+
+    def reject(self, reason: str) -> Overloaded:
+        self.rejected[reason] += 1
+        return Overloaded(reason, self.estimated_wait())
+
+    @contextmanager
+    def admit(self) -> Iterator[None]:
+        if self.depth >= self._max_queue_depth:
+            raise self.reject("queue_full")
+        if self.estimated_wait(self.depth + 1) > self._max_queue_time:
+            raise self.reject("queue_time")
+
+        self.depth += 1
+        self.admitted += 1
+        admitted_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            self._complete(admitted_at)
+
+    def _complete(self, admitted_at: float) -> None:
+        now = time.monotonic()
+        # When the node was idle, the interval is the service time
+        self._intervals.append(now - max(self._last_completion, admitted_at))
+        self._last_completion = now
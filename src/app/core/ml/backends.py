@@ -0,0 +1,320 @@
+import hashlib
+import os
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from typing import Any
+
+import torch
+from torchvision import models
+
+from app.core.ml.engine import build_engine
+from app.core.ml.quantization import load_or_quantize
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+ARCHITECTURES = ("mobilenet_v3_large", "mobilenet_v3_small")
+
+
+def build_model(architecture="mobilenet_v3_large"):
+    if architecture not in ARCHITECTURES:
+        raise ValueError(f"Unknown model architecture: {architecture}")
+    return getattr(models, architecture)()
+
+
+class WithEmbeddings(torch.nn.Module):
+    """
+    MobileNetV3 returning the logits and the pooled features of its last
+    convolution, which the classifier head maps to the logits.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        # Same submodule names, so that the state dicts are interchangeable
+        self.features = model.features
+        self.avgpool = model.avgpool
+        self.classifier = model.classifier
+
+    def forward(self, x):
+        embeddings = torch.flatten(self.avgpool(self.features(x)), 1)
+        return self.classifier(embeddings), embeddings
+
+
+def load_model(model_path, architecture="mobilenet_v3_large"):
+    """
+    Build the model on the meta device, skipping the random initialization,
+    and assign it the weights memory-mapped from `model_path`.
+    """
+    with torch.device("meta"):
+        model = WithEmbeddings(build_model(architecture))
+    state_dict = torch.load(model_path, mmap=True, weights_only=True)
+    model.load_state_dict(state_dict, assign=True)
+    return model.eval()
+
+
+class InferenceBackend(ABC):
+    """
+    Runs the forward pass of the classification model.
+
+    `load` reads the weights, `forward_with_embeddings` maps a batch of
+    preprocessed images `(N, 3, 224, 224)` to the logits `(N, num_classes)`
+    and the pooled embeddings `(N, embedding_size)`.
+    """
+
+    # Suffix of the cached artifacts, whose graphs also output the embeddings
+    artifact_suffix = "embeddings"
+
+    name = ""
+
+    def __init__(
+        self, model_path, cache_dir=None, architecture="mobilenet_v3_large"
+    ):
+        self._model_path = model_path
+        self._cache_dir = cache_dir
+        self._architecture = architecture
+        self._version = None
+        # Duration of the loading stages, in seconds
+        self.load_timings = {}
+
+    @property
+    def version(self):
+        """
+        Identifies the weights, and how they are run when it changes outputs.
+        """
+        return self._version
+
+    @property
+    def metadata(self):
+        return {
+            "backend": self.name,
+            "architecture": self._architecture,
+            "version": self._version,
+        }
+
+    @property
+    def memory_bytes(self):
+        """
+        Memory held by the model, estimated by the size of its weights.
+        """
+        return os.path.getsize(self._model_path)
+
+    def _hash_weights(self):
+        try:
+            return file_sha256(self._model_path)[:16]
+        except FileNotFoundError:
+            raise ValueError(f"Model file not found: {self._model_path}")
+
+    @abstractmethod
+    def load(self):
+        pass
+
+    @abstractmethod
+    def forward_with_embeddings(self, batch):
+        pass
+
+    def forward(self, batch):
+        return self.forward_with_embeddings(batch)[0]
+
+    def warmup(self, batch_sizes=(1,), repeat=1):
+        """
+        Run forward passes on dummy batches, so that kernels and allocator
+        pools are ready before the first request.
+        """
+        for batch_size in batch_sizes:
+            for _ in range(repeat):
+                self.forward(torch.zeros(batch_size, 3, 224, 224))
+
+
+class TorchBackend(InferenceBackend):
+    """
+    torchvision MobileNetV3 run by PyTorch, eagerly, compiled or in INT8.
+    """
+
+    name = "torch"
+
+    def __init__(
+        self,
+        model_path,
+        cache_dir=None,
+        architecture="mobilenet_v3_large",
+        device=None,
+        engine="eager",
+        channels_last=False,
+        quantization=None,
+        calibration_dir=None,
+        preprocessor=None,
+    ):
+        super().__init__(model_path, cache_dir, architecture)
+        self._device = (
+            device
+            if device
+            else ("cuda" if torch.cuda.is_available() else "cpu")
+        )
+        self._engine = engine
+        self._channels_last = channels_last
+        self._quantization = quantization
+        self._calibration_dir = calibration_dir
+        self._preprocessor = preprocessor
+        self._model: Callable[..., Any] | None = None
+
+    @property
+    def metadata(self):
+        return {
+            **super().metadata,
+            "device": self._device,
+            "engine": "int8" if self._quantization else self._engine,
+            "channels_last": self._channels_last,
+        }
+
+    def load(self):
+        start = time.perf_counter()
+        weights_hash = self._hash_weights()
+        model = load_model(self._model_path, self._architecture).to(
+            self._device
+        )
+        self.load_timings["weights"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if self._quantization:
+            if self._device != "cpu":
+                raise ValueError("INT8 quantization is only supported on CPU")
+            self._channels_last = False
+            self._model = load_or_quantize(
+                model,
+                self._preprocessor,
+                f"{weights_hash}-{self.artifact_suffix}",
+                backend=self._quantization,
+                calibration_dir=self._calibration_dir,
+                cache_dir=self._cache_dir,
+            )
+            self._version = f"{weights_hash}-int8-{self._quantization}"
+        else:
+            self._model = build_engine(
+                model,
+                engine=self._engine,
+                weights_hash=f"{weights_hash}-{self.artifact_suffix}",
+                cache_dir=self._cache_dir,
+                channels_last=self._channels_last,
+                example_input=torch.rand(1, 3, 224, 224, device=self._device),
+            )
+            self._version = weights_hash
+        self.load_timings["engine"] = time.perf_counter() - start
+
+    def forward_with_embeddings(self, batch):
+        if self._model is None:
+            raise RuntimeError("The backend is not loaded")
+        batch = batch.to(self._device)
+        if self._channels_last:
+            batch = batch.to(memory_format=torch.channels_last)
+
+        with torch.no_grad():
+            return self._model(batch)
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """
+    MobileNetV3 exported to ONNX and run by ONNX Runtime on the CPU.
+
+    The exported graph is cached in `cache_dir`, keyed by the weights hash.
+    Requires the `onnx` extra.
+    """
+
+    name = "onnxruntime"
+
+    def __init__(
+        self,
+        model_path,
+        cache_dir=None,
+        architecture="mobilenet_v3_large",
+        intra_op_threads=None,
+    ):
+        super().__init__(model_path, cache_dir, architecture)
+        self._intra_op_threads = intra_op_threads
+        self._session: Any = None
+
+    @property
+    def metadata(self):
+        return {
+            **super().metadata,
+            "device": "cpu",
+            "intra_op_threads": self._intra_op_threads,
+        }
+
+    def _export(self, path):
+        model = load_model(self._model_path, self._architecture)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.onnx.export(
+            model,
+            (torch.rand(1, 3, 224, 224),),
+            tmp_path,
+            input_names=["input"],
+            output_names=["logits", "embeddings"],
+            dynamic_axes={
+                "input": {0: "batch"},
+                "logits": {0: "batch"},
+                "embeddings": {0: "batch"},
+            },
+        )
+        os.replace(tmp_path, path)
+
+    def load(self):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ValueError(
+                "The onnxruntime backend requires the onnxruntime package"
+            )
+
+        start = time.perf_counter()
+        weights_hash = self._hash_weights()
+        cache_dir = self._cache_dir or os.path.dirname(self._model_path)
+        path = os.path.join(
+            cache_dir, f"{weights_hash}-{self.artifact_suffix}.onnx"
+        )
+        if not os.path.exists(path):
+            self._export(path)
+        self.load_timings["export"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        if self._intra_op_threads:
+            options.intra_op_num_threads = self._intra_op_threads
+        options.inter_op_num_threads = 1
+        self._session = onnxruntime.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+        self._version = weights_hash
+        self.load_timings["session"] = time.perf_counter() - start
+
+    def forward_with_embeddings(self, batch):
+        if self._session is None:
+            raise RuntimeError("The backend is not loaded")
+        logits, embeddings = self._session.run(
+            ["logits", "embeddings"], {"input": batch.cpu().numpy()}
+        )
+        return torch.from_numpy(logits), torch.from_numpy(embeddings)
+
+
+BACKENDS = {
+    TorchBackend.name: TorchBackend,
+    OnnxRuntimeBackend.name: OnnxRuntimeBackend,
+}
+
+
+def create_backend(name, model_path, **options):
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown inference backend: {name}")
+    return backend_class(model_path, **options)
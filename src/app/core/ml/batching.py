@@ -0,0 +1,177 @@
+import asyncio
+from collections.abc import Callable, Hashable, Sequence
+from concurrent.futures import Executor
+from typing import Any
+
+import torch
+
+from app.core.metrics import STAGE_SECONDS
+from app.core.ml.fairness import FairQueue
+from app.core.tracing import RequestTrace, current_trace
+
+
+class QueueTimeout(Exception):
+    """
+    The tensor waited longer than the maximum queueing time.
+    """
+
+
+class BatchScheduler:
+    """
+    Collect preprocessed tensors from concurrent requests and run them through
+    `predict_fn` as one stacked forward pass.
+
+    A batch is dispatched as soon as `max_batch_size` tensors are queued or
+    `max_wait_ms` has elapsed since the first tensor of the batch arrived.
+    `predict_fn` receives a `(N, C, H, W)` tensor and must return a sequence of
+    N results, which are handed back to the waiting requests in order.
+
+    Tensors that waited more than `max_queue_ms` when their batch is
+    dispatched are shed with `QueueTimeout` instead of being run.
+
+    The queue is shared fairly between the `flow`s given to `submit`, e.g.
+    the users, in proportion to their weight: a flow with many queued tensors
+    does not delay the tensors of the other flows.
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable[[torch.Tensor], Sequence[Any]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+        executor: Executor | None = None,
+        max_queue_ms: float | None = None,
+    ):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+
+        self._predict_fn = predict_fn
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000
+        self._executor = executor
+        self._max_queue_time = (
+            max_queue_ms / 1000 if max_queue_ms is not None else None
+        )
+        self._queue: FairQueue
+        self._worker: asyncio.Task[None] | None = None
+        self._closed = False
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._queue = FairQueue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def submit(
+        self,
+        tensor: torch.Tensor,
+        flow: Hashable = None,
+        weight: float = 1.0,
+    ) -> Any:
+        if self._closed:
+            raise RuntimeError("BatchScheduler is closed")
+        self.start()
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put_nowait(
+            (
+                flow,
+                weight,
+                (tensor, future, loop.time(), current_trace.get()),
+            )
+        )
+        return await future
+
+    async def close(self) -> None:
+        """
+        Stop accepting new tensors and wait for the in-flight batches to drain.
+        """
+        self._closed = True
+        if self._worker is None:
+            return
+
+        await self._queue.join()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [(await self._queue.get())[2]]
+            deadline = loop.time() + self._max_wait
+            while len(batch) < self._max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait()[2])
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(
+                        (await asyncio.wait_for(self._queue.get(), timeout))[2]
+                    )
+                except asyncio.TimeoutError:
+                    break
+
+            await self._process(batch)
+
+    async def _process(
+        self,
+        batch: list[
+            tuple[torch.Tensor, asyncio.Future[Any], float, RequestTrace | None]
+        ],
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        # Requests whose client went away are dropped from the forward pass
+        pending = []
+        traces = []
+        for tensor, future, enqueued_at, trace in batch:
+            if future.done():
+                continue
+            queue_time = loop.time() - enqueued_at
+            STAGE_SECONDS.observe(queue_time, "batch_queue")
+            if trace is not None:
+                trace.add("batch_queue", queue_time)
+            if (
+                self._max_queue_time is not None
+                and queue_time > self._max_queue_time
+            ):
+                future.set_exception(QueueTimeout())
+                continue
+            pending.append((tensor, future))
+            if trace is not None:
+                traces.append((trace, queue_time))
+        try:
+            if not pending:
+                return
+            tensors = torch.stack([tensor for tensor, _ in pending])
+            start = loop.time()
+            results = await loop.run_in_executor(
+                self._executor, self._predict_fn, tensors
+            )
+            forward_time = loop.time() - start
+            STAGE_SECONDS.observe(forward_time, "forward")
+            for trace, queue_time in traces:
+                trace.add("forward", forward_time)
+                trace.inferences.append(
+                    {
+                        "batch_size": len(pending),
+                        "queue_ms": round(queue_time * 1000, 2),
+                        "forward_ms": round(forward_time * 1000, 2),
+                    }
+                )
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(pending, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from typing import NamedTuple
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import app.models as models
+
+
+class Prediction(NamedTuple):
+    width: int
+    height: int
+    label: str
+    probability: float | None
+    reused: bool = False
+    # L2-normalized float16 embedding of the image
+    embedding: bytes | None = None
+
+
+class PredictionCache:
+    """
+    Content-addressed cache of predictions, keyed by the SHA-256 of the
+    uploaded bytes and the version of the model weights.
+
+    The first tier is a bounded in-process LRU, the optional second tier is
+    the `prediction_cache` table, shared by every worker using the database
+    through the sessions of `session_factory`: the inference of an image can
+    outlive the request that started it, so it does not use its session.
+    Concurrent lookups of the same image wait on a single in-flight inference.
+    """
+
+    def __init__(
+        self,
+        model_version: str,
+        max_size: int = 1024,
+        session_factory: Callable[[], AsyncSession] | None = None,
+    ):
+        self._model_version = model_version
+        self._max_size = max_size
+        self._session_factory = session_factory
+        self._entries: OrderedDict[str, Prediction] = OrderedDict()
+        self._in_flight: dict[str, asyncio.Future[Prediction]] = {}
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @property
+    def model_version(self) -> str:
+        return self._model_version
+
+    @staticmethod
+    def image_hash(image_data: bytes) -> str:
+        return hashlib.sha256(image_data).hexdigest()
+
+    def stats(self) -> dict[str, int | str]:
+        return {
+            "model_version": self._model_version,
+            "size": len(self._entries),
+            "max_size": self._max_size,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+    def invalidate(self, model_version: str | None = None) -> None:
+        """
+        Drop the in-process entries, e.g. when the model weights change.
+        Shared entries of other versions are no longer matched.
+        """
+        if model_version is not None:
+            self._model_version = model_version
+        self._entries.clear()
+        self._in_flight.clear()
+
+    def purge_stale(self, db: Session) -> None:
+        """
+        Delete the shared entries computed by other versions of the model.
+        """
+        db.query(models.PredictionCacheORM).filter(
+            models.PredictionCacheORM.model_version != self._model_version
+        ).delete()
+        db.commit()
+
+    async def get_or_compute(
+        self,
+        image_data: bytes,
+        compute: Callable[[], Awaitable[Prediction]],
+    ) -> Prediction:
+        image_hash = self.image_hash(image_data)
+
+        prediction = self._get(image_hash)
+        if prediction is not None:
+            self.hits += 1
+            return prediction
+
+        if image_hash in self._in_flight:
+            self.coalesced += 1
+        else:
+            # The inference runs in its own task, so that a disconnecting
+            # client does not cancel it for the requests coalesced on it
+            task = asyncio.ensure_future(self._compute(image_hash, compute))
+            task.add_done_callback(self._discard_in_flight)
+            self._in_flight[image_hash] = task
+        return await asyncio.shield(self._in_flight[image_hash])
+
+    async def _compute(
+        self,
+        image_hash: str,
+        compute: Callable[[], Awaitable[Prediction]],
+    ) -> Prediction:
+        model_version = self._model_version
+        prediction = await self._get_shared(image_hash)
+        if prediction is not None:
+            self.shared_hits += 1
+        else:
+            self.misses += 1
+            prediction = await compute()
+            await self._put_shared(image_hash, prediction)
+        if model_version == self._model_version:
+            self._put(image_hash, prediction)
+        return prediction
+
+    def _discard_in_flight(self, task: asyncio.Future[Prediction]) -> None:
+        for image_hash, in_flight in list(self._in_flight.items()):
+            if in_flight is task:
+                del self._in_flight[image_hash]
+        if not task.cancelled():
+            # Retrieve the exception even if every waiter went away
+            task.exception()
+
+    def _get(self, image_hash: str) -> Prediction | None:
+        prediction = self._entries.get(image_hash)
+        if prediction is not None:
+            self._entries.move_to_end(image_hash)
+        return prediction
+
+    def _put(self, image_hash: str, prediction: Prediction) -> None:
+        if self._max_size <= 0:
+            return
+        self._entries[image_hash] = prediction
+        self._entries.move_to_end(image_hash)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    async def _get_shared(self, image_hash: str) -> Prediction | None:
+        if self._session_factory is None:
+            return None
+
+        async with self._session_factory() as db:
+            row = await db.get(
+                models.PredictionCacheORM, (image_hash, self._model_version)
+            )
+        if row is None:
+            return None
+        return Prediction(
+            width=row.width,
+            height=row.height,
+            label=row.label,
+            probability=(
+                float(row.probability) if row.probability is not None else None
+            ),
+            embedding=row.embedding,
+        )
+
+    async def _put_shared(
+        self, image_hash: str, prediction: Prediction
+    ) -> None:
+        if self._session_factory is None:
+            return
+
+        async with self._session_factory() as db:
+            try:
+                db.add(
+                    models.PredictionCacheORM(
+                        image_hash=image_hash,
+                        model_version=self._model_version,
+                        width=prediction.width,
+                        height=prediction.height,
+                        label=prediction.label,
+                        probability=prediction.probability,
+                        embedding=prediction.embedding,
+                    )
+                )
+                await db.commit()
+            except SQLAlchemyError:
+                # Another worker stored the same prediction first
+                await db.rollback()
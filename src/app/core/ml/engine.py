@@ -0,0 +1,116 @@
+import functools
+import os
+import tempfile
+from collections.abc import Callable
+from typing import Any
+
+import torch
+
+ENGINES = ("eager", "torchscript", "compile")
+
+
+def artifact_path(cache_dir, weights_hash, channels_last=False):
+    """
+    Path of the frozen TorchScript artifact of the given weights.
+
+    The torch version is part of the key, since serialized graphs are only
+    guaranteed to load with the version that produced them.
+    """
+    memory_format = "channels_last" if channels_last else "contiguous"
+    filename = (
+        f"{weights_hash}-torch{torch.__version__.replace('+', '_')}"
+        f"-{memory_format}.pt"
+    )
+    return os.path.join(cache_dir, filename)
+
+
+def _freeze(model, example_input):
+    with torch.no_grad():
+        return torch.jit.freeze(torch.jit.trace(model, example_input))
+
+
+def save_atomically(module, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        torch.jit.save(module, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def build_engine(
+    model,
+    engine="eager",
+    weights_hash=None,
+    cache_dir=None,
+    channels_last=False,
+    example_input=None,
+    atol=1e-4,
+):
+    """
+    Wrap an eval-mode `model` into the selected inference engine.
+
+    - "eager": the module itself.
+    - "torchscript": traced, frozen and optimized for inference. The frozen
+      graph is cached in `cache_dir`, keyed by `weights_hash` and the torch
+      version, so that restarts skip tracing.
+    - "compile": `torch.compile`, whose kernels are cached by inductor in
+      `cache_dir`.
+
+    The engine outputs are checked against eager within `atol`.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown inference engine: {engine}")
+
+    model.eval()
+    if example_input is None:
+        example_input = torch.rand(1, 3, 224, 224)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+        example_input = example_input.to(memory_format=torch.channels_last)
+
+    if engine == "eager":
+        return model
+
+    compiled: Callable[..., Any]
+    if engine == "torchscript":
+        path = (
+            artifact_path(cache_dir, weights_hash, channels_last)
+            if cache_dir and weights_hash
+            else None
+        )
+        if path and os.path.exists(path):
+            frozen = torch.jit.load(path)
+        else:
+            frozen = _freeze(model, example_input)
+            if path:
+                save_atomically(frozen, path)
+        compiled = torch.jit.optimize_for_inference(frozen)
+    else:
+        if cache_dir:
+            os.environ.setdefault(
+                "TORCHINDUCTOR_CACHE_DIR", os.path.join(cache_dir, "inductor")
+            )
+        compiled = torch.compile(model)
+
+    with torch.no_grad():
+        expected = _outputs(model(example_input))
+        actual = _outputs(compiled(example_input))
+    if not all(
+        map(functools.partial(torch.allclose, atol=atol), actual, expected)
+    ):
+        difference = max(
+            (a - e).abs().max().item() for a, e in zip(actual, expected)
+        )
+        raise ValueError(
+            f"The {engine} engine outputs differ from eager by "
+            f"{difference:.2e}"
+        )
+    return compiled
+
+
+def _outputs(output):
+    return output if isinstance(output, tuple) else (output,)
@@ -0,0 +1,160 @@
+import io
+import multiprocessing
+import os
+import time
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any
+
+import torch
+from PIL import Image
+
+from app.core import profiling
+from app.core.ml.phash import dhash
+from app.core.ml.registry import ModelKey
+
+# Classifiers owned by a process pool worker by model name, None in the
+# serving process
+_worker_classifiers: dict[str, Any] | None = None
+_worker_classifier_factory: Callable[[Any], Any] | None = None
+
+
+def default_num_threads(max_workers: int) -> int:
+    """
+    Split the CPU cores evenly between the inference workers.
+    """
+    return max(1, (os.cpu_count() or 1) // max_workers)
+
+
+def _init_thread_worker(num_threads: int) -> None:
+    torch.set_num_threads(num_threads)
+
+
+def _init_process_worker(
+    num_threads: int, classifier_factory: Callable[[Any], Any]
+) -> None:
+    global _worker_classifiers, _worker_classifier_factory
+    torch.set_num_threads(num_threads)
+    _worker_classifiers = {}
+    _worker_classifier_factory = classifier_factory
+
+
+def current_classifier(model: ModelKey | None = None) -> Any:
+    """
+    The classifier of the `model` version, or of the default model.
+    """
+    if _worker_classifiers is None or _worker_classifier_factory is None:
+        from app.core.setup import ml_models
+
+        return ml_models["model_registry"].classifier(model)
+
+    if model is None:
+        raise ValueError("Process workers need the key of the model")
+    # Workers keep the latest version of each model they were asked for
+    classifier = _worker_classifiers.get(model.spec.name)
+    if classifier is None or classifier.version != model.version:
+        classifier = _worker_classifier_factory(model.spec)
+        _worker_classifiers[model.spec.name] = classifier
+    return classifier
+
+
+def decode_and_preprocess(
+    image_data: bytes,
+    perceptual_hash: bool = False,
+    model: ModelKey | None = None,
+) -> tuple[tuple[int, int], Any, int | None, dict[str, float]]:
+    """
+    The size, input tensor and perceptual hash of the image, with the seconds
+    spent in each stage, which process workers cannot record themselves.
+    """
+    classifier = current_classifier(model)
+    start = time.perf_counter()
+    image = Image.open(io.BytesIO(image_data))
+    # Read before decoding, which may decode a reduced JPEG draft
+    size = image.size
+    classifier.decode(image)
+    decoded = time.perf_counter()
+    input_tensor = classifier.preprocess(image)
+    preprocessed = time.perf_counter()
+    timings = {"decode": decoded - start, "preprocess": preprocessed - decoded}
+    image_hash = None
+    if perceptual_hash:
+        image_hash = dhash(image)
+        timings["perceptual_hash"] = time.perf_counter() - preprocessed
+    return size, input_tensor, image_hash, timings
+
+
+def predict_category_batch(
+    batch: torch.Tensor, model: ModelKey | None = None
+) -> list[Any]:
+    return list(current_classifier(model).predict_category_batch(batch))
+
+
+def classify_batch(
+    batch: torch.Tensor,
+    model: ModelKey | None = None,
+    embeddings: bool = False,
+) -> list[tuple[str, float | None, bytes | None]]:
+    """
+    The category, probability and, if `embeddings`, the embedding of each
+    image of the batch.
+    """
+    capture = profiling.active
+    if isinstance(capture, profiling.TorchCapture):
+        return capture.profile(_classify_batch, batch, model, embeddings)
+    return _classify_batch(batch, model, embeddings)
+
+
+def _classify_batch(
+    batch: torch.Tensor, model: ModelKey | None, embeddings: bool
+) -> list[tuple[str, float | None, bytes | None]]:
+    classifier = current_classifier(model)
+    if embeddings:
+        return list(classifier.predict_category_embedding_batch(batch))
+    return [
+        (category, prob, None)
+        for category, prob in classifier.predict_category_batch(batch)
+    ]
+
+
+def warmup(
+    batch_sizes: tuple[int, ...], repeat: int, model: ModelKey | None = None
+) -> None:
+    current_classifier(model).warmup(batch_sizes, repeat)
+
+
+def create_inference_executor(
+    kind: str = "thread",
+    max_workers: int = 1,
+    num_threads: int | None = None,
+    classifier_factory: Callable[[Any], Any] | None = None,
+) -> Executor:
+    """
+    Create the executor running the decode -> preprocess -> forward path.
+
+    Thread workers share the classifiers of the serving process, since torch
+    releases the GIL during the forward pass. Process workers build their own
+    classifier of each model spec with `classifier_factory`, which must be
+    picklable. Each worker
+    gets a budget of `num_threads` torch intra-op threads.
+    """
+    if num_threads is None:
+        num_threads = default_num_threads(max_workers)
+
+    if kind == "thread":
+        return ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="inference",
+            initializer=_init_thread_worker,
+            initargs=(num_threads,),
+        )
+    if kind == "process":
+        if classifier_factory is None:
+            raise ValueError("A process executor requires a classifier_factory")
+        return ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process_worker,
+            initargs=(num_threads, classifier_factory),
+        )
+    raise ValueError(f"Unknown inference executor: {kind}")
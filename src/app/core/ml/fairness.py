@@ -0,0 +1,87 @@
+import asyncio
+from collections import deque
+from collections.abc import Hashable
+from typing import Any
+
+
+class DeficitRoundRobin:
+    """
+    Per-flow FIFO queues served by deficit round-robin.
+
+    Every visit of a flow adds its weight to its deficit, and each item served
+    costs 1, so that a flow with weight 2 gets twice the items of a flow with
+    weight 1 while both are backlogged, whatever their arrival order.
+    """
+
+    def __init__(self) -> None:
+        self._flows: dict[Hashable, deque[Any]] = {}
+        self._weights: dict[Hashable, float] = {}
+        self._deficits: dict[Hashable, float] = {}
+        # Backlogged flows, in the order they are visited
+        self._active: deque[Hashable] = deque()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, flow: Hashable, weight: float, item: Any) -> None:
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        if flow not in self._flows:
+            self._flows[flow] = deque()
+            self._deficits[flow] = 0.0
+            self._active.append(flow)
+        self._flows[flow].append(item)
+        self._weights[flow] = weight
+        self._size += 1
+
+    def popleft(self) -> tuple[Hashable, float, Any]:
+        if not self._size:
+            raise IndexError("pop from an empty queue")
+        while True:
+            flow = self._active[0]
+            if self._deficits[flow] < 1:
+                self._deficits[flow] += self._weights[flow]
+            if self._deficits[flow] < 1:
+                # Weights under 1 accumulate over several rounds
+                self._active.rotate(-1)
+                continue
+
+            self._deficits[flow] -= 1
+            self._size -= 1
+            item = self._flows[flow].popleft()
+            weight = self._weights[flow]
+            if not self._flows[flow]:
+                # An idle flow does not keep its deficit
+                self._active.popleft()
+                del self._flows[flow]
+                del self._weights[flow]
+                del self._deficits[flow]
+            elif self._deficits[flow] < 1:
+                self._active.rotate(-1)
+            return flow, weight, item
+
+    def backlog(self) -> dict[Hashable, int]:
+        return {flow: len(items) for flow, items in self._flows.items()}
+
+
+class FairQueue(asyncio.Queue[tuple[Hashable, float, Any]]):
+    """
+    `asyncio.Queue` of `(flow, weight, item)` tuples, handed out fairly
+    between the flows instead of in arrival order.
+    """
+
+    def _init(self, maxsize: int) -> None:
+        self._queue = DeficitRoundRobin()
+
+    def _put(self, item: tuple[Hashable, float, Any]) -> None:
+        self._queue.append(*item)
+
+    def _get(self) -> tuple[Hashable, float, Any]:
+        return self._queue.popleft()
+
+    def backlog(self) -> dict[Hashable, int]:
+        """
+        Number of queued items of each flow.
+        """
+        return self._queue.backlog()
@@ -0,0 +1,119 @@
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Any
+
+import numpy as np
+from PIL import Image
+
+HASH_BITS = 64
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """
+    Difference hash: one bit per pair of horizontally adjacent pixels of a
+    `(hash_size + 1) x hash_size` grayscale thumbnail, set when the left pixel
+    is brighter. Robust to re-encoding, resizing and small crops.
+    """
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    thumbnail = image.resize(
+        (hash_size + 1, hash_size),
+        Image.Resampling.BILINEAR,
+        reducing_gap=2.0,
+    ).convert("L")
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+
+    value = 0
+    for bit in (pixels[:, :-1] > pixels[:, 1:]).flat:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class NearDuplicateIndex:
+    """
+    Multi-index hash of perceptual hashes for Hamming-distance lookups.
+
+    The hashes are split into `max_distance + 1` bands: by the pigeonhole
+    principle, two hashes within `max_distance` of each other agree exactly on
+    at least one band, so only the entries sharing a band are compared. The
+    oldest entries are evicted past `max_size`.
+
+    The entries of each owner, e.g. a user, are only matched by its own
+    searches.
+    """
+
+    def __init__(self, max_distance: int = 4, max_size: int = 100_000):
+        if not 0 <= max_distance < HASH_BITS:
+            raise ValueError(f"max_distance must be in [0, {HASH_BITS})")
+
+        self._max_distance = max_distance
+        self._max_size = max_size
+        num_bands = max_distance + 1
+        bounds = [i * HASH_BITS // num_bands for i in range(num_bands + 1)]
+        # (shift, mask) of each band
+        self._bands = [
+            (start, (1 << (end - start)) - 1)
+            for start, end in zip(bounds, bounds[1:])
+        ]
+        self._buckets: list[dict[tuple[Hashable, int], set[int]]] = [
+            {} for _ in self._bands
+        ]
+        self._entries: OrderedDict[tuple[Hashable, int], Any] = OrderedDict()
+        self.reused = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _band_keys(self, value: int) -> list[int]:
+        return [(value >> shift) & mask for shift, mask in self._bands]
+
+    def add(self, value: int, item: Any, owner: Hashable = None) -> None:
+        entry = (owner, value)
+        if entry in self._entries:
+            self._entries[entry] = item
+            self._entries.move_to_end(entry)
+            return
+
+        self._entries[entry] = item
+        for buckets, key in zip(self._buckets, self._band_keys(value)):
+            buckets.setdefault((owner, key), set()).add(value)
+
+        while len(self._entries) > self._max_size:
+            self._remove(*next(iter(self._entries)))
+
+    def _remove(self, owner: Hashable, value: int) -> None:
+        del self._entries[(owner, value)]
+        for buckets, key in zip(self._buckets, self._band_keys(value)):
+            bucket = buckets[(owner, key)]
+            bucket.discard(value)
+            if not bucket:
+                del buckets[(owner, key)]
+
+    def search(
+        self, value: int, owner: Hashable = None
+    ) -> tuple[int, Any] | None:
+        """
+        Return the (distance, item) of the nearest entry of `owner` within
+        `max_distance`, or None.
+        """
+        best: tuple[int, int] | None = None
+        for buckets, key in zip(self._buckets, self._band_keys(value)):
+            for candidate in buckets.get((owner, key), ()):
+                distance = hamming_distance(value, candidate)
+                if distance <= self._max_distance and (
+                    best is None or distance < best[0]
+                ):
+                    best = (distance, candidate)
+
+        if best is None:
+            return None
+        return best[0], self._entries[(owner, best[1])]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        for buckets in self._buckets:
+            buckets.clear()
@@ -0,0 +1,182 @@
+import argparse
+import copy
+import os
+import sys
+
+import torch
+from PIL import Image
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+from app.core.ml.engine import save_atomically
+
+BACKENDS = ("x86", "qnnpack")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def list_images(image_dir, limit=None):
+    try:
+        filenames = sorted(
+            filename
+            for filename in os.listdir(image_dir)
+            if filename.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    except FileNotFoundError:
+        raise ValueError(f"Image directory not found: {image_dir}")
+
+    if not filenames:
+        raise ValueError(f"No images found in: {image_dir}")
+    return [os.path.join(image_dir, filename) for filename in filenames][:limit]
+
+
+def load_batches(image_paths, preprocessor, batch_size=16):
+    for start in range(0, len(image_paths), batch_size):
+        end = start + batch_size
+        yield torch.stack(
+            [preprocessor(Image.open(path)) for path in image_paths[start:end]]
+        )
+
+
+def quantized_artifact_path(cache_dir, weights_hash, backend):
+    filename = (
+        f"{weights_hash}-int8-{backend}"
+        f"-torch{torch.__version__.replace('+', '_')}.pt"
+    )
+    return os.path.join(cache_dir, filename)
+
+
+def quantize_model(model, calibration_batches, backend="x86"):
+    """
+    Post-training static INT8 quantization of `model` in FX graph mode,
+    calibrated on the given batches of preprocessed images.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown quantization backend: {backend}")
+
+    torch.backends.quantized.engine = backend
+    example_input = torch.rand(1, 3, 224, 224)
+    prepared = prepare_fx(
+        copy.deepcopy(model).eval(),
+        get_default_qconfig_mapping(backend),
+        (example_input,),
+    )
+    with torch.no_grad():
+        for batch in calibration_batches:
+            prepared(batch)
+        quantized = convert_fx(prepared)
+        return torch.jit.freeze(torch.jit.trace(quantized, example_input))
+
+
+def load_or_quantize(
+    model,
+    preprocessor,
+    weights_hash,
+    backend="x86",
+    calibration_dir=None,
+    cache_dir=None,
+    calibration_size=256,
+):
+    """
+    Load the persisted INT8 model of these weights, or calibrate it on the
+    images of `calibration_dir` and persist it in `cache_dir`.
+    """
+    path = (
+        quantized_artifact_path(cache_dir, weights_hash, backend)
+        if cache_dir
+        else None
+    )
+    if path and os.path.exists(path):
+        torch.backends.quantized.engine = backend
+        return torch.jit.load(path)
+
+    if calibration_dir is None:
+        raise ValueError("INT8 quantization requires a calibration directory")
+    calibration_batches = load_batches(
+        list_images(calibration_dir, calibration_size), preprocessor
+    )
+    quantized = quantize_model(model, calibration_batches, backend)
+    if path:
+        save_atomically(quantized, path)
+    return quantized
+
+
+def compare_classifiers(reference, candidate, image_paths, batch_size=16):
+    """
+    Agreement of `candidate` with `reference` on held-out images: top-1
+    labels, `predict_category` results (including the "Unknown" rule) and
+    the ratio of "Unknown" categories of each classifier.
+    """
+    top1_agreement = category_agreement = 0
+    reference_unknown = candidate_unknown = 0
+    for batch in load_batches(image_paths, reference.preprocess, batch_size):
+        reference_top1 = reference.top_k_batch(batch, 1)
+        candidate_top1 = candidate.top_k_batch(batch, 1)
+        top1_agreement += sum(
+            ref[0][0] == cand[0][0]
+            for ref, cand in zip(reference_top1, candidate_top1)
+        )
+
+        reference_categories = reference.predict_category_batch(batch)
+        candidate_categories = candidate.predict_category_batch(batch)
+        category_agreement += sum(
+            ref[0] == cand[0]
+            for ref, cand in zip(reference_categories, candidate_categories)
+        )
+        reference_unknown += sum(
+            category == "Unknown" for category, _ in reference_categories
+        )
+        candidate_unknown += sum(
+            category == "Unknown" for category, _ in candidate_categories
+        )
+
+    num_images = len(image_paths)
+    return {
+        "images": num_images,
+        "top1_agreement": round(top1_agreement / num_images, 4),
+        "category_agreement": round(category_agreement / num_images, 4),
+        "reference_unknown_ratio": round(reference_unknown / num_images, 4),
+        "candidate_unknown_ratio": round(candidate_unknown / num_images, 4),
+    }
+
+
+def main():  # pragma: no cover
+    from app.core.ml.cnn_model import ImageClassifier
+
+    parser = argparse.ArgumentParser(
+        description="Calibrate the INT8 model and check its accuracy "
+        "regression against fp32 on a held-out set."
+    )
+    parser.add_argument("model_path")
+    parser.add_argument("label_path")
+    parser.add_argument("--calibration-dir", required=True)
+    parser.add_argument("--holdout-dir", required=True)
+    parser.add_argument("--cache-dir", required=True)
+    parser.add_argument("--backend", default="x86", choices=BACKENDS)
+    parser.add_argument("--min-top1-agreement", type=float, default=0.95)
+    parser.add_argument("--min-category-agreement", type=float, default=0.95)
+    args = parser.parse_args()
+
+    reference = ImageClassifier(args.model_path, args.label_path, device="cpu")
+    candidate = ImageClassifier(
+        args.model_path,
+        args.label_path,
+        device="cpu",
+        quantization=args.backend,
+        calibration_dir=args.calibration_dir,
+        cache_dir=args.cache_dir,
+    )
+    report = compare_classifiers(
+        reference, candidate, list_images(args.holdout_dir)
+    )
+    for name, value in report.items():
+        print(f"{name}: {value}")
+
+    if (
+        report["top1_agreement"] < args.min_top1_agreement
+        or report["category_agreement"] < args.min_category_agreement
+    ):
+        sys.exit("INT8 accuracy regression above the allowed threshold")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,284 @@
+import asyncio
+import os
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from typing import Any, NamedTuple
+
+from app.core.ml.backends import ARCHITECTURES
+from app.core.ml.batching import BatchScheduler
+from app.core.ml.cache import PredictionCache
+from app.core.ml.cnn_model import ImageClassifier
+from app.core.ml.phash import NearDuplicateIndex
+
+
+class ModelSpec(NamedTuple):
+    name: str
+    architecture: str
+    model_path: str
+
+
+class ModelKey(NamedTuple):
+    """
+    Identifies a loaded version of a model, also in process pool workers.
+    """
+
+    spec: ModelSpec
+    version: str
+
+
+def parse_model_specs(value: str, base_dir: str = "") -> list[ModelSpec]:
+    """
+    Parse `name=architecture:path` entries separated by commas, e.g.
+    `small=mobilenet_v3_small:core/ml/small.pth`. Relative paths are resolved
+    against `base_dir`.
+    """
+    specs = []
+    for entry in filter(None, (entry.strip() for entry in value.split(","))):
+        name, _, target = entry.partition("=")
+        architecture, _, model_path = target.partition(":")
+        if not name or not model_path:
+            raise ValueError(f"Invalid model entry: {entry}")
+        if architecture not in ARCHITECTURES:
+            raise ValueError(f"Unknown model architecture: {architecture}")
+        specs.append(
+            ModelSpec(
+                name.strip(),
+                architecture.strip(),
+                os.path.join(base_dir, model_path.strip()),
+            )
+        )
+    if not specs:
+        raise ValueError("No model configured")
+    return specs
+
+
+def create_classifier(spec: ModelSpec, **options: Any) -> ImageClassifier:
+    return ImageClassifier(
+        spec.model_path, architecture=spec.architecture, **options
+    )
+
+
+class ServedModel:
+    """
+    A loaded version of a model, with the batch scheduler, prediction cache
+    and near-duplicate index serving it.
+    """
+
+    def __init__(
+        self,
+        spec: ModelSpec,
+        classifier: Any,
+        batch_scheduler: BatchScheduler,
+        prediction_cache: PredictionCache,
+        near_duplicate_index: NearDuplicateIndex | None = None,
+        mtime: float | None = None,
+    ):
+        self.spec = spec
+        self.classifier = classifier
+        self.key = ModelKey(spec, classifier.version)
+        self.batch_scheduler = batch_scheduler
+        self.prediction_cache = prediction_cache
+        self.near_duplicate_index = near_duplicate_index
+        self.mtime = mtime
+        self.in_flight = 0
+
+    @property
+    def name(self) -> str:
+        return self.spec.name
+
+    @property
+    def version(self) -> str:
+        return self.key.version
+
+    @property
+    def memory_bytes(self) -> int:
+        return int(self.classifier.memory_bytes)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "architecture": self.spec.architecture,
+            "version": self.version,
+            "memory_bytes": self.memory_bytes,
+            "in_flight": self.in_flight,
+        }
+
+    async def close(self) -> None:
+        await self.batch_scheduler.close()
+
+
+class ModelRegistry:
+    """
+    Models served under a name, loaded on first use with `load_fn`, which
+    runs off the event loop.
+
+    Requests hold the model version they started with for their whole
+    lifetime: when the weights are reloaded or the model is evicted, the old
+    version keeps serving its in-flight requests and is closed after them.
+    When the loaded models exceed `memory_budget` bytes, the least recently
+    used ones are evicted, except the default model.
+    """
+
+    def __init__(
+        self,
+        specs: list[ModelSpec],
+        load_fn: Callable[[ModelSpec], ServedModel],
+        default: str | None = None,
+        memory_budget: int | None = None,
+    ):
+        self._specs = {spec.name: spec for spec in specs}
+        self.default = default or specs[0].name
+        if self.default not in self._specs:
+            raise ValueError(f"Unknown default model: {self.default}")
+        self._load_fn = load_fn
+        self._memory_budget = memory_budget
+        self._models: OrderedDict[str, ServedModel] = OrderedDict()
+        self._draining: list[ServedModel] = []
+        self._loading: dict[str, asyncio.Future[ServedModel]] = {}
+        self.loads = 0
+        self.reloads = 0
+        self.evictions = 0
+
+    @property
+    def names(self) -> list[str]:
+        return list(self._specs)
+
+    def get(self, name: str | None = None) -> ServedModel | None:
+        """
+        The current version of a loaded model, without loading it.
+        """
+        return self._models.get(name or self.default)
+
+    def add(self, served: ServedModel) -> None:
+        self._models[served.name] = served
+
+    def classifier(self, key: ModelKey | None = None) -> Any:
+        """
+        The classifier of a loaded or draining model version, or of the
+        default model.
+        """
+        if key is None:
+            return self._models[self.default].classifier
+        for served in [*self._models.values(), *self._draining]:
+            if served.key == key:
+                return served.classifier
+        raise ValueError(f"Model version not loaded: {key.version}")
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "default": self.default,
+            "available": self.names,
+            "loaded": [served.stats() for served in self._models.values()],
+            "draining": [served.stats() for served in self._draining],
+            "memory_budget": self._memory_budget,
+            "loads": self.loads,
+            "reloads": self.reloads,
+            "evictions": self.evictions,
+        }
+
+    @asynccontextmanager
+    async def acquire(
+        self, name: str | None = None
+    ) -> AsyncIterator[ServedModel]:
+        """
+        Hold the current version of a model, loading it if needed.
+        """
+        name = name or self.default
+        if name not in self._specs:
+            raise ValueError(f"Unknown model: {name}")
+
+        served = self._models.get(name)
+        if served is None:
+            served = await self._load(name)
+        else:
+            self._models.move_to_end(name)
+
+        served.in_flight += 1
+        try:
+            yield served
+        finally:
+            served.in_flight -= 1
+            if served.in_flight == 0 and served in self._draining:
+                self._draining.remove(served)
+                await served.close()
+
+    async def _load(self, name: str) -> ServedModel:
+        # Concurrent requests for a model being loaded wait for the same load
+        if name not in self._loading:
+            self._loading[name] = asyncio.ensure_future(
+                asyncio.to_thread(self._load_fn, self._specs[name])
+            )
+        try:
+            served = await asyncio.shield(self._loading[name])
+        finally:
+            self._loading.pop(name, None)
+
+        if name not in self._models:
+            self.loads += 1
+            self._models[name] = served
+            await self._evict()
+        return self._models[name]
+
+    async def _evict(self) -> None:
+        if self._memory_budget is None:
+            return
+        while (
+            sum(served.memory_bytes for served in self._models.values())
+            > self._memory_budget
+        ):
+            # The most recently used model is the one just loaded
+            candidates = [
+                name for name in list(self._models)[:-1] if name != self.default
+            ]
+            if not candidates:
+                break
+            self.evictions += 1
+            await self._retire(self._models.pop(candidates[0]))
+
+    async def _retire(self, served: ServedModel) -> None:
+        if served.in_flight:
+            self._draining.append(served)
+        else:
+            await served.close()
+
+    async def reload(self, name: str) -> bool:
+        """
+        Load the weights of a loaded model from disk again, and swap them in
+        if they changed.
+        """
+        current = self._models.get(name)
+        if current is None:
+            return False
+
+        served = await asyncio.to_thread(self._load_fn, self._specs[name])
+        if served.key == current.key:
+            current.mtime = served.mtime
+            await served.close()
+            return False
+
+        self.reloads += 1
+        if self._models.get(name) is current:
+            self._models[name] = served
+            await self._retire(current)
+        return True
+
+    async def check_for_updates(self) -> list[str]:
+        """
+        Reload the loaded models whose weights file was modified.
+        """
+        reloaded = []
+        for name, served in list(self._models.items()):
+            try:
+                mtime = os.path.getmtime(served.spec.model_path)
+            except OSError:
+                continue
+            if mtime != served.mtime and await self.reload(name):
+                reloaded.append(name)
+        return reloaded
+
+    async def close(self) -> None:
+        for served in [*self._models.values(), *self._draining]:
+            await served.close()
+        self._models.clear()
+        self._draining.clear()
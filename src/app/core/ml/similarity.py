@@ -0,0 +1,524 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable, Sequence
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.elements import ColumnElement
+
+import app.models as models
+
+EMBEDDING_DTYPE = np.float16
+# Vectors the k-means of the lists and subspaces are trained on
+TRAINING_SAMPLE_SIZE = 16_384
+# Rows read from the memory-mapped matrix at once
+CHUNK_SIZE = 8192
+
+
+def kmeans(
+    x: np.ndarray, k: int, iterations: int = 10, seed: int = 0
+) -> np.ndarray:
+    """
+    Lloyd's k-means of the rows of `x`, returning the `(k, dim)` centroids.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = nearest(x, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, x)
+        counts = np.bincount(assignments, minlength=k)
+        # Empty clusters keep their centroid
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def nearest(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmin |x - c|^2 = argmax x.c - |c|^2 / 2
+    scores = x @ centroids.T - 0.5 * (centroids**2).sum(axis=1)
+    return np.asarray(scores.argmax(axis=1))
+
+
+class ProductQuantizer:
+    """
+    Encode vectors as one byte per subspace: the index of the nearest of 256
+    centroids trained on that slice of the dimensions.
+    """
+
+    def __init__(self, dim: int, num_subspaces: int = 16):
+        while dim % num_subspaces:
+            num_subspaces -= 1
+        self.num_subspaces = num_subspaces
+        self._subspace_dim = dim // num_subspaces
+        self._codebooks: np.ndarray | None = None
+
+    def _split(self, x: np.ndarray) -> np.ndarray:
+        return x.reshape(len(x), self.num_subspaces, self._subspace_dim)
+
+    @property
+    def codebooks(self) -> np.ndarray:
+        if self._codebooks is None:
+            raise RuntimeError("The quantizer is not trained")
+        return self._codebooks
+
+    def train(self, x: np.ndarray) -> None:
+        num_centroids = min(256, len(x))
+        self._codebooks = np.stack(
+            [
+                kmeans(subspace, num_centroids)
+                for subspace in self._split(x).transpose(1, 0, 2)
+            ]
+        )
+
+    def encode(self, x: np.ndarray) -> np.ndarray:
+        return np.stack(
+            [
+                nearest(subspace, codebook)
+                for subspace, codebook in zip(
+                    self._split(x).transpose(1, 0, 2), self.codebooks
+                )
+            ],
+            axis=1,
+        ).astype(np.uint8)
+
+    def distances(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """
+        Squared distances from `query` to the encoded vectors, summed from a
+        lookup table of the distances to the centroids of each subspace.
+        """
+        table = (
+            (self.codebooks - self._split(query[None])[0][:, None]) ** 2
+        ).sum(axis=2)
+        return np.asarray(
+            table[np.arange(self.num_subspaces), codes].sum(axis=1)
+        )
+
+
+class EmbeddingIndex:
+    """
+    Nearest-neighbour index of L2-normalized embeddings, by cosine similarity.
+
+    The float16 vectors are stored in a memory-mapped matrix, so that the
+    indexes of many users are paged by the OS instead of held in memory.
+    Collections under `ivf_threshold` vectors are searched exactly; past it,
+    an inverted file of `sqrt(n)` k-means lists with product-quantized
+    residuals narrows the search to the `nprobe` nearest lists, whose best
+    candidates are re-ranked exactly. The lists are retrained whenever the
+    collection doubled.
+
+    Removed images keep their row, which is skipped by the searches.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dim: int,
+        ivf_threshold: int = 20_000,
+        nprobe: int = 8,
+        rerank: int = 10,
+        capacity: int = 1024,
+    ):
+        self._path = path
+        self.dim = dim
+        self._ivf_threshold = ivf_threshold
+        self._nprobe = nprobe
+        self._rerank = rerank
+        self._vectors = self._allocate(capacity)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._live = np.zeros(capacity, dtype=bool)
+        # Row of each indexed image
+        self._rows: dict[int, int] = {}
+        self.size = 0
+        self.last_id = 0
+        self._centroids: np.ndarray | None = None
+        self._lists: list[list[int]] = []
+        self._codes = np.zeros((capacity, 0), dtype=np.uint8)
+        self._quantizer: ProductQuantizer | None = None
+        self._trained_size = 0
+        self.lock = threading.Lock()
+
+    @property
+    def approximate(self) -> bool:
+        return self._centroids is not None
+
+    @property
+    def ids(self) -> set[int]:
+        return set(self._rows)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, image_id: int) -> bool:
+        return image_id in self._rows
+
+    def _ivf(self) -> tuple[np.ndarray, ProductQuantizer]:
+        if self._centroids is None or self._quantizer is None:
+            raise RuntimeError("The index is not trained")
+        return self._centroids, self._quantizer
+
+    def _allocate(self, capacity: int) -> np.ndarray:
+        tmp_path = f"{self._path}.{capacity}.tmp"
+        vectors = np.lib.format.open_memmap(
+            tmp_path,
+            mode="w+",
+            dtype=EMBEDDING_DTYPE,
+            shape=(capacity, self.dim),
+        )
+        os.replace(tmp_path, self._path)
+        return vectors
+
+    def _grow(self, capacity: int) -> None:
+        # The previous mapping stays valid once its file is replaced
+        previous = self._vectors
+        self._vectors = self._allocate(capacity)
+        for start in range(0, self.size, CHUNK_SIZE):
+            end = min(self.size, start + CHUNK_SIZE)
+            self._vectors[start:end] = previous[start:end]
+        self._ids = np.resize(self._ids, capacity)
+        self._live = np.resize(self._live, capacity)
+        self._codes = np.resize(self._codes, (capacity, self._codes.shape[1]))
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """
+        Append the vectors of images, replacing those already indexed.
+        """
+        if not len(ids):
+            return
+        self.remove(ids.tolist())
+        start, end = self.size, self.size + len(ids)
+        if end > len(self._ids):
+            self._grow(max(end, 2 * len(self._ids)))
+        self._vectors[start:end] = vectors
+        self._ids[start:end] = ids
+        self._live[start:end] = True
+        self._rows.update(zip(ids.tolist(), range(start, end)))
+        self.size, self.last_id = end, max(self.last_id, int(ids.max()))
+
+        if self.size >= max(self._ivf_threshold, 2 * self._trained_size):
+            self._train()
+        elif self.approximate:
+            self._assign(start, end)
+
+    def remove(self, ids: Iterable[int]) -> None:
+        for image_id in ids:
+            row = self._rows.pop(image_id, None)
+            if row is not None:
+                self._live[row] = False
+        if self.last_id not in self._rows:
+            self.last_id = max(self._rows, default=0)
+
+    def _train(self) -> None:
+        rows = np.random.default_rng(0).permutation(self.size)
+        sample = np.asarray(
+            self._vectors[np.sort(rows[:TRAINING_SAMPLE_SIZE])],
+            dtype=np.float32,
+        )
+        num_lists = max(1, int(np.sqrt(self.size)))
+        self._centroids = kmeans(sample, num_lists)
+        self._quantizer = ProductQuantizer(self.dim)
+        assignments = nearest(sample, self._centroids)
+        self._quantizer.train(sample - self._centroids[assignments])
+        self._codes = np.zeros(
+            (len(self._ids), self._quantizer.num_subspaces), dtype=np.uint8
+        )
+        self._lists = [[] for _ in range(num_lists)]
+        self._trained_size = self.size
+        self._assign(0, self.size)
+
+    def _assign(self, start: int, end: int) -> None:
+        centroids, quantizer = self._ivf()
+        for chunk_start in range(start, end, CHUNK_SIZE):
+            chunk_end = min(end, chunk_start + CHUNK_SIZE)
+            vectors = np.asarray(
+                self._vectors[chunk_start:chunk_end], dtype=np.float32
+            )
+            assignments = nearest(vectors, centroids)
+            self._codes[chunk_start:chunk_end] = quantizer.encode(
+                vectors - centroids[assignments]
+            )
+            for row, list_id in enumerate(assignments, chunk_start):
+                self._lists[list_id].append(row)
+
+    def _exact_scores(self, query: np.ndarray) -> np.ndarray:
+        scores = np.empty(self.size, dtype=np.float32)
+        for start in range(0, self.size, CHUNK_SIZE):
+            end = min(self.size, start + CHUNK_SIZE)
+            scores[start:end] = (
+                np.asarray(self._vectors[start:end], dtype=np.float32) @ query
+            )
+        return scores
+
+    def _candidates(self, query: np.ndarray, k: int) -> np.ndarray:
+        centroids, quantizer = self._ivf()
+        probed = np.argsort(centroids @ query)[::-1][: self._nprobe]
+        probed_rows, probed_distances = [], []
+        for list_id in probed:
+            list_rows = np.asarray(self._lists[list_id], dtype=np.int64)
+            list_rows = list_rows[self._live[list_rows]]
+            if not len(list_rows):
+                continue
+            probed_rows.append(list_rows)
+            probed_distances.append(
+                quantizer.distances(
+                    query - centroids[list_id], self._codes[list_rows]
+                )
+            )
+        if not probed_rows:
+            return np.zeros(0, dtype=np.int64)
+        rows = np.concatenate(probed_rows)
+        distances = np.concatenate(probed_distances)
+        num_candidates = min(len(rows), k * self._rerank)
+        return rows[np.argpartition(distances, num_candidates - 1)][
+            :num_candidates
+        ]
+
+    def close(self) -> None:
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
+
+    def search(
+        self, query: np.ndarray, k: int, exclude_id: int | None = None
+    ) -> list[tuple[int, float]]:
+        """
+        The ids of the `k` most similar images, with their cosine similarity.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if self.approximate:
+            rows = np.sort(self._candidates(query, k + 1))
+            scores = np.asarray(self._vectors[rows], dtype=np.float32) @ query
+        else:
+            rows = np.flatnonzero(self._live[: self.size])
+            scores = self._exact_scores(query)[rows]
+
+        order = np.argsort(-scores)
+        results = []
+        for position in order:
+            image_id = int(self._ids[rows[position]])
+            if image_id == exclude_id:
+                continue
+            results.append((image_id, float(scores[position])))
+            if len(results) == k:
+                break
+        return results
+
+
+def indexed_ids(index: EmbeddingIndex) -> set[int]:
+    with index.lock:
+        return index.ids
+
+
+def indexed_state(index: EmbeddingIndex) -> tuple[int, int]:
+    with index.lock:
+        return len(index), index.last_id
+
+
+def catch_up(
+    index: EmbeddingIndex,
+    rows: Sequence[tuple[int, bytes]],
+    removed: Iterable[int] = (),
+) -> None:
+    """
+    Add the `(id, embedding)` rows not indexed yet and remove the `removed`
+    ids.
+    """
+    with index.lock:
+        index.remove(removed)
+        # Added concurrently since read
+        rows = [row for row in rows if row[0] not in index]
+        if rows:
+            index.add(
+                np.array([image_id for image_id, _ in rows], dtype=np.int64),
+                np.frombuffer(
+                    b"".join(embedding for _, embedding in rows),
+                    dtype=EMBEDDING_DTYPE,
+                ).reshape(len(rows), index.dim),
+            )
+
+
+def catch_up_and_search(
+    index: EmbeddingIndex,
+    rows: Sequence[tuple[int, bytes]],
+    removed: set[int],
+    query: np.ndarray,
+    k: int,
+    exclude_id: int,
+) -> list[tuple[int, float]]:
+    """
+    Catch up the index, then search it.
+    """
+    catch_up(index, rows, removed)
+    with index.lock:
+        return index.search(query, k, exclude_id=exclude_id)
+
+
+async def read_embeddings(
+    db: AsyncSession, *conditions: ColumnElement[bool]
+) -> list[tuple[int, bytes]]:
+    """
+    The `(id, embedding)` rows of the images matching `conditions`, in id
+    order.
+    """
+    result = await db.execute(
+        select(models.ImageORM.id, models.ImageORM.embedding)
+        .where(*conditions)
+        .order_by(models.ImageORM.id)
+    )
+    return [
+        (image_id, embedding)
+        for image_id, embedding in result
+        if embedding is not None
+    ]
+
+
+class SimilarityIndexes:
+    """
+    The embedding index of each user and model version. The images saved by
+    this process are added as they are saved, and those saved by the other
+    workers are read at the next search.
+
+    At most `max_indexes` indexes are kept, the least recently used ones are
+    dropped and rebuilt from the database when needed again.
+    """
+
+    def __init__(
+        self,
+        directory: str | None = None,
+        max_indexes: int = 256,
+        **index_options,
+    ):
+        # Each process maps its own files
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self._directory = tempfile.mkdtemp(prefix="embeddings-", dir=directory)
+        self._max_indexes = max_indexes
+        self._index_options = index_options
+        self._indexes: OrderedDict[tuple[int, str], EmbeddingIndex] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def _index(
+        self, user_id: int, model_version: str, dim: int
+    ) -> EmbeddingIndex:
+        key = (user_id, model_version)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None and index.dim != dim:
+                index.close()
+                index = None
+            if index is None:
+                index = EmbeddingIndex(
+                    os.path.join(
+                        self._directory, f"{user_id}-{model_version}.npy"
+                    ),
+                    dim,
+                    **self._index_options,
+                )
+                self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self._max_indexes:
+                self._indexes.popitem(last=False)[1].close()
+        return index
+
+    async def add(
+        self,
+        user_id: int,
+        model_version: str,
+        rows: Sequence[tuple[int, bytes]],
+    ) -> None:
+        """
+        Add the `(id, embedding)` rows of saved images to the index of this
+        process, if it is loaded.
+        """
+        with self._lock:
+            index = self._indexes.get((user_id, model_version))
+        if index is not None and rows:
+            # The lists may be retrained, off the event loop
+            await asyncio.to_thread(catch_up, index, rows)
+
+    def remove(
+        self, user_id: int, model_version: str, ids: Iterable[int]
+    ) -> None:
+        """
+        Drop deleted images from the index of this process, the others
+        notice them missing at their next search.
+        """
+        with self._lock:
+            index = self._indexes.get((user_id, model_version))
+        if index is not None:
+            with index.lock:
+                index.remove(ids)
+
+    async def search(
+        self, db: AsyncSession, image: models.ImageORM, k: int = 5
+    ) -> list[tuple[int, float]]:
+        """
+        The past images of the owner of `image` most similar to it.
+
+        The index is checked against the count and latest id of the images in
+        the database. When they differ, the images after the latest indexed
+        one are read. Only when they do not account for the difference, the
+        ids are compared to add the images committed out of order, and to
+        remove the deleted ones.
+        """
+        if image.embedding is None or image.model_version is None:
+            return []
+        query = np.frombuffer(image.embedding, dtype=EMBEDDING_DTYPE)
+        user_id, model_version = image.user_id, image.model_version
+        index = self._index(user_id, model_version, len(query))
+        embedded = (
+            models.ImageORM.user_id == user_id,
+            models.ImageORM.model_version == model_version,
+            models.ImageORM.embedding.is_not(None),
+        )
+        count, last_id = (
+            await db.execute(
+                select(func.count(), func.max(models.ImageORM.id)).where(
+                    *embedded
+                )
+            )
+        ).one()
+        rows: Sequence[tuple[int, bytes]] = []
+        removed: set[int] = set()
+        # Read without the lock, a search in progress is caught up anyway
+        if (count, last_id or 0) != (len(index), index.last_id):
+            size, indexed_last_id = await asyncio.to_thread(
+                indexed_state, index
+            )
+            rows = await read_embeddings(
+                db, *embedded, models.ImageORM.id > indexed_last_id
+            )
+            if size + len(rows) != count:
+                ids = set(
+                    await db.scalars(
+                        select(models.ImageORM.id).where(*embedded)
+                    )
+                )
+                indexed = await asyncio.to_thread(indexed_ids, index)
+                removed = indexed - ids
+                missing = ids - indexed
+                # Only the rows from the first missing id are read
+                rows = (
+                    await read_embeddings(
+                        db, *embedded, models.ImageORM.id >= min(missing)
+                    )
+                    if missing
+                    else []
+                )
+        # The index is memory-mapped, it is read off the event loop
+        return await asyncio.to_thread(
+            catch_up_and_search, index, rows, removed, query, k, image.id
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._indexes.clear()
+        shutil.rmtree(self._directory, ignore_errors=True)
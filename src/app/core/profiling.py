@@ -0,0 +1,237 @@
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import threading
+import zipfile
+from abc import ABC, abstractmethod
+from collections import Counter
+from collections.abc import Callable
+from types import FrameType
+from typing import Any, TypeVar
+
+import torch
+from torch.profiler import ProfilerActivity
+
+T = TypeVar("T")
+
+# The capture in progress, checked by the request and inference paths, which
+# do nothing more while it is None
+active: "Capture | None" = None
+
+
+class CaptureInProgress(Exception):
+    """
+    Another capture is in progress.
+    """
+
+
+class Capture(ABC):
+    """
+    Profile until `max_requests` requests finished, if given, or `seconds`
+    elapsed.
+    """
+
+    kind: str
+    media_type: str
+    filename: str
+
+    def __init__(self, seconds: float, max_requests: int | None = None):
+        self.seconds = seconds
+        self.max_requests = max_requests
+        self.requests = 0
+        self._done = asyncio.Event()
+
+    def request_finished(self) -> None:
+        self.requests += 1
+        if self.max_requests is not None and self.requests >= self.max_requests:
+            self._done.set()
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    @abstractmethod
+    def artifact(self) -> bytes:
+        """
+        The profile, as the content of the downloaded file.
+        """
+
+    async def run(self) -> bytes:
+        """
+        Capture, and return the profile as a downloadable artifact.
+        """
+        global active
+        if active is not None:
+            raise CaptureInProgress()
+        self.start()
+        active = self
+        try:
+            await asyncio.wait_for(self._done.wait(), self.seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            active = None
+            self.stop()
+        return await asyncio.to_thread(self.artifact)
+
+
+class TorchCapture(Capture):
+    """
+    `torch.profiler` traces of the forward passes run by the inference
+    threads, with the CPU time of each operator summed over the passes.
+
+    The profiled passes are serialized, the profiler being global to the
+    process. Passes run by process workers are not captured.
+    """
+
+    kind = "torch"
+    media_type = "application/zip"
+    filename = "torch-profile.zip"
+
+    def __init__(
+        self,
+        seconds: float,
+        max_requests: int | None = None,
+        max_traces: int = 16,
+    ):
+        super().__init__(seconds, max_requests)
+        self._max_traces = max_traces
+        self._traces: list[bytes] = []
+        # Operator: calls, self CPU time and CPU time in microseconds
+        self._operators: dict[str, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def profile(self, fn: Callable[..., T], *args: Any) -> T:
+        with self._lock:
+            with torch.profiler.profile(
+                activities=[ProfilerActivity.CPU], record_shapes=True
+            ) as prof:
+                result = fn(*args)
+
+            for event in prof.key_averages():
+                operator = self._operators.setdefault(event.key, [0, 0, 0])
+                operator[0] += event.count
+                operator[1] += event.self_cpu_time_total
+                operator[2] += event.cpu_time_total
+            if len(self._traces) < self._max_traces:
+                # Only exported to a file
+                with tempfile.TemporaryDirectory() as directory:
+                    path = os.path.join(directory, "trace.json")
+                    prof.export_chrome_trace(path)
+                    with open(path, "rb") as f:
+                        self._traces.append(f.read())
+        return result
+
+    def summary(self) -> str:
+        lines = [
+            f"{'operator':<48}{'calls':>10}{'self CPU ms':>14}{'CPU ms':>12}"
+        ]
+        for name, (calls, self_cpu, cpu) in sorted(
+            self._operators.items(), key=lambda item: -item[1][1]
+        ):
+            lines.append(
+                f"{name[:47]:<48}{calls:>10.0f}{self_cpu / 1000:>14.3f}"
+                f"{cpu / 1000:>12.3f}"
+            )
+        lines.append(
+            f"\n{len(self._traces)} forward pass(es) traced, "
+            f"{self.requests} request(s) finished"
+        )
+        return "\n".join(lines) + "\n"
+
+    def artifact(self) -> bytes:
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("summary.txt", self.summary())
+            for i, trace in enumerate(self._traces):
+                archive.writestr(f"trace-{i:03d}.json", trace)
+        return buf.getvalue()
+
+
+class SamplingCapture(Capture):
+    """
+    Sample the Python stacks of every thread each `interval` seconds, as
+    collapsed stacks: one `thread;outer;...;inner count` line per stack,
+    the input of flame graph tools such as speedscope or flamegraph.pl.
+
+    Unlike `cProfile`, the event loop and the inference threads are all
+    sampled, and the code runs at full speed between the samples.
+    """
+
+    kind = "python"
+    media_type = "text/plain"
+    filename = "python-profile.folded"
+
+    def __init__(
+        self,
+        seconds: float,
+        max_requests: int | None = None,
+        interval: float = 0.005,
+    ):
+        super().__init__(seconds, max_requests)
+        self._interval = interval
+        self._stacks: Counter[str] = Counter()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @staticmethod
+    def _frame_name(frame: FrameType) -> str:
+        code = frame.f_code
+        return (
+            f"{code.co_name} "
+            f"({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        )
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, top in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = []
+            frame: FrameType | None = top
+            while frame is not None:
+                stack.append(self._frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            self._stacks[";".join(reversed(stack))] += 1
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._interval):
+            self._sample()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def artifact(self) -> bytes:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self._stacks.most_common()
+        ).encode()
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware counting the requests finished during a capture.
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if active is not None and scope["type"] == "http":
+                active.request_finished()
@@ -0,0 +1,275 @@
+import math
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from typing import Any, NamedTuple, cast
+
+from sqlalchemy import CursorResult, insert, update
+from sqlalchemy.orm import Session
+
+import app.models as models
+
+
+class QuotaExceeded(Exception):
+    """
+    The user is over its quota, the request can be retried after
+    `retry_after` seconds.
+    """
+
+    status_code = 429
+
+    def __init__(self, reason: str, retry_after: float | None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = (
+            max(1, math.ceil(retry_after)) if retry_after is not None else None
+        )
+
+
+class OverBurst(QuotaExceeded):
+    """
+    The request has more images than the bucket can ever hold, retrying it
+    cannot succeed.
+    """
+
+    status_code = 413
+
+    def __init__(self, images: int, burst: int):
+        super().__init__("burst", None)
+        self.images = images
+        self.burst = burst
+
+
+class TokenBucket:
+    """
+    Allow `rate` images per second on average, and bursts of `burst` images.
+    """
+
+    def __init__(
+        self, rate: float, burst: float, clock: Callable[[], float]
+    ) -> None:
+        self._rate = rate
+        self._burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._updated = clock()
+
+    @property
+    def tokens(self) -> float:
+        now = self._clock()
+        self._tokens = min(
+            self._burst, self._tokens + (now - self._updated) * self._rate
+        )
+        self._updated = now
+        return self._tokens
+
+    @property
+    def full(self) -> bool:
+        return self.tokens >= self._burst
+
+    def delay(self, cost: float = 1) -> float:
+        """
+        The seconds to wait until there are `cost` tokens.
+        """
+        return max(0.0, cost - self.tokens) / self._rate
+
+    def take(self, cost: float = 1) -> float:
+        """
+        Take `cost` tokens, or return the seconds to wait until there are
+        enough of them.
+        """
+        delay = self.delay(cost)
+        if delay > 0:
+            return delay
+        self._tokens -= cost
+        return 0.0
+
+
+class UserLimits(NamedTuple):
+    weight: float
+    max_concurrency: int
+
+
+class Usage(NamedTuple):
+    images: int = 0
+    throttled: int = 0
+
+
+class QuotaManager:
+    """
+    Per-user quotas enforced in this process, without a database query on the
+    request path: the limits come with the authenticated user, and the usage
+    is accumulated in memory and written by `flush`.
+
+    A request is rejected when the user already has `max_concurrency`
+    requests in flight, or when its images are over the token bucket of
+    `rate_per_minute` images. With several serving workers, each worker
+    enforces the quotas on the requests it serves.
+    """
+
+    def __init__(
+        self,
+        rate_per_minute: float | None = None,
+        burst: int = 256,
+        max_concurrency: int = 4,
+        weight: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._rate = rate_per_minute / 60 if rate_per_minute else None
+        self._burst = burst
+        self._max_concurrency = max_concurrency
+        self._weight = weight
+        self._clock = clock
+        self._buckets: dict[int, TokenBucket] = {}
+        self._in_flight: dict[int, int] = {}
+        self._usage: dict[int, Usage] = {}
+
+    def limits(self, user: models.UserORM) -> UserLimits:
+        return UserLimits(
+            weight=user.inference_weight or self._weight,
+            max_concurrency=user.max_concurrency or self._max_concurrency,
+        )
+
+    def _bucket(self, user_id: int) -> TokenBucket | None:
+        if self._rate is None:
+            return None
+        if user_id not in self._buckets:
+            self._buckets[user_id] = TokenBucket(
+                self._rate, self._burst, self._clock
+            )
+        return self._buckets[user_id]
+
+    def _record(self, user_id: int, images: int = 0, throttled: int = 0):
+        usage = self._usage.get(user_id, Usage())
+        self._usage[user_id] = Usage(
+            usage.images + images, usage.throttled + throttled
+        )
+
+    def check(self, user: models.UserORM, images: int = 1) -> UserLimits:
+        """
+        Raise `QuotaExceeded` if the user cannot classify `images` images now,
+        without taking them, or `OverBurst` if they never could.
+        """
+        user_id: int = user.id
+        limits = self.limits(user)
+        try:
+            if self._in_flight.get(user_id, 0) >= limits.max_concurrency:
+                raise QuotaExceeded("concurrency", 1)
+            bucket = self._bucket(user_id)
+            if bucket is not None:
+                if images > self._burst:
+                    raise OverBurst(images, self._burst)
+                delay = bucket.delay(images)
+                if delay > 0:
+                    raise QuotaExceeded("rate", delay)
+        except QuotaExceeded:
+            self._record(user_id, throttled=images)
+            raise
+        return limits
+
+    @contextmanager
+    def acquire(
+        self, user: models.UserORM, images: int = 1
+    ) -> Iterator[UserLimits]:
+        """
+        Hold one of the concurrent requests of the user, for `images` images
+        taken from its bucket.
+        """
+        user_id: int = user.id
+        limits = self.check(user, images)
+        bucket = self._bucket(user_id)
+        if bucket is not None:
+            bucket.take(images)
+
+        self._in_flight[user_id] = self._in_flight.get(user_id, 0) + 1
+        self._record(user_id, images=images)
+        try:
+            yield limits
+        finally:
+            self._in_flight[user_id] -= 1
+            if not self._in_flight[user_id]:
+                del self._in_flight[user_id]
+
+    def stats(self, user: models.UserORM) -> dict[str, Any]:
+        user_id: int = user.id
+        limits = self.limits(user)
+        bucket = self._bucket(user_id)
+        return {
+            "weight": limits.weight,
+            "max_concurrency": limits.max_concurrency,
+            "in_flight": self._in_flight.get(user_id, 0),
+            "images_per_minute": self._rate * 60 if self._rate else None,
+            "burst": self._burst if self._rate else None,
+            "remaining": (
+                math.floor(bucket.tokens) if bucket is not None else None
+            ),
+        }
+
+    def take_usage(self) -> dict[int, Usage]:
+        """
+        Return and reset the usage accumulated since the last call.
+
+        Called on the event loop that serves the requests, so the usage is
+        never updated while it is being taken.
+        """
+        usage, self._usage = self._usage, {}
+        # Full buckets of idle users are recreated full when needed
+        for user_id, bucket in list(self._buckets.items()):
+            if user_id not in self._in_flight and bucket.full:
+                del self._buckets[user_id]
+        return usage
+
+    def restore_usage(self, usage: dict[int, Usage]) -> None:
+        """
+        Give back usage that could not be written, for the next flush.
+        """
+        for user_id, (images, throttled) in usage.items():
+            self._record(user_id, images, throttled)
+
+    def flush(self, db: Session) -> int:
+        """
+        Add the usage accumulated since the last flush to the database, and
+        return the number of users updated.
+        """
+        usage = self.take_usage()
+        try:
+            return write_usage(db, usage)
+        except Exception:
+            # Written at the next flush
+            self.restore_usage(usage)
+            raise
+
+
+def write_usage(db: Session, usage: dict[int, Usage]) -> int:
+    """
+    Add `usage` to the database, and return the number of users updated.
+    """
+    if not usage:
+        return 0
+
+    try:
+        for user_id, (images, throttled) in usage.items():
+            updated = cast(
+                CursorResult[Any],
+                db.execute(
+                    update(models.UsageORM)
+                    .where(models.UsageORM.user_id == user_id)
+                    .values(
+                        images=models.UsageORM.images + images,
+                        throttled=models.UsageORM.throttled + throttled,
+                    )
+                ),
+            )
+            if not updated.rowcount:
+                db.execute(
+                    insert(models.UsageORM).values(
+                        user_id=user_id,
+                        images=images,
+                        throttled=throttled,
+                    )
+                )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(usage)
@@ -6,10 +6,12 @@ import jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
+from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
+from app.core.metrics import time_stage
 from app.core.schemas import TokenData
 from app.db.database import TokenBlacklistORM, get_db
 
@@ -17,16 +19,18 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
 
 def get_password_hash(password: str) -> str:
-    hashed_password: str = bcrypt.hashpw(
-        password.encode(), bcrypt.gensalt()
-    ).decode()
+    with time_stage("bcrypt"):
+        hashed_password: str = bcrypt.hashpw(
+            password.encode(), bcrypt.gensalt()
+        ).decode()
     return hashed_password
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    correct_password: bool = bcrypt.checkpw(
-        plain_password.encode(), hashed_password.encode()
-    )
+    with time_stage("bcrypt"):
+        correct_password: bool = bcrypt.checkpw(
+            plain_password.encode(), hashed_password.encode()
+        )
     return correct_password
 
 
@@ -49,7 +53,7 @@ def create_access_token(
     return encoded_jwt
 
 
-def blacklist_token(token: str, db: Session) -> None:
+async def blacklist_token(token: str, db: AsyncSession) -> None:
     from app.db.database import TokenBlacklistORM
 
     payload = jwt.decode(
@@ -60,16 +64,20 @@ def blacklist_token(token: str, db: Session) -> None:
     expires_at = datetime.fromtimestamp(payload.get("exp"))
     token_blacklist = TokenBlacklistORM(token=token, expires_at=expires_at)
     db.add(token_blacklist)
-    db.commit()
+    await db.commit()
 
 
-def is_blacklisted(token: str, db: Annotated[Session, Depends(get_db)]):
+async def is_blacklisted(
+    token: str, db: Annotated[AsyncSession, Depends(get_db)]
+):
 
     try:
         return (
-            db.query(TokenBlacklistORM)
-            .filter(TokenBlacklistORM.token == token)
-            .first()
+            await db.scalar(
+                select(TokenBlacklistORM.id).where(
+                    TokenBlacklistORM.token == token
+                )
+            )
             is not None
         )
     except SQLAlchemyError as e:
@@ -79,8 +87,8 @@ def is_blacklisted(token: str, db: Annotated[Session, Depends(get_db)]):
         ) from e
 
 
-def verify_token(token: str, db) -> TokenData:
-    if is_blacklisted(token, db):
+async def verify_token(token: str, db: AsyncSession) -> TokenData:
+    if await is_blacklisted(token, db):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token has been blacklisted, please log in again.",
@@ -0,0 +1,103 @@
+import os
+from typing import Any
+
+import torch
+
+# Slot of this gunicorn worker, None when not pre-forked
+worker_slot: int | None = None
+
+MEMORY_FIELDS = {
+    "Rss": "rss_kb",
+    "Pss": "pss_kb",
+    "Shared_Clean": "shared_clean_kb",
+    "Shared_Dirty": "shared_dirty_kb",
+    "Private_Clean": "private_clean_kb",
+    "Private_Dirty": "private_dirty_kb",
+}
+
+
+def process_memory(pid: int | str = "self") -> dict[str, int] | None:
+    """
+    Memory of a process from `/proc/<pid>/smaps_rollup`, in kB.
+
+    RSS counts the pages shared with the master and the other workers in
+    full, PSS divides them between the processes sharing them. None if the
+    process is gone or the kernel does not expose it.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+
+    memory = {}
+    for line in lines:
+        field, _, value = line.partition(":")
+        if field in MEMORY_FIELDS:
+            memory[MEMORY_FIELDS[field]] = int(value.split()[0])
+    return memory
+
+
+def child_pids(pid: int) -> list[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def workers_memory() -> dict[str, Any]:
+    """
+    Memory of the master and of every worker, when pre-forked by gunicorn,
+    or of this process otherwise.
+    """
+    if worker_slot is None:
+        return {"workers": [{"pid": os.getpid(), **(process_memory() or {})}]}
+
+    master = os.getppid()
+    workers = []
+    for pid in child_pids(master):
+        memory = process_memory(pid)
+        if memory is not None:
+            workers.append({"pid": pid, **memory})
+    return {
+        "master": {"pid": master, **(process_memory(master) or {})},
+        "workers": workers,
+        "current_pid": os.getpid(),
+    }
+
+
+def worker_cpus(
+    slot: int, num_cpus: int, cpus: list[int] | None = None
+) -> list[int]:
+    """
+    The `num_cpus` cores pinned to the worker in `slot`, wrapping around
+    when there are more workers than cores.
+    """
+    if cpus is None:
+        cpus = sorted(os.sched_getaffinity(0))
+    start = slot * num_cpus
+    return [cpus[(start + i) % len(cpus)] for i in range(num_cpus)]
+
+
+def configure_worker(
+    slot: int,
+    num_threads: int,
+    interop_threads: int = 1,
+    cpus: list[int] | None = None,
+) -> None:
+    """
+    Set the torch thread pools of a freshly forked worker, and pin it to
+    `cpus` if given.
+    """
+    global worker_slot
+    worker_slot = slot
+
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        # Already sized in the master, before the model was loaded
+        pass
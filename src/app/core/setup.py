@@ -1,18 +1,54 @@
+import asyncio
+import functools
+import logging
 import os
-from contextlib import asynccontextmanager
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from PIL import Image
 
+from app.core.blobs import collect_garbage, create_blob_store
 from app.core.config import settings
-from app.core.ml.cnn_model import ImageClassifier
-from app.db.database import init_db
+from app.core.jobs import JobQueue
+from app.core.metrics import MetricsMiddleware
+from app.core.metrics import registry as metrics_registry
+from app.core.ml.admission import AdmissionController
+from app.core.ml.batching import BatchScheduler
+from app.core.ml.cache import PredictionCache
+from app.core.ml.executor import (
+    classify_batch,
+    create_inference_executor,
+    default_num_threads,
+    warmup,
+)
+from app.core.ml.phash import NearDuplicateIndex
+from app.core.ml.registry import (
+    ModelKey,
+    ModelRegistry,
+    ModelSpec,
+    ServedModel,
+    create_classifier,
+    parse_model_specs,
+)
+from app.core.ml.similarity import SimilarityIndexes
+from app.core.profiling import ProfilingMiddleware
+from app.core.quotas import QuotaManager, write_usage
+from app.core.tracing import TracingMiddleware
+from app.core.writebehind import WriteBehindWriter
+from app.db.database import AsyncSessionLocal, SessionLocal, close_db, init_db
 
 origins = [
     "http://localhost:3000",
 ]
 
-ml_models = {}
+# Configured by uvicorn, and by gunicorn for its workers
+logger = logging.getLogger("uvicorn.error")
+
+ml_models: dict[str, Any] = {}
+preloaded_models: dict[str, Any] = {}
 
 tags_metadata = [
     {
@@ -27,22 +63,415 @@ tags_metadata = [
         "name": "Info",
         "description": "Miscellaneous information.",
     },
+    {
+        "name": "Admin",
+        "description": "Diagnostics, for the admin users.",
+    },
 ]
 
 
+def inference_threads():
+    """
+    Torch intra-op threads of each inference worker, so that serving workers
+    x inference workers x threads matches the core count.
+    """
+    return settings.INFERENCE_THREADS_PER_WORKER or default_num_threads(
+        settings.SERVING_WORKERS * settings.INFERENCE_WORKERS
+    )
+
+
+APP_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def model_specs():
+    if settings.MODELS:
+        return parse_model_specs(settings.MODELS, APP_DIRECTORY)
+    return [
+        ModelSpec(
+            "mobilenet_v3_large",
+            "mobilenet_v3_large",
+            os.path.join(APP_DIRECTORY, settings.MODEL_PATH),
+        )
+    ]
+
+
+def image_classifier_factory():
+    """
+    Picklable factory of the classifier of a `ModelSpec`.
+    """
+    backend_options: dict[str, Any] = {
+        "cache_dir": os.path.join(APP_DIRECTORY, settings.ENGINE_CACHE_DIR)
+    }
+    if settings.INFERENCE_BACKEND == "onnxruntime":
+        backend_options["intra_op_threads"] = inference_threads()
+    else:
+        backend_options.update(
+            engine=settings.INFERENCE_ENGINE,
+            channels_last=settings.CHANNELS_LAST,
+            quantization=settings.QUANTIZATION_BACKEND,
+            calibration_dir=settings.CALIBRATION_DIR,
+        )
+    return functools.partial(
+        create_classifier,
+        label_path=os.path.join(APP_DIRECTORY, settings.LABEL_PATH),
+        fast_preprocessing=settings.FAST_PREPROCESSING,
+        jpeg_draft=settings.JPEG_DRAFT_DECODE,
+        backend=settings.INFERENCE_BACKEND,
+        **backend_options,
+    )
+
+
+@contextmanager
+def log_duration(phase):
+    start = time.perf_counter()
+    yield
+    logger.info(
+        "Startup: %s in %.0f ms", phase, (time.perf_counter() - start) * 1000
+    )
+
+
+def load_image_classifier(spec):
+    with log_duration(f"model {spec.name} loaded"):
+        classifier = image_classifier_factory()(spec)
+    logger.info(
+        "Startup: model %s %s",
+        spec.name,
+        ", ".join(
+            f"{stage} in {duration * 1000:.0f} ms"
+            for stage, duration in classifier.load_timings.items()
+        ),
+    )
+    return classifier
+
+
+def serve_model(spec, classifier=None):
+    """
+    Load a model version, with the batch scheduler, prediction cache and
+    near-duplicate index serving it.
+    """
+    # Read before loading, so that a write during the load triggers a reload
+    mtime = os.path.getmtime(spec.model_path)
+    if classifier is None:
+        classifier = load_image_classifier(spec)
+    key = ModelKey(spec, classifier.version)
+    return ServedModel(
+        spec,
+        classifier,
+        batch_scheduler=BatchScheduler(
+            functools.partial(
+                classify_batch, model=key, embeddings=settings.EMBEDDINGS
+            ),
+            max_batch_size=settings.BATCH_MAX_SIZE,
+            max_wait_ms=settings.BATCH_MAX_WAIT_MS,
+            executor=ml_models["inference_executor"],
+            max_queue_ms=settings.ADMISSION_MAX_QUEUE_MS,
+        ),
+        prediction_cache=PredictionCache(
+            model_version=classifier.version,
+            max_size=settings.PREDICTION_CACHE_SIZE,
+            session_factory=(
+                AsyncSessionLocal if settings.PREDICTION_CACHE_SHARED else None
+            ),
+        ),
+        near_duplicate_index=(
+            NearDuplicateIndex(
+                max_distance=settings.NEAR_DUPLICATE_MAX_DISTANCE,
+                max_size=settings.NEAR_DUPLICATE_INDEX_SIZE,
+            )
+            if settings.NEAR_DUPLICATE_REUSE
+            else None
+        ),
+        mtime=mtime,
+    )
+
+
+async def watch_models(registry, interval):
+    """
+    Hot reload the models whose weights file changed on disk.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            for name in await registry.check_for_updates():
+                logger.info(
+                    "Model %s reloaded: version %s",
+                    name,
+                    registry.get(name).version,
+                )
+        except Exception:
+            logger.exception("Model reload failed")
+
+
+def save_usage(usage):
+    with SessionLocal() as db:
+        return write_usage(db, usage)
+
+
+async def flush_usage(quotas):
+    # Taken on the event loop, where the requests update it
+    usage = quotas.take_usage()
+    try:
+        return await asyncio.to_thread(save_usage, usage)
+    except Exception:
+        quotas.restore_usage(usage)
+        raise
+
+
+async def flush_usage_periodically(quotas, interval):
+    """
+    Write the usage counted by the quotas to the database.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_usage(quotas)
+        except Exception:
+            logger.exception("Usage flush failed")
+
+
+def collect_blobs(store):
+    with SessionLocal() as db:
+        return collect_garbage(db, store, settings.BLOB_GC_GRACE_SECONDS)
+
+
+async def collect_blobs_periodically(store, interval):
+    """
+    Delete the blobs no image references anymore.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            collected = await asyncio.to_thread(collect_blobs, store)
+            if any(collected.values()):
+                logger.info("Blobs collected: %s", collected)
+        except Exception:
+            logger.exception("Blob garbage collection failed")
+
+
+async def flush_metrics_periodically(interval):
+    """
+    Write the metrics of this worker for the scrapes of the other workers.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(metrics_registry.flush)
+        except Exception:
+            logger.exception("Metrics flush failed")
+
+
+def warmup_batch_sizes():
+    if settings.WARMUP_BATCH_SIZES:
+        return tuple(
+            int(size) for size in settings.WARMUP_BATCH_SIZES.split(",")
+        )
+    return tuple(range(1, settings.BATCH_MAX_SIZE + 1))
+
+
+async def warmup_inference(executor, model):
+    """
+    Run the warmup passes on the inference workers, off the event loop, so
+    that kernels and allocator pools are ready when the service reports ready.
+    """
+    # Thread workers share the classifier, process workers own one each
+    num_workers = (
+        settings.INFERENCE_WORKERS
+        if settings.INFERENCE_EXECUTOR == "process"
+        else 1
+    )
+    loop = asyncio.get_running_loop()
+    try:
+        with log_duration("warmup done"):
+            await asyncio.gather(
+                *(
+                    loop.run_in_executor(
+                        executor,
+                        warmup,
+                        warmup_batch_sizes(),
+                        settings.WARMUP_PASSES,
+                        model,
+                    )
+                    for _ in range(num_workers)
+                )
+            )
+    except Exception:
+        logger.exception("Startup: warmup failed")
+        raise
+
+
+def is_ready():
+    """
+    Whether the warmup passes completed.
+    """
+    task = ml_models.get("warmup")
+    return (
+        task is not None
+        and task.done()
+        and not task.cancelled()
+        and task.exception() is None
+    )
+
+
+def preload_models():
+    """
+    Load the classifier of the default model in the gunicorn master, before
+    the workers are forked, so that they share its weight pages copy-on-write.
+    """
+    specs = {spec.name: spec for spec in model_specs()}
+    spec = specs[settings.DEFAULT_MODEL or next(iter(specs))]
+    preloaded_models[spec.name] = load_image_classifier(spec)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Initialize the db
-    init_db()
+    with log_duration("database initialized"):
+        init_db()
+
+    # Decompression bomb guard of every decode, uploads are probed before
+    Image.MAX_IMAGE_PIXELS = settings.MAX_IMAGE_PIXELS
+
+    # Run decoding and inference off the event loop
+    with log_duration("inference executor created"):
+        ml_models["inference_executor"] = create_inference_executor(
+            kind=settings.INFERENCE_EXECUTOR,
+            max_workers=settings.INFERENCE_WORKERS,
+            num_threads=inference_threads(),
+            classifier_factory=image_classifier_factory(),
+        )
+
+    # Shed the inferences over the node capacity instead of queueing them
+    ml_models["admission"] = AdmissionController(
+        max_queue_depth=settings.ADMISSION_MAX_QUEUE_DEPTH,
+        max_queue_ms=settings.ADMISSION_MAX_QUEUE_MS,
+    )
+
+    # Share the inference capacity fairly between the users
+    ml_models["quotas"] = QuotaManager(
+        rate_per_minute=settings.QUOTA_IMAGES_PER_MINUTE,
+        burst=settings.QUOTA_BURST,
+        max_concurrency=settings.USER_MAX_CONCURRENCY,
+        weight=settings.USER_INFERENCE_WEIGHT,
+    )
+    if settings.QUOTA_FLUSH_INTERVAL > 0:
+        ml_models["usage_flusher"] = asyncio.create_task(
+            flush_usage_periodically(
+                ml_models["quotas"], settings.QUOTA_FLUSH_INTERVAL
+            )
+        )
+
+    # The uploaded images, stored once per content
+    ml_models["blob_store"] = create_blob_store(
+        settings.BLOB_STORE,
+        os.path.join(APP_DIRECTORY, settings.BLOB_STORE_DIR),
+    )
+    if settings.BLOB_GC_INTERVAL > 0:
+        ml_models["blob_collector"] = asyncio.create_task(
+            collect_blobs_periodically(
+                ml_models["blob_store"], settings.BLOB_GC_INTERVAL
+            )
+        )
+
+    # Respond before the classification results are written
+    if settings.WRITE_BEHIND:
+        ml_models["write_behind"] = WriteBehindWriter(
+            AsyncSessionLocal,
+            max_size=settings.WRITE_BEHIND_MAX_QUEUE,
+            batch_size=settings.WRITE_BEHIND_BATCH_SIZE,
+            interval_ms=settings.WRITE_BEHIND_INTERVAL_MS,
+            max_wait_ms=settings.WRITE_BEHIND_MAX_WAIT_MS,
+        )
+        ml_models["write_behind"].start()
+
+    if metrics_registry.directory is not None:
+        ml_models["metrics_flusher"] = asyncio.create_task(
+            flush_metrics_periodically(settings.METRICS_FLUSH_INTERVAL)
+        )
+
+    # Load the default model, unless preloaded by the master, and the other
+    # models on first use
+    specs = model_specs()
+    registry = ModelRegistry(
+        specs,
+        serve_model,
+        default=settings.DEFAULT_MODEL,
+        memory_budget=(
+            settings.MODEL_MEMORY_BUDGET_MB * 2**20
+            if settings.MODEL_MEMORY_BUDGET_MB
+            else None
+        ),
+    )
+    ml_models["model_registry"] = registry
+    default_spec = next(spec for spec in specs if spec.name == registry.default)
+    default_model = serve_model(
+        default_spec, preloaded_models.get(default_spec.name)
+    )
+    registry.add(default_model)
+    if settings.PREDICTION_CACHE_SHARED and len(specs) == 1:
+        # With several models, the entries of the other models could not be
+        # told apart from stale ones
+        with SessionLocal() as db:
+            default_model.prediction_cache.purge_stale(db)
+    if settings.MODEL_RELOAD_INTERVAL > 0:
+        ml_models["model_watcher"] = asyncio.create_task(
+            watch_models(registry, settings.MODEL_RELOAD_INTERVAL)
+        )
+
+    # Searched by /users/me/similar, built from the stored embeddings
+    ml_models["similarity"] = SimilarityIndexes(
+        settings.EMBEDDING_INDEX_DIR,
+        max_indexes=settings.EMBEDDING_INDEX_MAX_USERS,
+        ivf_threshold=settings.EMBEDDING_IVF_THRESHOLD,
+        nprobe=settings.EMBEDDING_IVF_NPROBE,
+    )
+
+    # Classify the queued jobs in the background
+    from app.api.v1.jobs import run_job_worker
+
+    ml_models["job_queue"] = JobQueue(
+        lease_seconds=settings.JOB_LEASE_SECONDS,
+        max_attempts=settings.JOB_MAX_ATTEMPTS,
+    )
+    ml_models["job_workers"] = [
+        asyncio.create_task(
+            run_job_worker(
+                ml_models["job_queue"], registry, settings.JOB_POLL_INTERVAL
+            )
+        )
+        for _ in range(settings.JOB_WORKERS)
+    ]
 
-    # Load the ML model
-    current_directory = os.path.dirname(os.path.abspath(__file__))
-    parent_directory = os.path.dirname(current_directory)
-    ml_models["image_classifier"] = ImageClassifier(
-        model_path=os.path.join(parent_directory, settings.MODEL_PATH),
-        label_path=os.path.join(parent_directory, settings.LABEL_PATH),
+    # Serve while warming up, the readiness probe reports when it is done
+    ml_models["warmup"] = asyncio.create_task(
+        warmup_inference(ml_models["inference_executor"], default_model.key)
     )
     yield
+    ml_models["warmup"].cancel()
+    # A job interrupted here is claimed again when its lease expires
+    for worker in ml_models["job_workers"]:
+        worker.cancel()
+    await asyncio.gather(*ml_models["job_workers"], return_exceptions=True)
+    if "write_behind" in ml_models:
+        # The requests are done, write the results they queued
+        await ml_models["write_behind"].close()
+    if "model_watcher" in ml_models:
+        ml_models["model_watcher"].cancel()
+    if "blob_collector" in ml_models:
+        ml_models["blob_collector"].cancel()
+    if "usage_flusher" in ml_models:
+        ml_models["usage_flusher"].cancel()
+        try:
+            await flush_usage(ml_models["quotas"])
+        except Exception:
+            logger.exception("Usage flush failed")
+    # Drain the in-flight batches before releasing the models
+    await registry.close()
+    ml_models["inference_executor"].shutdown()
+    ml_models["similarity"].close()
+    if "metrics_flusher" in ml_models:
+        ml_models["metrics_flusher"].cancel()
+        metrics_registry.flush()
+    await close_db()
     # Clean up the ML models and release the resources
     ml_models.clear()
 
@@ -64,6 +493,9 @@ def create_application(router, settings, create_tables_on_start=True, **kwargs):
         openapi_tags=tags_metadata,
     )
 
+    app.add_middleware(ProfilingMiddleware)
+    app.add_middleware(TracingMiddleware, server_timing=settings.SERVER_TIMING)
+    app.add_middleware(MetricsMiddleware)
     app.add_middleware(
         CORSMiddleware,
         allow_origins=origins,
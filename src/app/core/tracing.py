@@ -0,0 +1,141 @@
+import time
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any
+
+from app.core.config import settings
+
+
+class RequestTrace:
+    """
+    The stages and inputs of one request, reported in its `Server-Timing`
+    header and kept by the flight recorder if it was slow.
+
+    The stages of the images of a batch request are summed.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.stages: dict[str, float] = {}
+        self.images: list[dict[str, int]] = []
+        self.inferences: list[dict[str, float]] = []
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        metrics = [
+            f"{stage};dur={seconds * 1000:.2f}"
+            for stage, seconds in self.stages.items()
+        ]
+        total = time.perf_counter() - self.start
+        return ", ".join([*metrics, f"total;dur={total * 1000:.2f}"])
+
+
+current_trace: ContextVar[RequestTrace | None] = ContextVar(
+    "current_trace", default=None
+)
+
+
+class FlightRecorder:
+    """
+    The last `size` requests slower than `threshold_ms`, with the breakdown
+    of their stages and their inputs, kept in memory by each worker.
+    """
+
+    def __init__(self, threshold_ms: float = 1000.0, size: int = 256):
+        self.threshold = threshold_ms / 1000
+        self._records: deque[dict[str, Any]] = deque(maxlen=size)
+
+    def record(
+        self,
+        trace: RequestTrace,
+        duration: float,
+        method: str,
+        path: str,
+        route: str | None,
+        status_code: int,
+    ) -> None:
+        if duration < self.threshold:
+            return
+        self._records.append(
+            {
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "method": method,
+                "path": path,
+                "route": route,
+                "status": status_code,
+                "duration_ms": round(duration * 1000, 2),
+                "stages_ms": {
+                    stage: round(seconds * 1000, 2)
+                    for stage, seconds in trace.stages.items()
+                },
+                "images": trace.images,
+                "inferences": trace.inferences,
+            }
+        )
+
+    def dump(self, limit: int | None = None) -> list[dict[str, Any]]:
+        """
+        The recorded requests, the slowest first.
+        """
+        records = sorted(
+            self._records, key=lambda record: -record["duration_ms"]
+        )
+        return records[:limit]
+
+    def clear(self) -> None:
+        self._records.clear()
+
+
+recorder = FlightRecorder(
+    settings.SLOW_REQUEST_MS, settings.SLOW_REQUEST_BUFFER_SIZE
+)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware tracing each HTTP request, adding its `Server-Timing`
+    header and recording it if slow.
+    """
+
+    def __init__(self, app: Any, server_timing: bool = True):
+        self.app = app
+        self._server_timing = server_timing
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = current_trace.set(trace)
+        status_code = 500
+
+        async def send_with_timing(message: Any) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self._server_timing:
+                    # The stages after the headers, e.g. of a streamed
+                    # response, are only recorded
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"server-timing", trace.server_timing().encode()),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_trace.reset(token)
+            route = scope.get("route")
+            recorder.record(
+                trace,
+                time.perf_counter() - trace.start,
+                scope["method"],
+                scope["path"],
+                route.path if route is not None else None,
+                status_code,
+            )
@@ -0,0 +1,164 @@
+import io
+import tarfile
+import zipfile
+import zlib
+from collections.abc import AsyncIterable, AsyncIterator
+from typing import IO
+
+from fastapi import UploadFile
+from PIL import Image, UnidentifiedImageError
+
+CHUNK_SIZE = 64 * 1024
+
+# Enough bytes to recognize every signature below
+SIGNATURE_SIZE = 12
+IMAGE_SIGNATURES = {
+    b"\xff\xd8\xff": "JPEG",
+    b"\x89PNG\r\n\x1a\n": "PNG",
+    b"GIF87a": "GIF",
+    b"GIF89a": "GIF",
+    b"BM": "BMP",
+    b"II*\x00": "TIFF",
+    b"MM\x00*": "TIFF",
+}
+
+
+class UploadError(ValueError):
+    status_code = 400
+
+
+class UploadTooLarge(UploadError):
+    status_code = 413
+
+
+class UnsupportedImage(UploadError):
+    status_code = 415
+
+
+def sniff_image_format(header: bytes) -> str | None:
+    """
+    The image format announced by the magic bytes of `header`, if any.
+    """
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "WEBP"
+    for signature, image_format in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return image_format
+    return None
+
+
+def check_image_signature(header: bytes) -> str:
+    image_format = sniff_image_format(header)
+    if image_format is None:
+        raise UnsupportedImage("The file is not a supported image.")
+    return image_format
+
+
+async def iter_upload_file(
+    file: UploadFile, chunk_size: int = CHUNK_SIZE
+) -> AsyncIterator[bytes]:
+    while chunk := await file.read(chunk_size):
+        yield chunk
+
+
+async def read_upload(
+    chunks: AsyncIterable[bytes], max_bytes: int, check_signature: bool = True
+) -> bytes:
+    """
+    Read an upload chunk by chunk, stopping as soon as it exceeds `max_bytes`
+    or, with `check_signature`, as soon as its first bytes are not an image.
+    """
+    data = bytearray()
+    checked = not check_signature
+    async for chunk in chunks:
+        data += chunk
+        if len(data) > max_bytes:
+            raise UploadTooLarge(f"The upload exceeds {max_bytes} bytes.")
+        if not checked and len(data) >= SIGNATURE_SIZE:
+            check_image_signature(bytes(data[:SIGNATURE_SIZE]))
+            checked = True
+    if not checked:
+        check_image_signature(bytes(data))
+    return bytes(data)
+
+
+def probe_image(image_data: bytes, max_pixels: int) -> tuple[int, int]:
+    """
+    The size of an image, read from its header without decoding the pixels.
+    """
+    try:
+        with Image.open(io.BytesIO(image_data)) as image:
+            width, height = image.size
+    except Image.DecompressionBombError as e:
+        raise UploadTooLarge(str(e)) from e
+    except (UnidentifiedImageError, OSError, SyntaxError) as e:
+        raise UnsupportedImage("The file is not a supported image.") from e
+
+    if width * height > max_pixels:
+        raise UploadTooLarge(
+            f"The image has {width * height} pixels, more than {max_pixels}."
+        )
+    return width, height
+
+
+def read_archive(
+    fileobj: IO[bytes],
+    max_member_bytes: int | None = None,
+    max_total_bytes: int | None = None,
+) -> list[tuple[str, bytes]] | None:
+    """
+    Return the (filename, data) of every regular file in a zip or tar archive,
+    or None if `fileobj` is not an archive.
+
+    The uncompressed sizes declared by the archive are checked against the
+    limits before anything is extracted.
+    """
+
+    def check_sizes(sizes: list[int]) -> None:
+        if max_member_bytes is not None and any(
+            size > max_member_bytes for size in sizes
+        ):
+            raise UploadTooLarge(
+                f"An archived file exceeds {max_member_bytes} bytes."
+            )
+        if max_total_bytes is not None and sum(sizes) > max_total_bytes:
+            raise UploadTooLarge(
+                f"The archived files exceed {max_total_bytes} bytes."
+            )
+
+    fileobj.seek(0)
+    try:
+        if zipfile.is_zipfile(fileobj):
+            fileobj.seek(0)
+            with zipfile.ZipFile(fileobj) as zip_archive:
+                infos = [
+                    info for info in zip_archive.infolist() if not info.is_dir()
+                ]
+                # Extraction stops at the declared size, even for a zip bomb
+                check_sizes([info.file_size for info in infos])
+                return [
+                    (info.filename, zip_archive.read(info)) for info in infos
+                ]
+
+        fileobj.seek(0)
+        if tarfile.is_tarfile(fileobj):
+            fileobj.seek(0)
+            with tarfile.open(fileobj=fileobj) as tar_archive:
+                members = [
+                    member
+                    for member in tar_archive.getmembers()
+                    if member.isfile()
+                ]
+                check_sizes([member.size for member in members])
+                images = []
+                for member in members:
+                    member_file = tar_archive.extractfile(member)
+                    if member_file is not None:
+                        images.append((member.name, member_file.read()))
+                return images
+    except (zipfile.BadZipFile, zlib.error, tarfile.TarError, EOFError) as e:
+        # Truncated or corrupted after the headers that identified it
+        raise UploadError("The archive is corrupt.") from e
+
+    fileobj.seek(0)
+    return None
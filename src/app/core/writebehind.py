@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from collections.abc import Callable
+from typing import Any
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import app.models as models
+from app.core.blobs import count_references, reference_blobs
+from app.core.metrics import WRITE_BEHIND_SECONDS
+
+# Configured by uvicorn, and by gunicorn for its workers
+logger = logging.getLogger("uvicorn.error")
+
+
+class WriteBehindFull(Exception):
+    """
+    The queue of the results to write stayed full, the request can be
+    retried after `retry_after` seconds.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__("write_behind_full")
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class WriteBehindWriter:
+    """
+    `ImageORM` rows written to the database by a background task, after the
+    responses were sent: every `interval_ms`, or as soon as `batch_size` rows
+    are queued, in one transaction per batch.
+
+    The blobs of the rows are written before they are queued. A queued row
+    is lost if the process is killed, or if its batch still fails after
+    `max_attempts`: its blob is then collected as an orphan. Until then, it
+    is missing from the history of the user.
+
+    When `max_size` rows are queued, `put` waits up to `max_wait_ms` for the
+    flusher to catch up, then raises `WriteBehindFull`.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession],
+        max_size: int = 10000,
+        batch_size: int = 500,
+        interval_ms: float = 200.0,
+        max_wait_ms: float = 1000.0,
+        max_attempts: int = 3,
+    ):
+        self._session_factory = session_factory
+        self.max_size = max_size
+        self._batch_size = batch_size
+        self._interval = interval_ms / 1000
+        self._max_wait = max_wait_ms / 1000
+        self._max_attempts = max_attempts
+        # The rows, with the time they were queued
+        self._rows: deque[tuple[float, dict[str, Any]]] = deque()
+        self._batch_ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._closing = False
+        self._task: asyncio.Task[None] | None = None
+        self.queued = 0
+        self.written = 0
+        self.lost = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.retries = 0
+        self.last_flush_seconds: float | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, row: dict[str, Any]) -> None:
+        """
+        Queue a row, waiting for room if the queue is full.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._max_wait
+        while len(self._rows) >= self.max_size:
+            self._space.clear()
+            try:
+                await asyncio.wait_for(
+                    self._space.wait(), deadline - loop.time()
+                )
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise WriteBehindFull(self._max_wait) from None
+        self._rows.append((time.perf_counter(), row))
+        self.queued += 1
+        if len(self._rows) >= self._batch_size:
+            self._batch_ready.set()
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self._interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """
+        Write the queued rows.
+        """
+        async with self._lock:
+            while self._rows:
+                size = min(len(self._rows), self._batch_size)
+                batch = [self._rows.popleft() for _ in range(size)]
+                self._space.set()
+                await self._write(batch)
+
+    async def _write(self, batch: list[tuple[float, dict[str, Any]]]) -> None:
+        rows = [row for _, row in batch]
+        for attempt in range(self._max_attempts):
+            start = time.perf_counter()
+            try:
+                async with self._session_factory() as db:
+                    await db.run_sync(reference_blobs, count_references(rows))
+                    await db.execute(insert(models.ImageORM), rows)
+                    await db.commit()
+                break
+            except Exception:
+                if attempt + 1 == self._max_attempts:
+                    self.lost += len(rows)
+                    logger.exception("Write-behind: %d results lost", len(rows))
+                    return
+                self.retries += 1
+                await asyncio.sleep(self._interval * 2**attempt)
+
+        end = time.perf_counter()
+        self.last_flush_seconds = end - start
+        WRITE_BEHIND_SECONDS.observe(self.last_flush_seconds, "flush")
+        for queued_at, _ in batch:
+            WRITE_BEHIND_SECONDS.observe(end - queued_at, "delay")
+        self.written += len(rows)
+        self.flushes += 1
+
+    async def close(self) -> None:
+        """
+        Stop the flusher, once the queued rows are written.
+        """
+        self._closing = True
+        self._batch_ready.set()
+        if self._task is not None:
+            await self._task
+        await self.flush()
+
+    def stats(self) -> dict[str, int | float | None]:
+        oldest = (
+            round((time.perf_counter() - self._rows[0][0]) * 1000, 1)
+            if self._rows
+            else None
+        )
+        return {
+            "pending": len(self._rows),
+            "max_queue": self.max_size,
+            "oldest_pending_ms": oldest,
+            "interval_ms": self._interval * 1000,
+            "batch_size": self._batch_size,
+            "queued": self.queued,
+            "written": self.written,
+            "lost": self.lost,
+            "rejected": self.rejected,
+            "flushes": self.flushes,
+            "retries": self.retries,
+            "last_flush_ms": (
+                round(self.last_flush_seconds * 1000, 2)
+                if self.last_flush_seconds is not None
+                else None
+            ),
+        }
@@ -1,7 +1,14 @@
+from collections.abc import AsyncIterator
 from datetime import datetime
 from typing import Any
 
-from sqlalchemy import DateTime, String, create_engine
+from sqlalchemy import DateTime, String, create_engine, make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 from sqlalchemy.orm import Mapped, declarative_base, mapped_column, sessionmaker
 
 from app.core.config import settings
@@ -9,10 +16,37 @@ from app.core.config import settings
 DATABASE_URI = settings.POSTGRES_URI
 DATABASE_PREFIX = settings.POSTGRES_SYNC_PREFIX
 DATABASE_URL = f"{DATABASE_PREFIX}{DATABASE_URI}"
+ASYNC_DATABASE_URL = f"{settings.POSTGRES_ASYNC_PREFIX}{DATABASE_URI}"
 
+# Used by the background threads, the scripts and the tests
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def create_async_db_engine(url: str) -> AsyncEngine:
+    """
+    The engine of the API, with its connection pool sized by the settings.
+    """
+    options: dict[str, Any] = {
+        "pool_pre_ping": settings.DATABASE_POOL_PRE_PING,
+        "pool_recycle": settings.DATABASE_POOL_RECYCLE,
+    }
+    # SQLite, the local stand-in, has no server connections to pool
+    if make_url(url).get_backend_name() != "sqlite":
+        options.update(
+            pool_size=settings.DATABASE_POOL_SIZE,
+            max_overflow=settings.DATABASE_MAX_OVERFLOW,
+            pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+        )
+    return create_async_engine(url, **options)
+
+
+async_engine = create_async_db_engine(ASYNC_DATABASE_URL)
+# The attributes are not expired on commit, they could not be lazy loaded
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
 Base: Any = declarative_base()
 
 
@@ -30,6 +64,10 @@ def init_db():
     Base.metadata.create_all(bind=engine)
 
 
-def get_db():
-    with SessionLocal() as db:
+async def close_db():
+    await async_engine.dispose()
+
+
+async def get_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as db:
         yield db
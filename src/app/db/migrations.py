@@ -0,0 +1,175 @@
+"""
+Upgrade a database created by a previous version: create the new tables, add
+the columns added to the existing ones since they were created, move the
+images stored in the `image.image_data` column to the blob store, in batches,
+then drop the column, and create the new indexes.
+
+Run it once, with the serving processes stopped, before starting this
+version: `SECRET_KEY=... PYTHONPATH=src python -m app.db.migrations`. An
+interrupted run resumes where it stopped.
+"""
+
+import argparse
+import logging
+import os
+from collections import Counter
+
+from sqlalchemy import DefaultClause, Engine, inspect, text, update
+from sqlalchemy.orm import Session
+
+import app.models as models
+from app.core.blobs import (
+    BlobStore,
+    blob_hash,
+    create_blob_store,
+    mime_type,
+    reference_blobs,
+)
+from app.core.config import settings
+from app.db.database import Base, engine
+
+logger = logging.getLogger(__name__)
+
+
+def add_missing_columns(engine: Engine) -> list[str]:
+    """
+    Add the columns of the models missing from the existing tables, which
+    `create_all` skips, and return their names. They are added nullable,
+    unless a server default fills the existing rows.
+    """
+    inspector = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    added = []
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            columns = {
+                column["name"] for column in inspector.get_columns(table.name)
+            }
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                ddl = (
+                    f"ALTER TABLE {quote(table.name)} "
+                    f"ADD COLUMN {quote(column.name)} {column_type}"
+                )
+                default = column.server_default
+                if isinstance(default, DefaultClause):
+                    value = (
+                        default.arg
+                        if isinstance(default.arg, str)
+                        else default.arg.compile(dialect=engine.dialect)
+                    )
+                    ddl += f" DEFAULT {value}"
+                    if not column.nullable:
+                        ddl += " NOT NULL"
+                connection.execute(text(ddl))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def migrate_image_blobs(
+    engine: Engine, store: BlobStore, batch_size: int = 500
+) -> int:
+    """
+    Move the `image_data` of the images to the blob store, and return the
+    number of images moved. Each batch is committed on its own.
+    """
+    # The blob table, and the blob columns of the images
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    columns = {
+        column["name"] for column in inspect(engine).get_columns("image")
+    }
+    if "image_data" not in columns:
+        return 0
+
+    moved = 0
+    while True:
+        with Session(engine) as db:
+            rows = db.execute(
+                text(
+                    "SELECT id, image_data FROM image WHERE blob_hash IS NULL "
+                    "ORDER BY id LIMIT :batch_size"
+                ),
+                {"batch_size": batch_size},
+            ).all()
+            if not rows:
+                break
+
+            images = []
+            blobs = {}
+            counts: Counter[str] = Counter()
+            for image_id, image_data in rows:
+                image_data = bytes(image_data)
+                digest = blob_hash(image_data)
+                fields = {
+                    "blob_hash": digest,
+                    "size": len(image_data),
+                    "mime_type": mime_type(image_data),
+                }
+                images.append({"id": image_id, **fields})
+                counts[digest] += 1
+                if digest not in blobs:
+                    store.put(digest, image_data)
+                    blobs[digest] = {
+                        "size": fields["size"],
+                        "mime_type": fields["mime_type"],
+                    }
+            reference_blobs(
+                db,
+                {
+                    digest: {**blob, "count": counts[digest]}
+                    for digest, blob in blobs.items()
+                },
+            )
+            db.execute(update(models.ImageORM), images)
+            db.commit()
+        moved += len(rows)
+        logger.info("%d images moved to the blob store", moved)
+
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE image DROP COLUMN image_data"))
+    for index in models.ImageORM.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    return moved
+
+
+def create_indexes(engine: Engine) -> None:
+    """
+    Create the missing indexes of the existing tables, which `create_all`
+    skips.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    Base.metadata.create_all(bind=engine)
+    for column in add_missing_columns(engine):
+        logger.info("Column %s added", column)
+    store = create_blob_store(
+        settings.BLOB_STORE,
+        os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            settings.BLOB_STORE_DIR,
+        ),
+    )
+    moved = migrate_image_blobs(engine, store, args.batch_size)
+    logger.info("Done: %d images moved", moved)
+    create_indexes(engine)
+    logger.info("Done: indexes created")
+
+
+if __name__ == "__main__":
+    main()
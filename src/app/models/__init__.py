@@ -1,6 +1,18 @@
 from app.db.database import Base
 
+from .blob import BlobORM
 from .image import ImageORM
+from .job import JobORM
+from .prediction import PredictionCacheORM
+from .usage import UsageORM
 from .user import UserORM
 
-__all__ = ["Base", "ImageORM", "UserORM"]
+__all__ = [
+    "Base",
+    "BlobORM",
+    "ImageORM",
+    "JobORM",
+    "PredictionCacheORM",
+    "UsageORM",
+    "UserORM",
+]
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+from sqlalchemy import TIMESTAMP, BigInteger, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db.database import Base
+
+
+class BlobORM(Base):
+    """
+    An image in the blob store, shared by the images with the same content.
+    """
+
+    __tablename__ = "blob"
+
+    # SHA-256 of the content, its key in the blob store
+    hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    size: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    mime_type: Mapped[str] = mapped_column(String(64), nullable=False)
+    # Number of images referencing it, collected once 0
+    refcount: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    creationdate: Mapped[datetime] = mapped_column(
+        TIMESTAMP(timezone=True), nullable=False
+    )
+    updatedate: Mapped[datetime] = mapped_column(
+        TIMESTAMP(timezone=True), nullable=False
+    )
@@ -1,13 +1,18 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+
 from sqlalchemy import (
     TIMESTAMP,
-    Column,
+    BigInteger,
     ForeignKey,
+    Index,
     Integer,
     LargeBinary,
     Numeric,
     String,
+    desc,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
 
 from app.db.database import Base
@@ -15,18 +20,46 @@ from app.db.database import Base
 
 class ImageORM(Base):
     __tablename__ = "image"
+    # The history of a user, most recent first, and its keyset pagination
+    __table_args__ = (
+        Index(
+            "ix_image_user_id_creationdate_id",
+            "user_id",
+            desc("creationdate"),
+            desc("id"),
+        ),
+    )
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    filename = Column(String(255), nullable=False)
-    image_data = Column(LargeBinary, nullable=False)
-    label = Column(String(255), nullable=True)
-    probability = Column(Numeric(5, 4), nullable=True)
-    user_id = Column(Integer, ForeignKey("user.id"), index=True, nullable=False)
+    id: Mapped[int] = mapped_column(
+        Integer, primary_key=True, autoincrement=True
+    )
+    filename: Mapped[str] = mapped_column(String(255), nullable=False)
+    # The content is in the blob store
+    blob_hash: Mapped[str] = mapped_column(
+        String(64), ForeignKey("blob.hash"), index=True, nullable=False
+    )
+    size: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    mime_type: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    label: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    probability: Mapped[Decimal | None] = mapped_column(
+        Numeric(5, 4), nullable=True
+    )
+    model_version: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    # L2-normalized float16 embedding, searched by `/users/me/similar`
+    embedding: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    user_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("user.id"), index=True, nullable=False
+    )
 
-    creationdate = Column(
-        TIMESTAMP(timezone=True), nullable=False, server_default=func.now()
+    # Also set by Python, so that the rows of one transaction are ordered,
+    # and stored in the format of the bound cursors by SQLite
+    creationdate: Mapped[datetime] = mapped_column(
+        TIMESTAMP(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+        server_default=func.now(),
     )
-    updatedate = Column(
+    updatedate: Mapped[datetime | None] = mapped_column(
         TIMESTAMP(timezone=True), default=None, onupdate=func.now()
     )
 
@@ -0,0 +1,26 @@
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import TIMESTAMP, Integer, LargeBinary, Numeric, String
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.sql import func
+
+from app.db.database import Base
+
+
+class PredictionCacheORM(Base):
+    __tablename__ = "prediction_cache"
+
+    image_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    model_version: Mapped[str] = mapped_column(String(64), primary_key=True)
+    width: Mapped[int] = mapped_column(Integer, nullable=False)
+    height: Mapped[int] = mapped_column(Integer, nullable=False)
+    label: Mapped[str] = mapped_column(String(255), nullable=False)
+    probability: Mapped[Decimal | None] = mapped_column(
+        Numeric(5, 4), nullable=True
+    )
+    embedding: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+
+    creationdate: Mapped[datetime] = mapped_column(
+        TIMESTAMP(timezone=True), nullable=False, server_default=func.now()
+    )
@@ -0,0 +1,26 @@
+from datetime import datetime
+
+from sqlalchemy import TIMESTAMP, BigInteger, ForeignKey, Integer
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.sql import func
+
+from app.db.database import Base
+
+
+class UsageORM(Base):
+    __tablename__ = "user_usage"
+
+    user_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("user.id"), primary_key=True
+    )
+    images: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    throttled: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, default=0
+    )
+
+    updatedate: Mapped[datetime] = mapped_column(
+        TIMESTAMP(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        onupdate=func.now(),
+    )
@@ -1,6 +1,8 @@
-from sqlalchemy import TIMESTAMP, Boolean, Column, Integer, String
-from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from datetime import datetime
+
+from sqlalchemy import TIMESTAMP, Boolean, Float, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.sql import false, func
 
 from app.db.database import Base
 
@@ -8,16 +10,32 @@ from app.db.database import Base
 class UserORM(Base):
     __tablename__ = "user"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    username = Column(String, unique=True, index=True, nullable=False)
-    email = Column(String, unique=True, index=True, nullable=False)
-    hashed_password = Column(String, nullable=False)
-    is_active = Column(Boolean, default=True, nullable=False)
+    id: Mapped[int] = mapped_column(
+        Integer, primary_key=True, autoincrement=True
+    )
+    username: Mapped[str] = mapped_column(
+        String, unique=True, index=True, nullable=False
+    )
+    email: Mapped[str] = mapped_column(
+        String, unique=True, index=True, nullable=False
+    )
+    hashed_password: Mapped[str] = mapped_column(String, nullable=False)
+    is_active: Mapped[bool] = mapped_column(
+        Boolean, default=True, nullable=False
+    )
+    # Granted in the database, not through the API
+    is_superuser: Mapped[bool] = mapped_column(
+        Boolean, default=False, server_default=false(), nullable=False
+    )
+    # Share of the inference capacity and concurrent requests, the settings
+    # defaults if unset
+    inference_weight: Mapped[float | None] = mapped_column(Float, nullable=True)
+    max_concurrency: Mapped[int | None] = mapped_column(Integer, nullable=True)
 
-    creationdate = Column(
+    creationdate: Mapped[datetime] = mapped_column(
         TIMESTAMP(timezone=True), nullable=False, server_default=func.now()
     )
-    updatedate = Column(
+    updatedate: Mapped[datetime | None] = mapped_column(
         TIMESTAMP(timezone=True), default=None, onupdate=func.now()
     )
 
@@ -13,11 +13,24 @@ class Status(str, Enum):
     Error = "Error"
 
 
+class JobStatus(str, Enum):
+    """
+    Status of a classification job.
+    """
+
+    Queued = "queued"
+    Running = "running"
+    Succeeded = "succeeded"
+    Failed = "failed"
+
+
 class InferenceResult(BaseModel):
     """
     Inference result schema from the model.
     """
 
+    model_config = {"protected_namespaces": ()}
+
     filename: str = Field(description="Filename", examples=["dog.png"])
     width: int = Field(description="Image width", examples=[640], gt=0.0)
     height: int = Field(description="Image height", examples=[480], gt=0.0)
@@ -28,6 +41,23 @@ class InferenceResult(BaseModel):
         ge=0.0,
         le=1.0,
     )
+    reused: bool = Field(
+        default=False,
+        description="Prediction reused from a near-duplicate image",
+        examples=[False],
+    )
+    model: str | None = Field(
+        default=None,
+        description="Name of the model",
+        examples=["mobilenet_v3_large"],
+    )
+    model_version: str | None = Field(
+        default=None,
+        description="Version of the model weights",
+        examples=["8f3b2c4d5e6f7a81"],
+    )
+    # Stored with the image, not returned
+    embedding: bytes | None = Field(default=None, exclude=True)
 
     @field_validator("probability")
     def probability_format(cls, v):
@@ -43,6 +73,43 @@ class InferenceResponse(BaseModel):
     results: InferenceResult
 
 
+class BatchInferenceResult(BaseModel):
+    """
+    Result line streamed for each image when classifying a batch of images.
+    """
+
+    index: int = Field(description="Position of the image in the batch")
+    status: Status
+    results: InferenceResult | None = None
+    message: str | None = Field(
+        default=None,
+        description="Error message",
+        examples=["An error occurred while classifying the image."],
+    )
+
+
+class JobResponse(BaseModel):
+    """
+    Response schema when submitting or requesting a classification job.
+    """
+
+    id: str = Field(
+        description="Job id", examples=["3f2b8c1d9e4a4b6f8a7c5d2e1f0a9b8c"]
+    )
+    status: JobStatus
+    attempts: int = Field(description="Times the job was started", examples=[1])
+    results: InferenceResult | None = None
+    message: str | None = Field(
+        default=None,
+        description="Error message",
+        examples=["An error occurred while classifying the image."],
+    )
+    submitted_at: datetime = Field(description="Submission timestamp")
+    finished_at: datetime | None = Field(
+        default=None, description="Completion timestamp"
+    )
+
+
 class RegisterResponse(BaseModel):
     """
     Response schema when a user registers.
@@ -88,11 +155,36 @@ class UserCreate(UserResponse):
     )
 
 
+class QuotaResponse(BaseModel):
+    """
+    Response schema when requesting the quota of the current user.
+    """
+
+    weight: float = Field(
+        description="Share of the inference capacity", examples=[1.0]
+    )
+    max_concurrency: int = Field(
+        description="Maximum number of concurrent requests", examples=[4]
+    )
+    in_flight: int = Field(description="Requests in flight", examples=[0])
+    images_per_minute: float | None = Field(
+        description="Sustained rate of classified images, unlimited if null",
+        examples=[600.0],
+    )
+    burst: int | None = Field(
+        description="Images classified at once", examples=[256]
+    )
+    remaining: int | None = Field(
+        description="Images that can be classified now", examples=[256]
+    )
+
+
 class InferenceResultHistory(BaseModel):
     """
     Classification history schema.
     """
 
+    id: int = Field(description="Image id", examples=[42])
     filename: str = Field(description="Filename", examples=["dog.png"])
     label: str = Field(description="Image label", examples=["Dog"])
     probability: float = Field(
@@ -111,6 +203,38 @@ class InferenceResultHistoryResponse(BaseModel):
     status: Status
     username: str = Field(description="Username", examples=["JohnDoe"])
     history: list[InferenceResultHistory]
+    next_cursor: str | None = Field(
+        default=None,
+        description="Cursor of the next page, none on the last page",
+        examples=["WyIyMDI0LTAxLTAxVDAwOjAwOjAwIiwgNDJd"],
+    )
+
+
+class SimilarImage(BaseModel):
+    """
+    Past image similar to the queried one.
+    """
+
+    id: int = Field(description="Image id", examples=[42])
+    filename: str = Field(description="Filename", examples=["dog.png"])
+    label: str | None = Field(description="Image label", examples=["Dog"])
+    score: float = Field(
+        description="Cosine similarity of the embeddings",
+        examples=[0.8731],
+        ge=-1.0,
+        le=1.0,
+    )
+    upload_timestamp: datetime = Field(description="Timestamp")
+
+
+class SimilarImagesResponse(BaseModel):
+    """
+    Response schema when requesting the images similar to an image.
+    """
+
+    status: Status
+    image_id: int = Field(description="Queried image id", examples=[7])
+    similar: list[SimilarImage]
 
 
 class ErrorResponse(BaseModel):
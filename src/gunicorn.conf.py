@@ -0,0 +1,93 @@
+"""
+Pre-forked serving: `gunicorn app.main:app` from this directory.
+
+The master loads the classifier once and forks `SERVING_WORKERS` uvicorn
+workers, which share its weight pages copy-on-write. Each worker gets its
+share of the torch threads and, with `SERVING_CPU_AFFINITY`, its own cores.
+`GET /about/workers` reports the RSS and PSS of the master and workers, and
+`GET /metrics` the metrics summed over the workers.
+"""
+
+import gc
+import logging
+import os
+import shutil
+import tempfile
+
+import torch
+
+from app.core import serving
+from app.core.config import settings
+from app.core.metrics import registry as metrics_registry
+from app.core.setup import inference_threads, preload_models
+
+bind = "0.0.0.0:8000"
+workers = settings.SERVING_WORKERS
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+
+def on_starting(server):
+    # The workers flush their metrics here, for the scrapes of any worker
+    if metrics_registry.directory is None:
+        metrics_registry.directory = tempfile.mkdtemp(prefix="metrics-")
+    else:
+        # The counters restart with the server
+        metrics_registry.clear()
+
+
+def on_exit(server):
+    if settings.METRICS_DIR is None and metrics_registry.directory is not None:
+        shutil.rmtree(metrics_registry.directory, ignore_errors=True)
+
+
+def when_ready(server):
+    # Log the startup phases of the master like the workers do
+    logger = logging.getLogger("uvicorn.error")
+    logger.handlers = server.log.error_log.handlers
+    logger.setLevel(server.log.error_log.level)
+    # Forked workers inherit the inter-op pool size, which is fixed once used
+    torch.set_num_interop_threads(settings.SERVING_INTEROP_THREADS)
+    preload_models()
+    # Keep the collector from writing to, and unsharing, the preloaded objects
+    gc.freeze()
+    server.log.info("Model preloaded, master RSS/PSS: %s", _memory())
+
+
+def pre_fork(server, worker):
+    # Runs in the master, which keeps track of the slots in use
+    used = {getattr(w, "slot", None) for w in server.WORKERS.values()}
+    worker.slot = min(set(range(len(used) + 1)) - used)
+
+
+def post_fork(server, worker):
+    num_threads = inference_threads()
+    cpus = (
+        serving.worker_cpus(
+            worker.slot, max(1, len(os.sched_getaffinity(0)) // workers)
+        )
+        if settings.SERVING_CPU_AFFINITY
+        else None
+    )
+    serving.configure_worker(
+        worker.slot,
+        num_threads,
+        interop_threads=settings.SERVING_INTEROP_THREADS,
+        cpus=cpus,
+    )
+    server.log.info(
+        "Worker %s (slot %s): %s torch threads, cpus %s",
+        worker.pid,
+        worker.slot,
+        num_threads,
+        cpus or "all",
+    )
+
+
+def post_worker_init(worker):
+    worker.log.info("Worker %s RSS/PSS: %s", worker.pid, _memory())
+
+
+def _memory():
+    memory = serving.process_memory() or {}
+    return f"{memory.get('rss_kb')} kB / {memory.get('pss_kb')} kB"
@@ -1,16 +1,17 @@
 import os
 import pathlib
+from datetime import datetime, timezone
 
 import pytest
 from fastapi.testclient import TestClient
 from PIL import Image
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, make_url
 from sqlalchemy.exc import OperationalError as SQLAlchemyOperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import NullPool, StaticPool
 
 import app.models as models
-from app.api.dependencies import get_user
 from app.core.security import create_access_token, get_password_hash
 from app.db.database import Base, get_db
 from app.main import app
@@ -56,20 +57,37 @@ def setup_and_teardown_db(db_url):
 
     engine = create_engine(db_url, poolclass=StaticPool, echo=True)
     Base.metadata.create_all(bind=engine)
+    if engine.dialect.name == "sqlite":
+        # The test and the app sessions use their own connections, readers
+        # and the writer must not block each other
+        with engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA journal_mode=WAL")
 
     yield db_url
 
     Base.metadata.drop_all(bind=engine)
-    if db_path.exists():
-        os.remove(db_path)
+    engine.dispose()
+    for path in (db_path, db_path.with_name(f"{db_path.name}-wal")):
+        if path.exists():
+            os.remove(path)
+
+
+def async_url(db_url):
+    """The URL of the same database with the async driver."""
+    url = make_url(db_url)
+    drivers = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+    return url.set(drivername=drivers[url.get_backend_name()])
 
 
 @pytest.fixture(scope="function")
 def db_session(setup_and_teardown_db):
-    """Create a new database session with a rollback at the end of the test."""
+    """
+    Create a new database session, and delete the rows written by the test
+    at its end.
+    """
     # Create a SQLAlchemy engine
     db_url = setup_and_teardown_db
-    engine = create_engine(db_url, poolclass=StaticPool, echo=True)
+    engine = create_engine(db_url, echo=True)
 
     # Create a sessionmaker to manage sessions
     TestingSessionLocal = sessionmaker(
@@ -78,28 +96,51 @@ def db_session(setup_and_teardown_db):
 
     # Create tables in the database
     Base.metadata.create_all(bind=engine)
-    connection = engine.connect()
-    transaction = connection.begin()
-    session = TestingSessionLocal(bind=connection)
+    session = TestingSessionLocal()
 
     yield session
 
+    session.rollback()
+    for table in reversed(Base.metadata.sorted_tables):
+        session.execute(table.delete())
+    session.commit()
     session.close()
-    transaction.rollback()
-    connection.close()
+    engine.dispose()
+
+
+@pytest.fixture(scope="function")
+def async_session_factory(setup_and_teardown_db):
+    """
+    Sessions of the app, on the test database.
+    """
+    engine = create_async_engine(
+        async_url(setup_and_teardown_db), poolclass=NullPool
+    )
+    if engine.dialect.name == "sqlite":
+        # Wait for the writes of the test session instead of failing
+        @event.listens_for(engine.sync_engine, "connect")
+        def set_busy_timeout(connection, _):
+            connection.execute("PRAGMA busy_timeout=5000")
+
+    return async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 
 
 @pytest.fixture(scope="function")
-def test_client(db_session):
+def test_client(db_session, async_session_factory, monkeypatch):
     """Create a test client with a mocked db."""
 
-    def override_get_db():
-        try:
-            yield db_session
-        finally:
-            db_session.close()
+    async def override_get_db():
+        async with async_session_factory() as db:
+            yield db
 
     app.dependency_overrides[get_db] = override_get_db
+    # The sessions opened outside of the requests
+    monkeypatch.setattr(
+        "app.api.v1.ml.AsyncSessionLocal", async_session_factory
+    )
+    monkeypatch.setattr(
+        "app.api.v1.jobs.AsyncSessionLocal", async_session_factory
+    )
     with TestClient(app) as test_client:
         yield test_client
 
@@ -109,6 +150,29 @@ def mock_init_db(monkeypatch):
     monkeypatch.setattr("app.core.setup.init_db", lambda: None)
 
 
+@pytest.fixture(autouse=True)
+def skip_warmup(monkeypatch):
+    monkeypatch.setattr("app.core.setup.settings.WARMUP_PASSES", 0)
+
+
+@pytest.fixture(autouse=True)
+def skip_usage_flush(monkeypatch):
+    monkeypatch.setattr("app.core.setup.settings.QUOTA_FLUSH_INTERVAL", 0)
+
+
+@pytest.fixture(autouse=True)
+def skip_job_workers(monkeypatch):
+    monkeypatch.setattr("app.core.setup.settings.JOB_WORKERS", 0)
+
+
+@pytest.fixture(autouse=True)
+def blob_store_dir(tmp_path, monkeypatch):
+    directory = tmp_path / "blobs"
+    monkeypatch.setattr("app.core.setup.settings.BLOB_STORE_DIR", directory)
+    monkeypatch.setattr("app.core.setup.settings.BLOB_GC_INTERVAL", 0)
+    return directory
+
+
 # --------------------------------- Fake Data ---------------------------------
 @pytest.fixture
 def image():
@@ -134,7 +198,22 @@ def user_db(user_payload, db_session):
     )
     db_session.add(new_user)
     db_session.commit()
-    return get_user(user_payload["username"], db_session)
+    return new_user
+
+
+@pytest.fixture
+def blob_hash(db_session):
+    blob = models.BlobORM(
+        hash="0" * 64,
+        size=2,
+        mime_type="image/png",
+        refcount=0,
+        creationdate=datetime.now(timezone.utc),
+        updatedate=datetime.now(timezone.utc),
+    )
+    db_session.add(blob)
+    db_session.commit()
+    return blob.hash
 
 
 @pytest.fixture
@@ -142,6 +221,13 @@ def access_token(user_payload, user_db):
     return create_access_token(data={"sub": user_payload["username"]})
 
 
+@pytest.fixture
+def admin_token(user_db, access_token, db_session):
+    user_db.is_superuser = True
+    db_session.commit()
+    return access_token
+
+
 # ------------------------------- API Endpoints -------------------------------
 @pytest.fixture
 def healthchecker_endpoint():
@@ -153,11 +239,76 @@ def about_endpoint():
     return "/api/v1/about"
 
 
+@pytest.fixture
+def ready_endpoint():
+    return "/api/v1/ready"
+
+
+@pytest.fixture
+def profile_endpoint():
+    return "/api/v1/admin/profile"
+
+
+@pytest.fixture
+def slow_requests_endpoint():
+    return "/api/v1/admin/slow-requests"
+
+
+@pytest.fixture
+def metrics_endpoint():
+    return "/metrics"
+
+
+@pytest.fixture
+def workers_endpoint():
+    return "/api/v1/about/workers"
+
+
 @pytest.fixture
 def predict_endpoint():
     return "/api/v1/ml/predict"
 
 
+@pytest.fixture
+def predict_raw_endpoint():
+    return "/api/v1/ml/predict/raw"
+
+
+@pytest.fixture
+def predict_batch_endpoint():
+    return "/api/v1/ml/predict/batch"
+
+
+@pytest.fixture
+def cache_endpoint():
+    return "/api/v1/ml/cache"
+
+
+@pytest.fixture
+def models_endpoint():
+    return "/api/v1/ml/models"
+
+
+@pytest.fixture
+def queue_endpoint():
+    return "/api/v1/ml/queue"
+
+
+@pytest.fixture
+def persistence_endpoint():
+    return "/api/v1/ml/persistence"
+
+
+@pytest.fixture
+def quota_endpoint():
+    return "/api/v1/users/me/quota"
+
+
+@pytest.fixture
+def jobs_endpoint():
+    return "/api/v1/ml/jobs"
+
+
 @pytest.fixture
 def register_endpoint():
     return "/api/v1/auth/register"
@@ -181,3 +332,13 @@ def read_user_me_endpoint():
 @pytest.fixture
 def history_endpoint():
     return "/api/v1/users/me/history"
+
+
+@pytest.fixture
+def similar_endpoint():
+    return "/api/v1/users/me/similar"
+
+
+@pytest.fixture
+def images_endpoint():
+    return "/api/v1/users/me/images"
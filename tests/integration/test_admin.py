@@ -0,0 +1,136 @@
+import io
+
+import pytest
+import torch
+
+from app.core import profiling, tracing
+from app.core.setup import ml_models
+
+
+@pytest.fixture
+def png_file(image):
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return {"file": ("red.png", buf.getvalue())}
+
+
+@pytest.fixture
+def mock_image_classifier(monkeypatch):
+    class MockImageClassifier:
+        def decode(self, image):
+            return image
+
+        def preprocess(self, image):
+            return torch.zeros(3, 224, 224)
+
+        def predict_category_embedding_batch(self, batch):
+            return [("mock_category", 0.99, None)] * len(batch)
+
+    served = ml_models["model_registry"].get()
+    monkeypatch.setattr(served, "classifier", MockImageClassifier())
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_profile_requires_admin(test_client, profile_endpoint, access_token):
+    response = test_client.post(profile_endpoint, params={"kind": "python"})
+    assert response.status_code == 401
+
+    response = test_client.post(
+        profile_endpoint,
+        params={"kind": "python"},
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert response.status_code == 403
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_profile(test_client, profile_endpoint, admin_token, monkeypatch):
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    response = test_client.post(
+        profile_endpoint,
+        params={"kind": "python", "seconds": 0.1},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == (
+        'attachment; filename="python-profile.folded"'
+    )
+    assert profiling.active is None
+
+    response = test_client.post(
+        profile_endpoint,
+        params={"kind": "torch", "seconds": 1000},
+        headers=headers,
+    )
+    assert response.status_code == 422
+
+    monkeypatch.setattr(
+        profiling, "active", profiling.SamplingCapture(seconds=1)
+    )
+    response = test_client.post(
+        profile_endpoint, params={"kind": "torch"}, headers=headers
+    )
+    assert response.status_code == 409
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_slow_requests(
+    test_client,
+    slow_requests_endpoint,
+    predict_endpoint,
+    png_file,
+    admin_token,
+    mock_image_classifier,
+    monkeypatch,
+):
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    monkeypatch.setattr(tracing.recorder, "threshold", 0)
+    tracing.recorder.clear()
+
+    response = test_client.post(
+        predict_endpoint, files=png_file, headers=headers
+    )
+    assert response.status_code == 200
+    stages = dict(
+        metric.split(";dur=")
+        for metric in response.headers["server-timing"].split(", ")
+    )
+    for stage in [
+        "verify_token",
+        "get_user",
+        "upload",
+        "decode",
+        "preprocess",
+        "batch_queue",
+        "forward",
+        "db_commit",
+        "total",
+    ]:
+        assert float(stages[stage]) >= 0
+
+    response = test_client.get(
+        slow_requests_endpoint,
+        params={"limit": 10, "clear": True},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    (record,) = [
+        record
+        for record in response.json()
+        if record["route"] == "/api/v1/ml/predict"
+    ]
+    assert record["status"] == 200
+    assert record["images"] == [
+        {"width": 400, "height": 400, "bytes": len(png_file["file"][1])}
+    ]
+    assert record["inferences"][0]["batch_size"] == 1
+    assert set(record["stages_ms"]) >= {"decode", "forward", "db_commit"}
+
+    response = test_client.get(slow_requests_endpoint, headers=headers)
+    # Only the previous dump was recorded since
+    assert [record["route"] for record in response.json()] == [
+        "/api/v1/admin/slow-requests"
+    ]
@@ -1,22 +1,30 @@
-from datetime import timedelta
+import asyncio
+from datetime import datetime, timedelta, timezone
 
 import bcrypt
+import numpy as np
 import pytest
 
 import app.models as models
 from app.api.dependencies import get_user
+from app.core.config import settings
+from app.core.ml import similarity
 from app.core.security import create_access_token
 from app.db.database import TokenBlacklistORM
 
 
 @pytest.mark.integration
-def test_get_user(user_payload, db_session, user_db):
-    user = get_user(user_payload["username"], db_session)
+def test_get_user(user_payload, async_session_factory, user_db):
+    async def fetch(username):
+        async with async_session_factory() as db:
+            return await get_user(username, db)
+
+    user = asyncio.run(fetch(user_payload["username"]))
     assert user
     assert user.username == user_payload["username"]
     assert user.email == user_payload["email"]
 
-    user = get_user("inexistent_user", db_session)
+    user = asyncio.run(fetch("inexistent_user"))
     assert user is None
 
 
@@ -153,7 +161,12 @@ def test_read_user_me(
 @pytest.mark.api
 @pytest.mark.integration
 def test_get_history(
-    test_client, history_endpoint, access_token, user_payload, db_session
+    test_client,
+    history_endpoint,
+    access_token,
+    user_payload,
+    db_session,
+    blob_hash,
 ):
     response = test_client.get(history_endpoint)
     assert response.status_code == 401
@@ -161,28 +174,28 @@ def test_get_history(
     images = [
         models.ImageORM(
             filename="test1.png",
-            image_data=b"\x00\x01",
+            blob_hash=blob_hash,
             label="category1",
             probability="0.2",
             user_id=1,
         ),
         models.ImageORM(
             filename="test2.png",
-            image_data=b"\x04\x05",
+            blob_hash=blob_hash,
             label="category2",
             probability="0.8",
             user_id=1,
         ),
         models.ImageORM(
             filename="test3.png",
-            image_data=b"\x08\x09",
+            blob_hash=blob_hash,
             label="category3",
             probability="0.6",
             user_id=1,
         ),
         models.ImageORM(
             filename="test4.png",
-            image_data=b"\x08\x09",
+            blob_hash=blob_hash,
             label="category3",
             probability="0.6",
             user_id=2,
@@ -202,9 +215,10 @@ def test_get_history(
 
     history = response_data["history"]
     assert len(history) == 3
-    assert history[0]["filename"] == "test1.png"
+    assert history[0]["filename"] == "test3.png"
     assert history[1]["filename"] == "test2.png"
-    assert history[2]["filename"] == "test3.png"
+    assert history[2]["filename"] == "test1.png"
+    assert response_data["next_cursor"] is None
 
     response = test_client.get(
         history_endpoint,
@@ -218,5 +232,194 @@ def test_get_history(
 
     history = response_data["history"]
     assert len(history) == 2
-    assert history[0]["filename"] == "test1.png"
+    assert history[0]["filename"] == "test3.png"
     assert history[1]["filename"] == "test2.png"
+    assert response_data["next_cursor"] is not None
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_get_history_pages(
+    test_client, history_endpoint, access_token, db_session, blob_hash
+):
+    # The same timestamp, as for the rows of a batch on PostgreSQL
+    creationdate = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    db_session.add_all(
+        models.ImageORM(
+            filename=f"test{i}.png",
+            blob_hash=blob_hash,
+            label="category",
+            probability="0.5",
+            user_id=1,
+            creationdate=creationdate,
+        )
+        for i in range(5)
+    )
+    db_session.add(
+        models.ImageORM(
+            filename="latest.png",
+            blob_hash=blob_hash,
+            label="category",
+            probability="0.5",
+            user_id=1,
+        )
+    )
+    db_session.commit()
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    filenames: list[str] = []
+    cursor = None
+    for _ in range(3):
+        params = {"limit": 2}
+        if cursor is not None:
+            params["cursor"] = cursor
+        response = test_client.get(
+            history_endpoint, headers=headers, params=params
+        )
+        assert response.status_code == 200
+        filenames.extend(
+            image["filename"] for image in response.json()["history"]
+        )
+        cursor = response.json()["next_cursor"]
+    assert cursor is None
+    assert filenames == [
+        "latest.png",
+        "test4.png",
+        "test3.png",
+        "test2.png",
+        "test1.png",
+        "test0.png",
+    ]
+
+    response = test_client.get(
+        history_endpoint, headers=headers, params={"cursor": "not a cursor"}
+    )
+    assert response.status_code == 400
+    response = test_client.get(
+        history_endpoint,
+        headers=headers,
+        params={"limit": settings.HISTORY_MAX_LIMIT + 1},
+    )
+    assert response.status_code == 422
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_get_similar_images(
+    test_client,
+    similar_endpoint,
+    access_token,
+    db_session,
+    blob_hash,
+    monkeypatch,
+):
+    def embedding(*values):
+        vector = np.array(values, dtype=np.float32)
+        return (vector / np.linalg.norm(vector)).astype(np.float16).tobytes()
+
+    images = [
+        models.ImageORM(
+            filename=filename,
+            blob_hash=blob_hash,
+            label="category",
+            model_version="v1",
+            embedding=vector,
+            user_id=user_id,
+        )
+        for filename, vector, user_id in [
+            ("query.png", embedding(1, 0, 0), 1),
+            ("close.png", embedding(1, 0.5, 0), 1),
+            ("far.png", embedding(0, 0, 1), 1),
+            ("closer.png", embedding(1, 0.2, 0), 1),
+            ("other_user.png", embedding(1, 0, 0), 2),
+            ("no_embedding.png", None, 1),
+        ]
+    ]
+    db_session.add_all(images)
+    db_session.commit()
+    ids = [image.id for image in images]
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    response = test_client.get(
+        similar_endpoint,
+        params={"image_id": ids[0], "limit": 2},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    response_data = response.json()
+    assert response_data["image_id"] == ids[0]
+    similar = response_data["similar"]
+    assert [image["filename"] for image in similar] == [
+        "closer.png",
+        "close.png",
+    ]
+    assert similar[0]["score"] > similar[1]["score"] > 0.8
+
+    # Caught up with the images classified since the last search, without
+    # comparing every id
+    def compare_ids(index):
+        raise AssertionError("The ids were compared")
+
+    monkeypatch.setattr(similarity, "indexed_ids", compare_ids)
+    db_session.add(
+        models.ImageORM(
+            filename="same.png",
+            blob_hash=blob_hash,
+            model_version="v1",
+            embedding=embedding(1, 0, 0),
+            user_id=1,
+        )
+    )
+    db_session.commit()
+    response = test_client.get(
+        similar_endpoint,
+        params={"image_id": ids[0], "limit": 1},
+        headers=headers,
+    )
+    assert response.json()["similar"][0]["filename"] == "same.png"
+    monkeypatch.undo()
+
+    # Committed after a newer image
+    for filename, image_id, vector in [
+        ("newer.png", max(ids) + 10, embedding(0, 1, 0)),
+        ("late.png", max(ids) + 5, embedding(1, 0.01, 0)),
+    ]:
+        db_session.add(
+            models.ImageORM(
+                id=image_id,
+                filename=filename,
+                blob_hash=blob_hash,
+                model_version="v1",
+                embedding=vector,
+                user_id=1,
+            )
+        )
+        db_session.commit()
+        response = test_client.get(
+            similar_endpoint,
+            params={"image_id": ids[0], "limit": 2},
+            headers=headers,
+        )
+    assert [image["filename"] for image in response.json()["similar"]] == [
+        "same.png",
+        "late.png",
+    ]
+
+    # Deleted by another worker
+    db_session.query(models.ImageORM).filter_by(filename="same.png").delete()
+    db_session.commit()
+    response = test_client.get(
+        similar_endpoint,
+        params={"image_id": ids[0], "limit": 2},
+        headers=headers,
+    )
+    assert [image["filename"] for image in response.json()["similar"]] == [
+        "late.png",
+        "closer.png",
+    ]
+
+    for image_id, status_code in [(ids[4], 404), (ids[5], 422)]:
+        response = test_client.get(
+            similar_endpoint, params={"image_id": image_id}, headers=headers
+        )
+        assert response.status_code == status_code
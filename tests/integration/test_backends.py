@@ -0,0 +1,104 @@
+import pytest
+import torch
+from PIL import Image
+
+from app.core.ml.backends import build_model, create_backend, load_model
+from app.core.ml.cnn_model import ImageClassifier, Preprocessor
+
+BACKEND_OPTIONS = [
+    pytest.param(("torch", {}), id="torch"),
+    pytest.param(("torch", {"engine": "torchscript"}), id="torchscript"),
+    pytest.param(("onnxruntime", {"intra_op_threads": 1}), id="onnxruntime"),
+]
+
+
+@pytest.fixture
+def model_path():
+    return "tests/data/mobilenet_v3_large.pth"
+
+
+@pytest.fixture
+def categories_path():
+    return "tests/data/imagenet_classes.txt"
+
+
+@pytest.fixture
+def batch():
+    preprocessor = Preprocessor()
+    images = [
+        Image.open("tests/data/dog.jpg"),
+        Image.new("RGB", (300, 400), color="blue"),
+        Image.new("RGB", (640, 480), color="white"),
+    ]
+    return torch.stack([preprocessor(image) for image in images])
+
+
+@pytest.fixture(params=BACKEND_OPTIONS)
+def image_classifier(request, model_path, categories_path, tmp_path):
+    backend, options = request.param
+    if backend == "onnxruntime":
+        pytest.importorskip("onnxruntime")
+    return ImageClassifier(
+        model_path,
+        categories_path,
+        backend=backend,
+        cache_dir=str(tmp_path),
+        **options,
+    )
+
+
+@pytest.mark.integration
+def test_backend_forward(image_classifier, batch):
+    backend = image_classifier._backend
+    logits = backend.forward(batch)
+    assert logits.shape == (3, 1000)
+    assert backend.version is not None
+    assert image_classifier.metadata["backend"] == backend.name
+    assert image_classifier.load_timings
+    image_classifier.warmup(batch_sizes=(1, 2))
+
+
+@pytest.mark.integration
+def test_load_model_on_meta_device(model_path, batch):
+    model = load_model(model_path)
+    tensors = [*model.parameters(), *model.buffers()]
+    assert not any(tensor.is_meta for tensor in tensors)
+
+    reference = build_model().eval()
+    reference.load_state_dict(torch.load(model_path, weights_only=True))
+    with torch.no_grad():
+        logits, embeddings = model(batch)
+        assert torch.equal(logits, reference(batch))
+    # Pooled features of the last convolution of MobileNetV3 large
+    assert embeddings.shape == (len(batch), 960)
+
+
+@pytest.mark.integration
+def test_backend_top_k_matches_torch(
+    image_classifier, batch, model_path, categories_path
+):
+    reference = ImageClassifier(model_path, categories_path, device="cpu")
+
+    expected = reference.top_k_batch(batch, k=5)
+    actual = image_classifier.top_k_batch(batch, k=5)
+    for expected_row, actual_row in zip(expected, actual):
+        assert [label for label, _ in actual_row] == [
+            label for label, _ in expected_row
+        ]
+        for (_, expected_prob), (_, actual_prob) in zip(
+            expected_row, actual_row
+        ):
+            assert actual_prob == pytest.approx(expected_prob, abs=1e-4)
+
+
+@pytest.mark.integration
+def test_unknown_backend(model_path):
+    with pytest.raises(ValueError):
+        create_backend("tensorflow", model_path)
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("name", ["torch", "onnxruntime"])
+def test_backend_missing_weights(name):
+    with pytest.raises(ValueError):
+        create_backend(name, "missing.pth").load()
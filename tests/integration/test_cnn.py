@@ -3,6 +3,7 @@ import torch
 from PIL import Image
 
 from app.core.ml.cnn_model import ImageClassifier
+from app.core.ml.quantization import compare_classifiers, list_images
 
 
 @pytest.fixture
@@ -18,7 +19,7 @@ def categories_path():
 @pytest.mark.integration
 def test_load_model(model_path, categories_path):
     image_classigier = ImageClassifier(model_path, categories_path)
-    assert image_classigier._model is not None
+    assert image_classigier._backend is not None
     assert image_classigier._categories is not None
 
 
@@ -48,3 +49,103 @@ def test_predict(model_path, categories_path):
     assert probabilities.shape == torch.Size([1000])
     assert max_index == 258  # Category: Samoyed
     assert probabilities[max_index] == pytest.approx(0.9736, rel=1e-3)
+
+
+@pytest.mark.integration
+def test_predict_batch(model_path, categories_path):
+    image_classifier = ImageClassifier(model_path, categories_path)
+    images = [
+        Image.open("tests/data/dog.jpg"),
+        Image.new("RGB", (300, 400), color="blue"),
+    ]
+    batch = torch.stack([image_classifier.preprocess(i) for i in images])
+
+    probabilities = image_classifier.predict_batch(batch)
+    assert probabilities.shape == torch.Size([2, 1000])
+    for image, row in zip(images, probabilities):
+        assert torch.allclose(image_classifier.predict(image), row, atol=1e-5)
+
+    top_k = image_classifier.top_k_batch(batch, k=3)
+    assert len(top_k) == 2
+    assert all(len(predictions) == 3 for predictions in top_k)
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("channels_last", [False, True])
+def test_torchscript_engine(
+    model_path, categories_path, tmp_path, channels_last
+):
+    eager_classifier = ImageClassifier(model_path, categories_path)
+    image_classifier = ImageClassifier(
+        model_path,
+        categories_path,
+        engine="torchscript",
+        channels_last=channels_last,
+        cache_dir=str(tmp_path),
+    )
+    assert len(list(tmp_path.iterdir())) == 1
+
+    image = Image.open("tests/data/dog.jpg")
+    batch = eager_classifier.preprocess(image).unsqueeze(0)
+    assert torch.allclose(
+        image_classifier.predict_batch(batch),
+        eager_classifier.predict_batch(batch),
+        atol=1e-4,
+    )
+
+
+@pytest.fixture
+def calibration_dir(tmp_path):
+    image = Image.open("tests/data/dog.jpg").convert("RGB")
+    calibration_dir = tmp_path / "calibration"
+    calibration_dir.mkdir()
+    for i, angle in enumerate([0, 90, 180, 270]):
+        image.rotate(angle).save(calibration_dir / f"{i}.jpg")
+    return calibration_dir
+
+
+@pytest.mark.integration
+def test_int8_quantization(
+    model_path, categories_path, calibration_dir, tmp_path
+):
+    cache_dir = tmp_path / "cache"
+    reference = ImageClassifier(model_path, categories_path, device="cpu")
+    image_classifier = ImageClassifier(
+        model_path,
+        categories_path,
+        device="cpu",
+        quantization="x86",
+        calibration_dir=str(calibration_dir),
+        cache_dir=str(cache_dir),
+    )
+    assert image_classifier.version == f"{reference.version}-int8-x86"
+    assert len(list(cache_dir.iterdir())) == 1
+
+    # The persisted model is loaded without calibrating again
+    persisted_classifier = ImageClassifier(
+        model_path,
+        categories_path,
+        device="cpu",
+        quantization="x86",
+        cache_dir=str(cache_dir),
+    )
+
+    image_paths = list_images(str(calibration_dir))
+    report = compare_classifiers(
+        image_classifier, persisted_classifier, image_paths
+    )
+    assert report["images"] == 4
+    assert report["top1_agreement"] == 1.0
+    assert report["category_agreement"] == 1.0
+
+    report = compare_classifiers(reference, image_classifier, image_paths)
+    assert 0.0 <= report["top1_agreement"] <= 1.0
+    assert 0.0 <= report["candidate_unknown_ratio"] <= 1.0
+
+
+@pytest.mark.integration
+def test_int8_quantization_requires_calibration(model_path, categories_path):
+    with pytest.raises(ValueError):
+        ImageClassifier(
+            model_path, categories_path, device="cpu", quantization="x86"
+        )
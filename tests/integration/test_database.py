@@ -1,8 +1,12 @@
+import asyncio
 from datetime import datetime
 
 import pytest
 
+from app.core.ml.cache import Prediction, PredictionCache
+from app.core.quotas import QuotaManager
 from app.db.database import TokenBlacklistORM
+from app.models import PredictionCacheORM, UsageORM
 
 
 @pytest.mark.integration
@@ -18,3 +22,48 @@ def test_create_token_blacklist(db_session):
     assert result is not None
     assert result.token == token
     assert result.expires_at == expires_at
+
+
+@pytest.mark.integration
+def test_shared_prediction_cache(db_session, async_session_factory):
+    calls = []
+
+    async def model():
+        calls.append(1)
+        return Prediction(400, 300, "dog", 0.9)
+
+    async def run(cache):
+        return await cache.get_or_compute(b"image", model)
+
+    # Each worker has its own in-process tier
+    for _ in range(2):
+        cache = PredictionCache(
+            model_version="v1", session_factory=async_session_factory
+        )
+        assert asyncio.run(run(cache)) == Prediction(400, 300, "dog", 0.9)
+    assert len(calls) == 1
+    assert cache.stats()["shared_hits"] == 1
+
+    # Entries of another model version are ignored, then purged
+    cache = PredictionCache(
+        model_version="v2", session_factory=async_session_factory
+    )
+    asyncio.run(run(cache))
+    assert len(calls) == 2
+    cache.purge_stale(db_session)
+    assert db_session.query(PredictionCacheORM).count() == 1
+
+
+@pytest.mark.integration
+def test_flush_usage(db_session, user_db):
+    quotas = QuotaManager()
+    for _ in range(2):
+        for images in [1, 3]:
+            with quotas.acquire(user_db, images=images):
+                pass
+        assert quotas.flush(db_session) == 1
+
+    usage = db_session.get(UsageORM, user_db.id)
+    assert usage.images == 8
+    assert usage.throttled == 0
+    assert quotas.flush(db_session) == 0
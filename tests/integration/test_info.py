@@ -1,4 +1,10 @@
+import threading
+import time
+
 import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
 
 
 @pytest.mark.api
@@ -14,3 +20,44 @@ def test_healthchecker(test_client, healthchecker_endpoint):
 def test_show_about(test_client, about_endpoint):
     response = test_client.get(about_endpoint)
     assert response.status_code == 200
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_show_workers_memory(test_client, workers_endpoint):
+    response = test_client.get(workers_endpoint)
+    assert response.status_code == 200
+
+    (worker,) = response.json()["workers"]
+    assert worker["rss_kb"] > 0
+    assert worker["pss_kb"] <= worker["rss_kb"]
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_readiness_checker(monkeypatch, ready_endpoint):
+    warmed_up = threading.Event()
+    warmup_calls = []
+
+    def mock_warmup(batch_sizes, repeat, model):
+        warmup_calls.append((batch_sizes, repeat, model.spec.name))
+        warmed_up.wait(timeout=10)
+
+    monkeypatch.setattr("app.core.setup.warmup", mock_warmup)
+    monkeypatch.setattr("app.core.setup.settings.WARMUP_PASSES", 2)
+    monkeypatch.setattr("app.core.setup.settings.WARMUP_BATCH_SIZES", "1,4")
+
+    with TestClient(app) as test_client:
+        response = test_client.get(ready_endpoint)
+        assert response.status_code == 503
+        assert response.json()["detail"] == "The model is warming up."
+
+        warmed_up.set()
+        for _ in range(100):
+            response = test_client.get(ready_endpoint)
+            if response.status_code == 200:
+                break
+            time.sleep(0.05)
+        assert response.status_code == 200
+        assert response.json() == {"message": "The API is READY!"}
+    assert warmup_calls == [((1, 4), 2, "mobilenet_v3_large")]
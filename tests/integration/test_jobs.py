@@ -0,0 +1,117 @@
+import io
+
+import numpy as np
+import pytest
+import torch
+
+from app.api.v1.jobs import process_next_job
+from app.core.jobs import JobQueue
+from app.core.setup import ml_models
+from app.models import ImageORM
+
+
+@pytest.fixture
+def png_bytes(image):
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.mark.integration
+def test_crashed_jobs_are_retried(db_session, user_db):
+    queue = JobQueue(worker_id="worker-1", lease_seconds=0, max_attempts=2)
+    job = queue.submit(db_session, user_db.id, "red.png", b"image")
+
+    # The lease of the first worker expires as if it crashed
+    assert queue.claim(db_session) is job
+    assert job.status == "running"
+    assert queue.claim(db_session) is job
+    assert job.attempts == 2
+
+    assert queue.claim(db_session) is None
+    assert job.status == "failed"
+
+    queue = JobQueue(lease_seconds=60)
+    other = queue.submit(db_session, user_db.id, "red.png", b"image")
+    assert queue.claim(db_session) is other
+    assert queue.claim(db_session) is None
+    assert job.image_data is None
+
+
+@pytest.mark.integration
+def test_expired_claims_cannot_finish(db_session, user_db):
+    stalled = JobQueue(worker_id="worker-1", lease_seconds=0)
+    job = stalled.submit(db_session, user_db.id, "red.png", b"image")
+    assert stalled.claim(db_session) is job
+
+    queue = JobQueue(worker_id="worker-2", lease_seconds=60)
+    assert queue.claim(db_session) is job
+    # The first worker lost its claim when its lease expired
+    assert not stalled.renew(db_session, job.id, 1)
+    assert not stalled.complete(db_session, job.id, 1, {})
+    assert queue.renew(db_session, job.id, 2)
+    assert queue.fail(db_session, job.id, 2, "error")
+    db_session.refresh(job)
+    assert job.status == "failed"
+    assert job.error == "error"
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_classification_job(
+    test_client,
+    jobs_endpoint,
+    png_bytes,
+    db_session,
+    async_session_factory,
+    access_token,
+    monkeypatch,
+):
+    class MockImageClassifier:
+        def decode(self, image):
+            return image
+
+        def preprocess(self, image):
+            return torch.zeros(3, 224, 224)
+
+        def predict_category_batch(self, batch):
+            return [("mock_category", 0.99)] * len(batch)
+
+        def predict_category_embedding_batch(self, batch):
+            embedding = np.ones(8, dtype=np.float16) / np.sqrt(8)
+            return [("mock_category", 0.99, embedding.tobytes())] * len(batch)
+
+    registry = ml_models["model_registry"]
+    monkeypatch.setattr(registry.get(), "classifier", MockImageClassifier())
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    response = test_client.post(
+        jobs_endpoint, files={"file": ("red.png", png_bytes)}, headers=headers
+    )
+    assert response.status_code == 202
+    job = response.json()
+    assert job["status"] == "queued"
+
+    # Long poll until the timeout while no worker runs
+    response = test_client.get(
+        f"{jobs_endpoint}/{job['id']}", params={"wait": 0.1}, headers=headers
+    )
+    assert response.status_code == 200
+    assert response.json()["status"] == "queued"
+
+    async def process():
+        async with async_session_factory() as db:
+            return await process_next_job(ml_models["job_queue"], db, registry)
+
+    assert test_client.portal.call(process)
+    response = test_client.get(
+        f"{jobs_endpoint}/{job['id']}", params={"wait": 10}, headers=headers
+    )
+    assert response.status_code == 200
+    assert response.json()["status"] == "succeeded"
+    assert response.json()["results"]["prediction"] == "mock_category"
+    assert response.json()["attempts"] == 1
+    assert db_session.query(ImageORM).filter_by(filename="red.png").count()
+
+    response = test_client.get(f"{jobs_endpoint}/unknown", headers=headers)
+    assert response.status_code == 404
@@ -1,8 +1,16 @@
 import io
+import json
+import time
+import zipfile
 
+import numpy as np
 import pytest
+import torch
 
 import app.models as models
+from app.core.config import settings
+from app.core.ml.phash import NearDuplicateIndex
+from app.core.quotas import QuotaManager
 from app.core.setup import ml_models
 
 
@@ -17,10 +25,21 @@ def image_file(image):
 @pytest.fixture(scope="function")
 def mock_image_classifier(monkeypatch):
     class MockImageClassifier:
-        def predict_category(self, image):
-            return "mock_category", 0.99
+        def decode(self, image):
+            return image
 
-    monkeypatch.setitem(ml_models, "image_classifier", MockImageClassifier())
+        def preprocess(self, image):
+            return torch.zeros(3, 224, 224)
+
+        def predict_category_batch(self, batch):
+            return [("mock_category", 0.99)] * len(batch)
+
+        def predict_category_embedding_batch(self, batch):
+            embedding = np.ones(8, dtype=np.float16) / np.sqrt(8)
+            return [("mock_category", 0.99, embedding.tobytes())] * len(batch)
+
+    served = ml_models["model_registry"].get()
+    monkeypatch.setattr(served, "classifier", MockImageClassifier())
 
 
 @pytest.mark.api
@@ -56,6 +75,7 @@ def test_predict(
     assert response_data["results"]["height"] == 400
     assert response_data["results"]["prediction"] == "mock_category"
     assert response_data["results"]["probability"] == 0.99
+    assert response_data["results"]["model"] == "mobilenet_v3_large"
 
     image = (
         db_session.query(models.ImageORM)
@@ -65,3 +85,490 @@ def test_predict(
     assert image is not None
     assert image.label == "mock_category"
     assert image.user_id == 1
+    assert image.model_version == response_data["results"]["model_version"]
+    assert image.model_version == ml_models["model_registry"].get().version
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_predict_unknown_model(
+    test_client, predict_endpoint, models_endpoint, image_file, admin_token
+):
+    response = test_client.post(
+        predict_endpoint,
+        params={"model": "resnet50"},
+        files=image_file,
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Unknown model: resnet50"
+
+    response = test_client.get(models_endpoint)
+    assert response.status_code == 401
+
+    response = test_client.get(
+        models_endpoint, headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["default"] == "mobilenet_v3_large"
+    assert [model["name"] for model in stats["loaded"]] == [
+        "mobilenet_v3_large"
+    ]
+
+
+@pytest.fixture(scope="function")
+def png_bytes(image):
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_predict_batch(
+    test_client,
+    predict_batch_endpoint,
+    png_bytes,
+    db_session,
+    access_token,
+    mock_image_classifier,
+):
+    files = [
+        ("files", ("batch1.png", png_bytes)),
+        ("files", ("batch2.png", png_bytes)),
+        ("files", ("not_an_image.png", b"not an image")),
+    ]
+
+    # Test Case 1: Without authentication
+    response = test_client.post(predict_batch_endpoint, files=files)
+    assert response.status_code == 401
+
+    # Test Case 2: With authentication
+    response = test_client.post(
+        predict_batch_endpoint,
+        files=files,
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    lines.sort(key=lambda line: line["index"])
+    assert [line["status"] for line in lines] == ["Success", "Success", "Error"]
+    assert lines[0]["results"]["filename"] == "batch1.png"
+    assert lines[1]["results"]["prediction"] == "mock_category"
+    assert lines[2]["results"] is None
+
+    images = (
+        db_session.query(models.ImageORM)
+        .filter(models.ImageORM.filename.like("batch%"))
+        .all()
+    )
+    assert sorted(image.filename for image in images) == [
+        "batch1.png",
+        "batch2.png",
+    ]
+    # The same content is stored once
+    assert images[0].blob_hash == images[1].blob_hash
+    assert images[0].size == len(png_bytes)
+    assert images[0].mime_type == "image/png"
+    blob = db_session.get(models.BlobORM, images[0].blob_hash)
+    assert blob.refcount == 2
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_get_and_delete_image(
+    test_client,
+    predict_endpoint,
+    images_endpoint,
+    png_bytes,
+    db_session,
+    access_token,
+    mock_image_classifier,
+    blob_store_dir,
+):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    for filename in ["first.png", "second.png"]:
+        response = test_client.post(
+            predict_endpoint,
+            files={"file": (filename, png_bytes)},
+            headers=headers,
+        )
+        assert response.status_code == 200
+    images = (
+        db_session.query(models.ImageORM)
+        .filter(models.ImageORM.filename.in_(["first.png", "second.png"]))
+        .order_by(models.ImageORM.id)
+        .all()
+    )
+    ids = [image.id for image in images]
+    digest = images[0].blob_hash
+    assert [
+        path.name for path in blob_store_dir.rglob("*") if path.is_file()
+    ] == [digest]
+
+    response = test_client.get(f"{images_endpoint}/{ids[0]}", headers=headers)
+    assert response.status_code == 200
+    assert response.content == png_bytes
+    assert response.headers["content-type"] == "image/png"
+
+    response = test_client.delete(
+        f"{images_endpoint}/{ids[0]}", headers=headers
+    )
+    assert response.status_code == 204
+    response = test_client.get(f"{images_endpoint}/{ids[0]}", headers=headers)
+    assert response.status_code == 404
+    # Still referenced by the second image
+    db_session.expire_all()
+    assert db_session.get(models.BlobORM, digest).refcount == 1
+    response = test_client.get(f"{images_endpoint}/{ids[1]}", headers=headers)
+    assert response.content == png_bytes
+
+    response = test_client.delete(
+        f"{images_endpoint}/{ids[1]}", headers=headers
+    )
+    assert response.status_code == 204
+    assert db_session.get(models.BlobORM, digest).refcount == 0
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_predict_batch_archive(
+    test_client,
+    predict_batch_endpoint,
+    png_bytes,
+    db_session,
+    access_token,
+    mock_image_classifier,
+):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as archive:
+        for i in range(3):
+            archive.writestr(f"images/archived{i}.png", png_bytes)
+
+    response = test_client.post(
+        predict_batch_endpoint,
+        files={"files": ("images.zip", buf.getvalue())},
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert response.status_code == 200
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line["index"] for line in lines) == [0, 1, 2]
+    assert all(line["status"] == "Success" for line in lines)
+    assert (
+        db_session.query(models.ImageORM)
+        .filter(models.ImageORM.filename.like("images/archived%"))
+        .count()
+        == 3
+    )
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_predict_cache(
+    test_client,
+    predict_endpoint,
+    cache_endpoint,
+    image_file,
+    admin_token,
+    mock_image_classifier,
+):
+    for _ in range(2):
+        image_file["file"][1].seek(0)
+        response = test_client.post(
+            predict_endpoint,
+            files=image_file,
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+        assert response.status_code == 200
+        assert response.json()["results"]["prediction"] == "mock_category"
+
+    response = test_client.get(
+        cache_endpoint, headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_predict_near_duplicate(
+    test_client,
+    predict_endpoint,
+    image,
+    access_token,
+    mock_image_classifier,
+    monkeypatch,
+):
+    monkeypatch.setattr(
+        ml_models["model_registry"].get(),
+        "near_duplicate_index",
+        NearDuplicateIndex(max_distance=4),
+    )
+
+    reused = []
+    for image_format in ["PNG", "JPEG"]:
+        buf = io.BytesIO()
+        image.save(buf, format=image_format)
+        response = test_client.post(
+            predict_endpoint,
+            files={"file": (f"red.{image_format.lower()}", buf.getvalue())},
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+        assert response.status_code == 200
+        assert response.json()["results"]["prediction"] == "mock_category"
+        reused.append(response.json()["results"]["reused"])
+
+    assert reused == [False, True]
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_predict_raw(
+    test_client,
+    predict_raw_endpoint,
+    png_bytes,
+    db_session,
+    access_token,
+    mock_image_classifier,
+):
+    response = test_client.post(
+        predict_raw_endpoint,
+        params={"filename": "raw.png"},
+        content=png_bytes,
+        headers={
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/octet-stream",
+        },
+    )
+    assert response.status_code == 200
+    assert response.json()["results"]["prediction"] == "mock_category"
+    assert (
+        db_session.query(models.ImageORM).filter_by(filename="raw.png").count()
+        == 1
+    )
+
+
+@pytest.fixture(scope="function")
+def write_behind(monkeypatch, async_session_factory):
+    monkeypatch.setattr(settings, "WRITE_BEHIND", True)
+    monkeypatch.setattr(settings, "WRITE_BEHIND_INTERVAL_MS", 10.0)
+    monkeypatch.setattr(
+        "app.core.setup.AsyncSessionLocal", async_session_factory
+    )
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_predict_write_behind(
+    write_behind,
+    test_client,
+    predict_raw_endpoint,
+    persistence_endpoint,
+    png_bytes,
+    db_session,
+    admin_token,
+    mock_image_classifier,
+):
+    response = test_client.post(
+        predict_raw_endpoint,
+        params={"filename": "behind.png"},
+        content=png_bytes,
+        headers={
+            "Authorization": f"Bearer {admin_token}",
+            "Content-Type": "application/octet-stream",
+        },
+    )
+    assert response.status_code == 200
+    assert "write_behind;dur=" in response.headers["server-timing"]
+
+    for _ in range(100):
+        stats = test_client.get(
+            persistence_endpoint,
+            headers={"Authorization": f"Bearer {admin_token}"},
+        ).json()
+        if stats["written"] == 1:
+            break
+        time.sleep(0.05)
+    assert stats["mode"] == "write_behind"
+    assert stats["queued"] == 1
+    assert stats["written"] == 1
+    assert stats["lost"] == 0
+    image = (
+        db_session.query(models.ImageORM).filter_by(filename="behind.png").one()
+    )
+    assert db_session.get(models.BlobORM, image.blob_hash).refcount == 1
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_predict_upload_limits(
+    test_client,
+    predict_endpoint,
+    predict_raw_endpoint,
+    png_bytes,
+    access_token,
+    mock_image_classifier,
+    monkeypatch,
+):
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    response = test_client.post(
+        predict_endpoint,
+        files={"file": ("page.html", b"<html></html>")},
+        headers=headers,
+    )
+    assert response.status_code == 415
+
+    monkeypatch.setattr(settings, "MAX_IMAGE_PIXELS", 100 * 100)
+    response = test_client.post(
+        predict_raw_endpoint, content=png_bytes, headers=headers
+    )
+    assert response.status_code == 413
+    assert "pixels" in response.json()["detail"]
+
+    monkeypatch.setattr(settings, "MAX_UPLOAD_BYTES", len(png_bytes) - 1)
+    for endpoint, upload in [
+        (predict_endpoint, {"files": {"file": ("red.png", png_bytes)}}),
+        (predict_raw_endpoint, {"content": png_bytes}),
+    ]:
+        response = test_client.post(endpoint, headers=headers, **upload)
+        assert response.status_code == 413
+        assert "bytes" in response.json()["detail"]
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_predict_overloaded(
+    test_client,
+    predict_endpoint,
+    queue_endpoint,
+    ready_endpoint,
+    png_bytes,
+    admin_token,
+    mock_image_classifier,
+    monkeypatch,
+):
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    admission = ml_models["admission"]
+    monkeypatch.setattr(admission, "_max_queue_depth", 0)
+
+    response = test_client.post(
+        predict_endpoint,
+        files={"file": ("red.png", png_bytes)},
+        headers=headers,
+    )
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+
+    response = test_client.get(ready_endpoint)
+    assert response.status_code == 503
+    assert response.json()["detail"] == "The inference queue is saturated."
+
+    response = test_client.get(queue_endpoint, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["rejected_queue_full"] == 1
+    assert response.json()["saturated"]
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_predict_quota(
+    test_client,
+    predict_endpoint,
+    predict_batch_endpoint,
+    quota_endpoint,
+    png_bytes,
+    access_token,
+    mock_image_classifier,
+    monkeypatch,
+):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    monkeypatch.setitem(
+        ml_models, "quotas", QuotaManager(rate_per_minute=1, burst=1)
+    )
+
+    response = test_client.post(
+        predict_endpoint,
+        files={"file": ("red.png", png_bytes)},
+        headers=headers,
+    )
+    assert response.status_code == 200
+
+    response = test_client.post(
+        predict_endpoint,
+        files={"file": ("red.png", png_bytes)},
+        headers=headers,
+    )
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 1
+
+    # More images than the burst can never be classified
+    response = test_client.post(
+        predict_batch_endpoint,
+        files=[("files", (f"{i}.png", png_bytes)) for i in range(2)],
+        headers=headers,
+    )
+    assert response.status_code == 413
+    assert "Retry-After" not in response.headers
+
+    response = test_client.get(quota_endpoint, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["remaining"] == 0
+    assert response.json()["images_per_minute"] == 1
+
+
+@pytest.mark.api
+@pytest.mark.integration
+def test_metrics(
+    test_client,
+    predict_endpoint,
+    metrics_endpoint,
+    image_file,
+    access_token,
+    mock_image_classifier,
+):
+    def counts():
+        response = test_client.get(metrics_endpoint)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        return {
+            series: float(value)
+            for series, value in (
+                line.rsplit(" ", 1)
+                for line in response.text.splitlines()
+                if "_count{" in line
+            )
+        }
+
+    before = counts()
+    response = test_client.post(
+        predict_endpoint,
+        files=image_file,
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert response.status_code == 200
+    after = counts()
+
+    stage = 'imagevision_stage_duration_seconds_count{stage="%s"}'
+    for name in [
+        "upload",
+        "verify_token",
+        "get_user",
+        "decode",
+        "preprocess",
+        "batch_queue",
+        "forward",
+        "db_commit",
+    ]:
+        assert after[stage % name] == before.get(stage % name, 0) + 1
+    request = (
+        "imagevision_request_duration_seconds_count"
+        '{method="POST",route="/api/v1/ml/predict",status="200"}'
+    )
+    assert after[request] == before.get(request, 0) + 1
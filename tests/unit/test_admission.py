@@ -0,0 +1,52 @@
+import pytest
+
+from app.core.ml.admission import AdmissionController, Overloaded
+
+
+@pytest.mark.unit
+def test_rejects_over_max_queue_depth():
+    admission = AdmissionController(max_queue_depth=2)
+
+    with admission.admit(), admission.admit():
+        assert admission.depth == 2
+        assert admission.saturated
+        with pytest.raises(Overloaded) as e:
+            with admission.admit():
+                pass
+        assert e.value.reason == "queue_full"
+        assert e.value.retry_after >= 1
+
+    assert admission.depth == 0
+    assert admission.stats()["admitted"] == 2
+    assert admission.stats()["rejected_queue_full"] == 1
+
+
+@pytest.mark.unit
+def test_rejects_over_estimated_wait():
+    admission = AdmissionController(max_queue_depth=100, max_queue_ms=1000)
+    # One completion every 300 ms
+    admission._intervals.extend([0.3] * 4)
+
+    assert admission.estimated_wait(3) == pytest.approx(0.9)
+    with admission.admit(), admission.admit(), admission.admit():
+        assert admission.saturated
+        with pytest.raises(Overloaded) as e:
+            with admission.admit():
+                pass
+        assert e.value.reason == "queue_time"
+        assert e.value.retry_after == 1
+
+    assert admission.stats()["rejected_queue_time"] == 1
+
+
+@pytest.mark.unit
+def test_estimates_wait_from_completions():
+    admission = AdmissionController()
+    assert admission.estimated_wait(10) == 0.0
+
+    for _ in range(3):
+        with admission.admit():
+            pass
+    assert len(admission._intervals) == 3
+    assert not admission.saturated
+    assert admission.estimated_wait(10) < 0.1
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+import torch
+
+from app.core.ml.batching import BatchScheduler, QueueTimeout
+
+
+class RecordingPredictor:
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, batch):
+        self.batch_sizes.append(len(batch))
+        return [tensor.sum().item() for tensor in batch]
+
+
+@pytest.mark.unit
+def test_batches_concurrent_requests():
+    predictor = RecordingPredictor()
+
+    async def run():
+        scheduler = BatchScheduler(predictor, max_batch_size=4, max_wait_ms=50)
+        results = await asyncio.gather(
+            *(scheduler.submit(torch.full((3, 2, 2), i)) for i in range(6))
+        )
+        await scheduler.close()
+        return results
+
+    results = asyncio.run(run())
+    assert results == [12.0 * i for i in range(6)]
+    assert predictor.batch_sizes == [4, 2]
+
+
+@pytest.mark.unit
+def test_prediction_error_is_propagated():
+    def failing_predictor(batch):
+        raise RuntimeError("forward failed")
+
+    async def run():
+        scheduler = BatchScheduler(failing_predictor, max_wait_ms=1)
+        with pytest.raises(RuntimeError, match="forward failed"):
+            await scheduler.submit(torch.zeros(3, 2, 2))
+        await scheduler.close()
+
+    asyncio.run(run())
+
+
+@pytest.mark.unit
+def test_close_drains_and_rejects_new_requests():
+    predictor = RecordingPredictor()
+
+    async def run():
+        scheduler = BatchScheduler(predictor, max_batch_size=8, max_wait_ms=20)
+        pending = [
+            asyncio.ensure_future(scheduler.submit(torch.ones(3, 2, 2)))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0)
+        await scheduler.close()
+        assert all(future.done() for future in pending)
+        with pytest.raises(RuntimeError):
+            await scheduler.submit(torch.ones(3, 2, 2))
+
+    asyncio.run(run())
+    assert predictor.batch_sizes == [3]
+
+
+@pytest.mark.unit
+def test_sheds_requests_that_waited_too_long():
+    predictor = RecordingPredictor()
+
+    def slow_predictor(batch):
+        time.sleep(0.05)
+        return predictor(batch)
+
+    async def run():
+        scheduler = BatchScheduler(
+            slow_predictor, max_batch_size=1, max_wait_ms=0, max_queue_ms=20
+        )
+        results = await asyncio.gather(
+            *(scheduler.submit(torch.ones(3, 2, 2)) for _ in range(3)),
+            return_exceptions=True,
+        )
+        await scheduler.close()
+        return results
+
+    results = asyncio.run(run())
+    # The first request is run, the others waited behind it
+    assert results[0] == 12.0
+    assert all(isinstance(result, QueueTimeout) for result in results[1:])
+    assert predictor.batch_sizes == [1]
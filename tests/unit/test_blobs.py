@@ -0,0 +1,209 @@
+import os
+import time
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import create_engine, inspect, text, update
+from sqlalchemy.orm import Session
+
+import app.models as models
+from app.core.blobs import (
+    BlobNotFound,
+    FileSystemBlobStore,
+    blob_fields,
+    blob_hash,
+    collect_garbage,
+    reference_blobs,
+    release_blob,
+    store_blobs,
+    utcnow,
+    write_blobs,
+)
+from app.db.migrations import create_indexes, migrate_image_blobs
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 8
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FileSystemBlobStore(str(tmp_path / "blobs"))
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/blobs.db")
+    models.Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        yield db
+    engine.dispose()
+
+
+def age(store, digest, seconds):
+    path = store.path(digest)
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.mark.unit
+def test_file_system_store(store):
+    digest = blob_hash(b"content")
+    store.put(digest, b"content")
+    store.put(digest, b"content")
+
+    assert store.path(digest).endswith(
+        os.path.join(digest[:2], digest[2:4], digest)
+    )
+    assert store.get(digest) == b"content"
+    assert [name for name, _ in store.list()] == [digest]
+
+    store.delete(digest)
+    store.delete(digest)
+    with pytest.raises(BlobNotFound):
+        store.get(digest)
+    with pytest.raises(BlobNotFound):
+        store.get("../" + digest[3:])
+
+
+@pytest.mark.unit
+def test_store_blobs_refcount(db, store):
+    fields = store_blobs(db, store, [PNG, b"other", PNG])
+    db.commit()
+    fields += store_blobs(db, store, [PNG])
+    db.commit()
+
+    digest = blob_hash(PNG)
+    assert [field["blob_hash"] for field in fields] == [
+        digest,
+        blob_hash(b"other"),
+        digest,
+        digest,
+    ]
+    assert fields[0]["mime_type"] == "image/png"
+    assert fields[1]["mime_type"] == "application/octet-stream"
+    assert db.get(models.BlobORM, digest).refcount == 3
+    assert len(list(store.list())) == 2
+
+
+@pytest.mark.unit
+def test_collect_garbage(db, store):
+    referenced, released = [blob_hash(data) for data in [PNG, b"other"]]
+    store_blobs(db, store, [PNG, b"other"])
+    db.commit()
+    release_blob(db, released)
+    db.commit()
+    # Written by a transaction that rolled back
+    store_blobs(db, store, [b"orphan"])
+    db.rollback()
+    orphan = blob_hash(b"orphan")
+
+    # Spared until older than the grace period
+    assert collect_garbage(db, store, grace_seconds=60) == {
+        "unreferenced": 0,
+        "orphans": 0,
+    }
+    age(store, orphan, 120)
+    assert collect_garbage(db, store, grace_seconds=0) == {
+        "unreferenced": 1,
+        "orphans": 1,
+    }
+    assert db.get(models.BlobORM, released) is None
+    assert [digest for digest, _ in store.list()] == [referenced]
+    assert store.get(referenced) == PNG
+
+
+@pytest.mark.unit
+def test_collect_garbage_spares_written_behind(db, store):
+    digest = blob_hash(PNG)
+    store_blobs(db, store, [PNG])
+    db.commit()
+    release_blob(db, digest)
+    db.execute(
+        update(models.BlobORM).values(updatedate=utcnow() - timedelta(hours=1))
+    )
+    db.commit()
+    age(store, digest, 120)
+
+    # Written again by a write-behind request, its reference not flushed yet
+    fields, blobs = blob_fields([PNG])
+    write_blobs(store, fields, [PNG])
+    assert collect_garbage(db, store, grace_seconds=60) == {
+        "unreferenced": 1,
+        "orphans": 0,
+    }
+    # The flush creates the row again
+    reference_blobs(db, blobs)
+    db.commit()
+    assert store.get(digest) == PNG
+
+    age(store, digest, 120)
+    assert store.delete(digest, older_than=time.time() - 60)
+    assert not store.delete(digest)
+
+
+@pytest.mark.unit
+def test_migrate_image_blobs(tmp_path, store):
+    engine = create_engine(f"sqlite:///{tmp_path}/legacy.db")
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE image (id INTEGER PRIMARY KEY, "
+                "filename VARCHAR(255) NOT NULL, image_data BLOB NOT NULL, "
+                "label VARCHAR(255), probability NUMERIC(5, 4), "
+                "user_id INTEGER NOT NULL, creationdate TIMESTAMP NOT NULL "
+                "DEFAULT CURRENT_TIMESTAMP, updatedate TIMESTAMP)"
+            )
+        )
+        connection.execute(
+            text(
+                'CREATE TABLE "user" (id INTEGER PRIMARY KEY, '
+                "username VARCHAR NOT NULL, email VARCHAR NOT NULL, "
+                "hashed_password VARCHAR NOT NULL, is_active BOOLEAN NOT NULL, "
+                "creationdate TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+                "updatedate TIMESTAMP)"
+            )
+        )
+        connection.execute(
+            text(
+                'INSERT INTO "user" (id, username, email, hashed_password, '
+                "is_active) VALUES (1, 'user', 'user@example.com', '', 1)"
+            )
+        )
+        for image_id, data in enumerate([PNG, b"other", PNG, PNG, b"last"]):
+            connection.execute(
+                text(
+                    "INSERT INTO image (id, filename, image_data, user_id) "
+                    "VALUES (:id, 'image.png', :data, 1)"
+                ),
+                {"id": image_id + 1, "data": data},
+            )
+
+    assert migrate_image_blobs(engine, store, batch_size=2) == 5
+    columns = {
+        column["name"] for column in inspect(engine).get_columns("image")
+    }
+    assert "image_data" not in columns
+    assert {"blob_hash", "model_version", "embedding"} <= columns
+    with Session(engine) as db:
+        images = db.query(models.ImageORM).order_by(models.ImageORM.id).all()
+        assert [store.get(image.blob_hash) for image in images] == [
+            PNG,
+            b"other",
+            PNG,
+            PNG,
+            b"last",
+        ]
+        assert images[0].size == len(PNG)
+        blob = db.get(models.BlobORM, blob_hash(PNG))
+        assert blob is not None
+        assert blob.refcount == 3
+        user = db.get(models.UserORM, 1)
+        assert user is not None
+        assert not user.is_superuser
+
+    # Already migrated
+    assert migrate_image_blobs(engine, store) == 0
+    create_indexes(engine)
+    assert "ix_image_user_id_creationdate_id" in {
+        index["name"] for index in inspect(engine).get_indexes("image")
+    }
+    engine.dispose()
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from app.core.ml.cache import Prediction, PredictionCache
+
+
+class CountingModel:
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return Prediction(400, 400, "dog", 0.9)
+
+
+@pytest.mark.unit
+def test_cache_hits_and_misses():
+    model = CountingModel()
+    cache = PredictionCache(model_version="v1", max_size=2)
+
+    async def run():
+        for image_data in [b"a", b"a", b"b", b"c", b"a"]:
+            prediction = await cache.get_or_compute(image_data, model)
+            assert prediction.label == "dog"
+
+    asyncio.run(run())
+    # b"a" was evicted by b"b" and b"c"
+    assert model.calls == 4
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 4
+    assert cache.stats()["size"] == 2
+
+
+@pytest.mark.unit
+def test_cache_coalesces_in_flight_requests():
+    model = CountingModel()
+    cache = PredictionCache(model_version="v1")
+
+    async def run():
+        return await asyncio.gather(
+            *(cache.get_or_compute(b"same bytes", model) for _ in range(5))
+        )
+
+    predictions = asyncio.run(run())
+    assert len(set(predictions)) == 1
+    assert model.calls == 1
+    assert cache.stats()["coalesced"] == 4
+
+
+@pytest.mark.unit
+def test_cache_errors_are_not_cached():
+    calls = []
+
+    async def failing_model():
+        calls.append(1)
+        raise RuntimeError("forward failed")
+
+    cache = PredictionCache(model_version="v1")
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await cache.get_or_compute(b"a", failing_model)
+
+    asyncio.run(run())
+    assert len(calls) == 2
+
+
+@pytest.mark.unit
+def test_cache_invalidate():
+    model = CountingModel()
+    cache = PredictionCache(model_version="v1")
+
+    async def run():
+        await cache.get_or_compute(b"a", model)
+        cache.invalidate(model_version="v2")
+        await cache.get_or_compute(b"a", model)
+
+    asyncio.run(run())
+    assert model.calls == 2
+    assert cache.model_version == "v2"
@@ -1,5 +1,7 @@
+import numpy as np
 import pytest
 import torch
+from PIL import Image
 
 from app.core.ml.cnn_model import ImageClassifier, Preprocessor
 
@@ -27,6 +29,38 @@ def test_preprocessor(image):
     assert torch.is_tensor(torch_image)
 
 
+@pytest.mark.unit
+@pytest.mark.parametrize("size", [(400, 400), (451, 300), (224, 1000)])
+def test_fast_preprocessor_matches_reference(size):
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(
+        rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    )
+
+    expected = Preprocessor(fast=False)(image)
+    assert torch.allclose(Preprocessor(fast=True)(image), expected, atol=1e-5)
+
+
+@pytest.mark.unit
+def test_draft_preprocessor_matches_reference():
+    image_path = "tests/data/dog.jpg"
+    expected = Preprocessor(fast=False)(Image.open(image_path))
+
+    image = Image.open(image_path)
+    torch_image = Preprocessor(fast=True, draft=True)(image)
+    # The JPEG was decoded at a reduced DCT scale
+    assert image.size[0] < 1546
+    assert torch_image.shape == (3, 224, 224)
+    assert (torch_image - expected).abs().mean() < 0.1
+
+
+@pytest.mark.unit
+def test_fast_preprocessor_converts_mode():
+    image = Image.new("RGBA", (300, 300), color=(255, 0, 0, 128))
+    torch_image = Preprocessor(fast=True)(image)
+    assert torch_image.shape == (3, 224, 224)
+
+
 @pytest.mark.unit
 def test_top_k_predictions(mocked_image_classifier, image):
     predictions = mocked_image_classifier.top_k_predictions(image, 3)
@@ -59,3 +93,21 @@ def test_fail_predict_category(mocked_image_classifier, image, monkeypatch):
     label, prob = prediction
     assert label == "Unknown"
     assert prob is None
+
+
+@pytest.mark.unit
+def test_predict_category_batch(mocked_image_classifier, monkeypatch):
+    def mock_predict_batch(*args, **kwargs):
+        return torch.tensor(
+            [[0.0098, 0.0494, 0.8500, 0.0788, 0.012], [0.5, 0.5, 0.0, 0.0, 0.0]]
+        )
+
+    monkeypatch.setattr(
+        mocked_image_classifier, "predict_batch", mock_predict_batch
+    )
+
+    predictions = mocked_image_classifier.predict_category_batch(None)
+    assert len(predictions) == 2
+    assert predictions[0][0] == "car"
+    assert predictions[0][1] == pytest.approx(0.8500, rel=1e-3)
+    assert predictions[1] == ("Unknown", None)
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+import torch
+
+from app.core.ml import engine
+from app.core.ml.engine import artifact_path, build_engine
+
+
+@pytest.fixture
+def model():
+    torch.manual_seed(0)
+    return torch.nn.Sequential(
+        torch.nn.Conv2d(3, 8, 3),
+        torch.nn.BatchNorm2d(8),
+        torch.nn.ReLU(),
+        torch.nn.AdaptiveAvgPool2d(1),
+        torch.nn.Flatten(),
+        torch.nn.Linear(8, 4),
+    ).eval()
+
+
+@pytest.fixture
+def example_input():
+    return torch.rand(1, 3, 32, 32)
+
+
+@pytest.mark.unit
+def test_eager_engine(model, example_input):
+    assert build_engine(model, example_input=example_input) is model
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("channels_last", [False, True])
+def test_torchscript_engine_is_cached(
+    model, example_input, tmp_path, monkeypatch, channels_last
+):
+    compiled = build_engine(
+        model,
+        engine="torchscript",
+        weights_hash="abc123",
+        cache_dir=str(tmp_path),
+        channels_last=channels_last,
+        example_input=example_input,
+    )
+    path = artifact_path(str(tmp_path), "abc123", channels_last)
+    assert os.path.exists(path)
+
+    batch = torch.rand(5, 3, 32, 32)
+    if channels_last:
+        batch = batch.to(memory_format=torch.channels_last)
+    with torch.no_grad():
+        assert torch.allclose(compiled(batch), model(batch), atol=1e-5)
+
+    def fail_freeze(*args, **kwargs):
+        raise AssertionError("The cached artifact should have been loaded")
+
+    monkeypatch.setattr(engine, "_freeze", fail_freeze)
+    build_engine(
+        model,
+        engine="torchscript",
+        weights_hash="abc123",
+        cache_dir=str(tmp_path),
+        channels_last=channels_last,
+        example_input=example_input,
+    )
+
+
+@pytest.mark.unit
+def test_engine_mismatch(model, example_input, monkeypatch):
+    monkeypatch.setattr(
+        torch.jit, "optimize_for_inference", lambda module: lambda x: x.sum()
+    )
+    with pytest.raises(ValueError):
+        build_engine(model, engine="torchscript", example_input=example_input)
+
+
+@pytest.mark.unit
+def test_unknown_engine(model):
+    with pytest.raises(ValueError):
+        build_engine(model, engine="tensorrt")
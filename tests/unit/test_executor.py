@@ -0,0 +1,116 @@
+import io
+
+import pytest
+import torch
+
+from app.core import profiling
+from app.core.ml import executor
+from app.core.ml.executor import (
+    classify_batch,
+    create_inference_executor,
+    decode_and_preprocess,
+    default_num_threads,
+    predict_category_batch,
+)
+from app.core.ml.registry import ModelKey, ModelSpec
+from app.core.setup import ml_models
+
+MODEL_KEY = ModelKey(ModelSpec("fake", "mobilenet_v3_small", "fake.pth"), "v1")
+
+
+class FakeClassifier:
+    version = "v1"
+
+    def __init__(self, spec=None):
+        self.spec = spec
+
+    def decode(self, image):
+        return image
+
+    def preprocess(self, image):
+        return torch.zeros(3, 224, 224)
+
+    def predict_category_batch(self, batch):
+        return [("fake_category", 0.5)] * len(batch)
+
+
+@pytest.fixture
+def image_data(image):
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.mark.unit
+def test_thread_executor_sets_num_threads():
+    with create_inference_executor(max_workers=1, num_threads=2) as pool:
+        assert pool.submit(torch.get_num_threads).result() == 2
+
+
+@pytest.mark.unit
+def test_process_executor_uses_worker_classifier(image_data):
+    with create_inference_executor(
+        kind="process",
+        max_workers=1,
+        num_threads=1,
+        classifier_factory=FakeClassifier,
+    ) as pool:
+        size, tensor, image_hash, timings = pool.submit(
+            decode_and_preprocess, image_data, False, MODEL_KEY
+        ).result()
+        assert size == (400, 400)
+        assert image_hash is None
+        assert set(timings) == {"decode", "preprocess"}
+        assert tensor.shape == (3, 224, 224)
+
+        predictions = pool.submit(
+            predict_category_batch, torch.zeros(2, 3, 224, 224), MODEL_KEY
+        ).result()
+        assert predictions == [("fake_category", 0.5)] * 2
+
+        # Process workers are only told the key of the model to use
+        with pytest.raises(ValueError):
+            pool.submit(decode_and_preprocess, image_data).result()
+
+
+@pytest.mark.unit
+def test_thread_worker_uses_serving_classifier(image_data, monkeypatch):
+    class FakeRegistry:
+        def classifier(self, key=None):
+            assert key == MODEL_KEY
+            return FakeClassifier()
+
+    monkeypatch.setitem(ml_models, "model_registry", FakeRegistry())
+    assert executor._worker_classifiers is None
+
+    size, tensor, image_hash, timings = decode_and_preprocess(
+        image_data, True, MODEL_KEY
+    )
+    assert size == (400, 400)
+    assert tensor.shape == (3, 224, 224)
+    assert isinstance(image_hash, int)
+    assert set(timings) == {"decode", "preprocess", "perceptual_hash"}
+
+
+@pytest.mark.unit
+def test_classify_batch_profiled(monkeypatch):
+    class FakeRegistry:
+        def classifier(self, key=None):
+            return FakeClassifier()
+
+    monkeypatch.setitem(ml_models, "model_registry", FakeRegistry())
+    capture = profiling.TorchCapture(seconds=1)
+    monkeypatch.setattr(profiling, "active", capture)
+
+    predictions = classify_batch(torch.zeros(2, 3, 224, 224), MODEL_KEY)
+    assert predictions == [("fake_category", 0.5, None)] * 2
+    assert "1 forward pass(es) traced" in capture.summary()
+
+
+@pytest.mark.unit
+def test_invalid_executor_config():
+    with pytest.raises(ValueError):
+        create_inference_executor(kind="fiber")
+    with pytest.raises(ValueError):
+        create_inference_executor(kind="process")
+    assert default_num_threads(10**6) == 1
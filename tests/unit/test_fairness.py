@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+import torch
+
+from app.core.ml.batching import BatchScheduler
+from app.core.ml.fairness import DeficitRoundRobin
+
+
+@pytest.mark.unit
+def test_round_robin_between_flows():
+    queue = DeficitRoundRobin()
+    for i in range(4):
+        queue.append("heavy", 1.0, f"heavy-{i}")
+    queue.append("light", 1.0, "light-0")
+
+    order = [queue.popleft()[2] for _ in range(len(queue))]
+    assert order == ["heavy-0", "light-0", "heavy-1", "heavy-2", "heavy-3"]
+    assert queue.backlog() == {}
+
+
+@pytest.mark.unit
+def test_weighted_flows():
+    queue = DeficitRoundRobin()
+    for i in range(6):
+        queue.append("gold", 2.0, "gold")
+        queue.append("free", 1.0, "free")
+        queue.append("slow", 0.5, "slow")
+
+    order = [queue.popleft()[2] for _ in range(7)]
+    assert order.count("gold") == 4
+    assert order.count("free") == 2
+    assert order.count("slow") == 1
+
+    with pytest.raises(ValueError):
+        queue.append("none", 0, "none")
+
+
+@pytest.mark.unit
+def test_scheduler_serves_flows_fairly():
+    batches = []
+
+    def predictor(batch):
+        batches.append([int(tensor[0, 0, 0]) for tensor in batch])
+        return [None] * len(batch)
+
+    async def run():
+        scheduler = BatchScheduler(predictor, max_batch_size=2, max_wait_ms=20)
+        # The heavy user queued six images before the light user's one
+        submissions = [
+            scheduler.submit(torch.full((3, 2, 2), 1), flow="heavy")
+            for _ in range(6)
+        ]
+        submissions.append(scheduler.submit(torch.full((3, 2, 2), 2), "light"))
+        await asyncio.gather(*submissions)
+        await scheduler.close()
+
+    asyncio.run(run())
+    assert batches[0] == [1, 2]
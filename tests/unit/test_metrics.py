@@ -0,0 +1,85 @@
+import os
+import threading
+
+import pytest
+
+from app.core.metrics import MetricsRegistry
+
+
+def sample(text, series):
+    for line in text.splitlines():
+        if line.startswith(series + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+@pytest.mark.unit
+def test_histogram_render():
+    registry = MetricsRegistry()
+    histogram = registry.histogram(
+        "stage_seconds", "Stage durations.", ("stage",), buckets=(0.1, 1.0)
+    )
+    for value in [0.05, 0.5, 0.5, 5.0]:
+        histogram.observe(value, "decode")
+    histogram.observe(0.1, 'quoted "stage"')
+
+    text = registry.render()
+    assert "# TYPE stage_seconds histogram" in text
+    bucket = 'stage_seconds_bucket{stage="decode",le="%s"}'
+    assert sample(text, bucket % "0.1") == 1
+    assert sample(text, bucket % "1.0") == 3
+    assert sample(text, bucket % "+Inf") == 4
+    assert sample(text, 'stage_seconds_count{stage="decode"}') == 4
+    assert sample(text, 'stage_seconds_sum{stage="decode"}') == 6.05
+    # The bounds are inclusive, and the label values escaped
+    assert (
+        sample(text, bucket.replace("decode", 'quoted \\"stage\\"') % "0.1")
+        == 1
+    )
+
+
+@pytest.mark.unit
+def test_histogram_threads():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("seconds", "Durations.", ("route",))
+
+    def observe():
+        for _ in range(1000):
+            histogram.observe(0.01, "/predict")
+
+    threads = [threading.Thread(target=observe) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Kept after the threads exited
+    assert sample(registry.render(), 'seconds_count{route="/predict"}') == 4000
+
+
+@pytest.mark.unit
+def test_collect_workers(tmp_path, monkeypatch):
+    def worker_registry():
+        registry = MetricsRegistry(str(tmp_path))
+        histogram = registry.histogram("seconds", "Durations.", ("route",))
+        return registry, histogram
+
+    other, histogram = worker_registry()
+    histogram.observe(0.01, "/predict")
+    histogram.observe(0.01, "/history")
+    monkeypatch.setattr(os, "getpid", lambda: 1)
+    other.flush()
+    monkeypatch.undo()
+
+    registry, histogram = worker_registry()
+    histogram.observe(0.01, "/predict")
+    # The own series of a worker are read live, not from its file
+    registry.flush()
+    histogram.observe(0.01, "/predict")
+
+    text = registry.render()
+    assert sample(text, 'seconds_count{route="/predict"}') == 3
+    assert sample(text, 'seconds_count{route="/history"}') == 1
+
+    registry.clear()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,81 @@
+import io
+import random
+
+import pytest
+from PIL import Image
+
+from app.core.ml.phash import NearDuplicateIndex, dhash, hamming_distance
+
+
+@pytest.fixture
+def photo():
+    return Image.open("tests/data/dog.jpg").convert("RGB")
+
+
+@pytest.mark.unit
+def test_dhash_near_duplicates(photo):
+    original = dhash(photo)
+
+    buf = io.BytesIO()
+    photo.resize((photo.width // 2, photo.height // 2)).save(
+        buf, format="JPEG", quality=60
+    )
+    reencoded = dhash(Image.open(buf))
+    assert hamming_distance(original, reencoded) <= 4
+
+    other = dhash(photo.transpose(Image.Transpose.FLIP_LEFT_RIGHT))
+    assert hamming_distance(original, other) > 10
+
+
+@pytest.mark.unit
+def test_index_matches_linear_scan():
+    rng = random.Random(0)
+    index = NearDuplicateIndex(max_distance=6)
+    hashes = [rng.getrandbits(64) for _ in range(500)]
+    for i, value in enumerate(hashes):
+        index.add(value, i)
+
+    for value in hashes[:50]:
+        query = value
+        for bit in rng.sample(range(64), 5):
+            query ^= 1 << bit
+
+        expected = min(
+            (hamming_distance(query, candidate), i)
+            for i, candidate in enumerate(hashes)
+        )
+        result = index.search(query)
+        assert result is not None
+        distance, item = result
+        assert distance == expected[0] <= 5
+        assert hamming_distance(query, hashes[item]) == distance
+
+    assert index.search(hashes[0] ^ ((1 << 7) - 1)) is None
+
+
+@pytest.mark.unit
+def test_index_evicts_oldest_entries():
+    index = NearDuplicateIndex(max_distance=2, max_size=2)
+    index.add(0b0, "first")
+    index.add(0b1111 << 20, "second")
+    index.add(0b1111 << 40, "third")
+
+    assert len(index) == 2
+    assert index.search(0b0) is None
+    assert index.search(0b1111 << 40) == (0, "third")
+
+
+@pytest.mark.unit
+def test_index_owners():
+    index = NearDuplicateIndex(max_distance=2, max_size=2)
+    index.add(0b0, "first", owner=1)
+    index.add(0b0, "second", owner=2)
+
+    assert len(index) == 2
+    assert index.search(0b1, owner=1) == (1, "first")
+    assert index.search(0b1, owner=2) == (1, "second")
+    assert index.search(0b1, owner=3) is None
+
+    index.add(0b1111 << 40, "third", owner=1)
+    assert index.search(0b0, owner=1) is None
+    assert index.search(0b0, owner=2) == (0, "second")
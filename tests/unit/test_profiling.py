@@ -0,0 +1,71 @@
+import asyncio
+import io
+import json
+import threading
+import time
+import zipfile
+
+import pytest
+import torch
+
+from app.core import profiling
+
+
+@pytest.mark.unit
+def test_capture_stops_after_requests():
+    async def capture_two_requests():
+        capture = profiling.SamplingCapture(seconds=10, max_requests=2)
+        task = asyncio.create_task(capture.run())
+        await asyncio.sleep(0)
+        assert profiling.active is capture
+        with pytest.raises(profiling.CaptureInProgress):
+            await profiling.SamplingCapture(seconds=1).run()
+
+        capture.request_finished()
+        capture.request_finished()
+        await asyncio.wait_for(task, 1)
+        assert profiling.active is None
+
+    asyncio.run(capture_two_requests())
+
+
+@pytest.mark.unit
+def test_sampling_capture():
+    stopped = threading.Event()
+
+    def busy_loop():
+        while not stopped.is_set():
+            time.sleep(0.001)
+
+    thread = threading.Thread(target=busy_loop, name="busy")
+    thread.start()
+    try:
+        capture = profiling.SamplingCapture(seconds=0.2, interval=0.005)
+        artifact = asyncio.run(capture.run()).decode()
+    finally:
+        stopped.set()
+        thread.join()
+
+    lines = artifact.splitlines()
+    assert any(
+        line.startswith("busy;") and "busy_loop (test_profiling.py" in line
+        for line in lines
+    )
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+
+
+@pytest.mark.unit
+def test_torch_capture():
+    model = torch.nn.Conv2d(3, 8, 3)
+    capture = profiling.TorchCapture(seconds=1, max_traces=1)
+    batch = torch.zeros(2, 3, 32, 32)
+    for _ in range(2):
+        assert capture.profile(model, batch).shape == (2, 8, 30, 30)
+
+    with zipfile.ZipFile(io.BytesIO(capture.artifact())) as archive:
+        assert archive.namelist() == ["summary.txt", "trace-000.json"]
+        summary = archive.read("summary.txt").decode()
+        json.loads(archive.read("trace-000.json"))
+
+    conv = next(line for line in summary.splitlines() if "conv2d" in line)
+    assert int(conv.split()[1]) == 2
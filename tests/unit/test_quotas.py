@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.quotas import OverBurst, QuotaExceeded, QuotaManager
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_user(user_id=1, inference_weight=None, max_concurrency=None):
+    return SimpleNamespace(
+        id=user_id,
+        inference_weight=inference_weight,
+        max_concurrency=max_concurrency,
+    )
+
+
+@pytest.mark.unit
+def test_token_bucket_quota():
+    clock = FakeClock()
+    quotas = QuotaManager(rate_per_minute=60, burst=3, clock=clock)
+    user = make_user()
+
+    with quotas.acquire(user, images=2):
+        pass
+    with quotas.acquire(user):
+        pass
+    with pytest.raises(QuotaExceeded) as e:
+        with quotas.acquire(user):
+            pass
+    assert e.value.reason == "rate"
+    assert e.value.retry_after == 1
+
+    # One image per second
+    clock.now = 2.0
+    assert quotas.stats(user)["remaining"] == 2
+    with quotas.acquire(user, images=2):
+        pass
+    # More images than the bucket holds are never allowed
+    with pytest.raises(OverBurst) as e:
+        quotas.check(user, images=4)
+    assert e.value.status_code == 413
+    assert e.value.retry_after is None
+
+    # Other users have their own bucket
+    with quotas.acquire(make_user(2), images=3):
+        pass
+    assert quotas._usage[1].images == 5
+    assert quotas._usage[1].throttled == 5
+
+    # Taken for a flush, and given back when it fails
+    usage = quotas.take_usage()
+    assert quotas._usage == {}
+    clock.now = 3.0
+    with quotas.acquire(make_user(2)):
+        pass
+    quotas.restore_usage(usage)
+    assert quotas._usage[1].images == 5
+    assert quotas._usage[2].images == 4
+
+
+@pytest.mark.unit
+def test_concurrency_cap_and_weight():
+    quotas = QuotaManager(max_concurrency=2, weight=1.0)
+    user = make_user(max_concurrency=1, inference_weight=3.0)
+
+    with quotas.acquire(user) as limits:
+        assert limits.weight == 3.0
+        with pytest.raises(QuotaExceeded) as e:
+            with quotas.acquire(user):
+                pass
+        assert e.value.reason == "concurrency"
+        # The default cap applies to the other users
+        with quotas.acquire(make_user(2)), quotas.acquire(make_user(2)):
+            assert quotas.stats(make_user(2))["in_flight"] == 2
+
+    assert quotas.stats(user) == {
+        "weight": 3.0,
+        "max_concurrency": 1,
+        "in_flight": 0,
+        "images_per_minute": None,
+        "burst": None,
+        "remaining": None,
+    }
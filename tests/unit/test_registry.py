@@ -0,0 +1,160 @@
+import asyncio
+import os
+
+import pytest
+import torch
+
+from app.core.ml.batching import BatchScheduler
+from app.core.ml.cache import PredictionCache
+from app.core.ml.registry import (
+    ModelRegistry,
+    ModelSpec,
+    ServedModel,
+    parse_model_specs,
+)
+
+
+class FakeClassifier:
+    def __init__(self, version, memory_bytes):
+        self.version = version
+        self.memory_bytes = memory_bytes
+
+    def predict_category_batch(self, batch):
+        return [(self.version, 0.9)] * len(batch)
+
+
+class FakeLoader:
+    """
+    Serve the weights file content as the model version, and its size as the
+    model memory.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, spec):
+        self.calls.append(spec.name)
+        with open(spec.model_path) as f:
+            version = f.read().strip()
+        classifier = FakeClassifier(version, os.path.getsize(spec.model_path))
+        return ServedModel(
+            spec,
+            classifier,
+            batch_scheduler=BatchScheduler(classifier.predict_category_batch),
+            prediction_cache=PredictionCache(model_version=version),
+            mtime=os.path.getmtime(spec.model_path),
+        )
+
+
+@pytest.fixture
+def specs(tmp_path):
+    specs = []
+    for name, size in [("large", 100), ("small", 30), ("tiny", 10)]:
+        path = tmp_path / f"{name}.pth"
+        path.write_text(f"{name}-v1".ljust(size))
+        specs.append(ModelSpec(name, "mobilenet_v3_large", str(path)))
+    return specs
+
+
+@pytest.mark.unit
+def test_parse_model_specs():
+    assert parse_model_specs(
+        "large=mobilenet_v3_large:large.pth, small=mobilenet_v3_small:s.pth",
+        "models",
+    ) == [
+        ModelSpec("large", "mobilenet_v3_large", "models/large.pth"),
+        ModelSpec("small", "mobilenet_v3_small", "models/s.pth"),
+    ]
+    for value in ["", "large", "large=resnet50:large.pth", "=x:large.pth"]:
+        with pytest.raises(ValueError):
+            parse_model_specs(value)
+
+
+@pytest.mark.unit
+def test_registry_loads_on_first_use(specs):
+    loader = FakeLoader()
+    registry = ModelRegistry(specs, loader)
+
+    async def run():
+        async def acquire(name):
+            async with registry.acquire(name) as served:
+                return served.version
+
+        versions = await asyncio.gather(*(acquire("small") for _ in range(3)))
+        assert versions == ["small-v1"] * 3
+        assert loader.calls == ["small"]
+
+        async with registry.acquire() as served:
+            assert served.name == "large"
+        with pytest.raises(ValueError):
+            async with registry.acquire("resnet50"):
+                pass
+        await registry.close()
+
+    asyncio.run(run())
+    assert registry.loads == 2
+
+
+@pytest.mark.unit
+def test_registry_evicts_least_recently_used(specs):
+    registry = ModelRegistry(specs, FakeLoader(), memory_budget=140)
+
+    async def run():
+        for name in ["large", "small", "tiny"]:
+            async with registry.acquire(name):
+                pass
+        # 100 + 30 + 10 fit in the budget
+        assert [served["name"] for served in registry.stats()["loaded"]] == [
+            "large",
+            "small",
+            "tiny",
+        ]
+        registry._memory_budget = 120
+        async with registry.acquire("small"):
+            pass
+        await registry._evict()
+        # The default model is never evicted
+        assert [served["name"] for served in registry.stats()["loaded"]] == [
+            "large",
+            "small",
+        ]
+        await registry.close()
+
+    asyncio.run(run())
+    assert registry.evictions == 1
+
+
+@pytest.mark.unit
+def test_registry_reload_drains_old_version(specs):
+    registry = ModelRegistry(specs, FakeLoader())
+
+    async def run():
+        async with registry.acquire("small") as old:
+            pass
+        assert await registry.check_for_updates() == []
+
+        async with registry.acquire("small") as old:
+            assert old.mtime is not None
+            with open(specs[1].model_path, "w") as f:
+                f.write("small-v2")
+            os.utime(specs[1].model_path, (0, old.mtime + 1))
+            assert await registry.check_for_updates() == ["small"]
+
+            # The in-flight request keeps the version it started with
+            current = registry.get("small")
+            assert current is not None
+            assert current.version == "small-v2"
+            assert registry.classifier(old.key).version == "small-v1"
+            assert await old.batch_scheduler.submit(torch.zeros(1)) == (
+                "small-v1",
+                0.9,
+            )
+            assert registry.stats()["draining"][0]["version"] == "small-v1"
+
+        assert registry.stats()["draining"] == []
+        with pytest.raises(ValueError):
+            registry.classifier(old.key)
+        await registry.close()
+
+    asyncio.run(run())
+    assert registry.reloads == 1
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+import torch
+
+from app.core import serving
+from app.core.serving import (
+    configure_worker,
+    process_memory,
+    worker_cpus,
+    workers_memory,
+)
+
+
+@pytest.mark.unit
+def test_process_memory():
+    memory = process_memory()
+    assert memory is not None
+    assert memory["rss_kb"] > 0
+    assert memory["pss_kb"] <= memory["rss_kb"]
+    assert process_memory(2**22 + 1) is None
+
+
+@pytest.mark.unit
+def test_worker_cpus():
+    cpus = [0, 1, 2, 3]
+    assert worker_cpus(0, 2, cpus) == [0, 1]
+    assert worker_cpus(1, 2, cpus) == [2, 3]
+    # More workers than cores share them round-robin
+    assert worker_cpus(2, 2, cpus) == [0, 1]
+    assert worker_cpus(3, 1, [4, 6]) == [6]
+
+
+@pytest.mark.unit
+def test_configure_worker(monkeypatch):
+    monkeypatch.setattr(serving, "worker_slot", None)
+    num_threads = torch.get_num_threads()
+    cpus = sorted(os.sched_getaffinity(0))
+    try:
+        configure_worker(0, 1, cpus=cpus[:1])
+        assert serving.worker_slot == 0
+        assert torch.get_num_threads() == 1
+        assert os.sched_getaffinity(0) == set(cpus[:1])
+    finally:
+        os.sched_setaffinity(0, cpus)
+        torch.set_num_threads(num_threads)
+
+
+@pytest.mark.unit
+def test_workers_memory_of_forked_workers(monkeypatch):
+    monkeypatch.setattr(serving, "worker_slot", None)
+    assert [worker["pid"] for worker in workers_memory()["workers"]] == [
+        os.getpid()
+    ]
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        # A worker reports itself and its siblings, the children of the master
+        os.close(read_fd)
+        serving.worker_slot = 0
+        report = workers_memory()
+        pids = sorted(worker["pid"] for worker in report["workers"])
+        os.write(write_fd, f"{report['master']['pid']} {pids}".encode())
+        os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        output = f.read()
+    os.waitpid(pid, 0)
+    assert output.startswith(f"{os.getpid()} ")
+    assert str(pid) in output
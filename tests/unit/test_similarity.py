@@ -0,0 +1,134 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.core.ml.similarity import (
+    EmbeddingIndex,
+    ProductQuantizer,
+    SimilarityIndexes,
+    kmeans,
+)
+
+
+def normalized(x):
+    return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+
+@pytest.fixture
+def vectors():
+    # Clustered, like the embeddings of a user's images
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((20, 32))
+    points = centers[rng.integers(0, 20, 2000)]
+    return normalized(points + 0.3 * rng.standard_normal(points.shape))
+
+
+@pytest.mark.unit
+def test_kmeans_finds_separated_clusters():
+    x = np.concatenate([np.zeros((50, 2)), np.full((50, 2), 10.0)]).astype(
+        np.float32
+    )
+    centroids = kmeans(x, 2)
+    assert sorted(centroids[:, 0].tolist()) == [0.0, 10.0]
+
+
+@pytest.mark.unit
+def test_product_quantizer_distances(vectors):
+    quantizer = ProductQuantizer(32, num_subspaces=8)
+    quantizer.train(vectors)
+    codes = quantizer.encode(vectors)
+    assert codes.shape == (len(vectors), 8)
+    assert codes.dtype == np.uint8
+
+    exact = ((vectors - vectors[0]) ** 2).sum(axis=1)
+    approximate = quantizer.distances(vectors[0], codes)
+    assert np.corrcoef(exact, approximate)[0, 1] > 0.9
+
+
+@pytest.mark.unit
+def test_exact_search(tmp_path, vectors):
+    index = EmbeddingIndex(str(tmp_path / "index.npy"), 32, capacity=16)
+    ids = np.arange(1, len(vectors) + 1)
+    # Grown while appended in several batches
+    for start in range(0, len(vectors), 300):
+        end = start + 300
+        index.add(ids[start:end], vectors[start:end])
+    assert index.size == len(vectors)
+    assert index.last_id == len(vectors)
+    assert not index.approximate
+
+    results = index.search(vectors[0], 5)
+    image_id, score = results[0]
+    assert image_id == 1
+    assert score == pytest.approx(1.0, abs=1e-2)
+    stored = vectors.astype(np.float16).astype(np.float32)
+    expected = np.argsort(-(stored @ stored[0]))[:5] + 1
+    assert [image_id for image_id, _ in results] == expected.tolist()
+
+    results = index.search(vectors[0], 4, exclude_id=1)
+    assert [image_id for image_id, _ in results] == expected[1:].tolist()
+    index.close()
+    assert not (tmp_path / "index.npy").exists()
+
+
+@pytest.mark.unit
+def test_removed_images(tmp_path, vectors):
+    index = EmbeddingIndex(str(tmp_path / "index.npy"), 32)
+    # Committed out of order
+    index.add(np.array([1, 3]), vectors[[0, 2]])
+    index.add(np.array([2]), vectors[[1]])
+    assert index.ids == {1, 2, 3}
+    assert index.last_id == 3
+
+    index.remove([3])
+    assert len(index) == 2
+    assert index.last_id == 2
+    assert {image_id for image_id, _ in index.search(vectors[2], 5)} == {1, 2}
+    index.close()
+
+
+@pytest.mark.unit
+def test_approximate_search_recall(tmp_path, vectors):
+    exact = EmbeddingIndex(str(tmp_path / "exact.npy"), 32)
+    approximate = EmbeddingIndex(
+        str(tmp_path / "ivf.npy"), 32, ivf_threshold=1000, nprobe=8
+    )
+    ids = np.arange(1, len(vectors) + 1)
+    exact.add(ids, vectors)
+    approximate.add(ids[:1500], vectors[:1500])
+    assert approximate.approximate
+    # Assigned to the trained lists
+    approximate.add(ids[1500:], vectors[1500:])
+
+    recall = []
+    for query in vectors[:50]:
+        expected = {image_id for image_id, _ in exact.search(query, 10)}
+        found = {image_id for image_id, _ in approximate.search(query, 10)}
+        recall.append(len(expected & found) / 10)
+    assert np.mean(recall) > 0.9
+
+    approximate.remove([1])
+    assert 1 not in {
+        image_id for image_id, _ in approximate.search(vectors[0], 10)
+    }
+
+
+@pytest.mark.unit
+def test_saved_images_are_added(tmp_path, vectors):
+    indexes = SimilarityIndexes(str(tmp_path))
+    embeddings = vectors.astype(np.float16)
+    rows = [(1, embeddings[0].tobytes()), (2, embeddings[1].tobytes())]
+
+    # Not loaded by this process, read by its first search
+    asyncio.run(indexes.add(1, "v1", rows[:1]))
+    index = indexes._index(1, "v1", 32)
+    assert len(index) == 0
+
+    asyncio.run(indexes.add(1, "v1", rows))
+    assert index.ids == {1, 2}
+    assert index.last_id == 2
+    ((image_id, score),) = index.search(vectors[1], 1)
+    assert image_id == 2
+    assert score == pytest.approx(1.0, abs=1e-3)
+    indexes.close()
@@ -0,0 +1,36 @@
+import pytest
+
+from app.core.tracing import FlightRecorder, RequestTrace
+
+
+@pytest.mark.unit
+def test_server_timing():
+    trace = RequestTrace()
+    trace.add("decode", 0.002)
+    trace.add("decode", 0.001)
+    trace.add("forward", 0.0125)
+
+    metrics = trace.server_timing().split(", ")
+    assert metrics[:2] == ["decode;dur=3.00", "forward;dur=12.50"]
+    assert metrics[2].startswith("total;dur=")
+
+
+@pytest.mark.unit
+def test_flight_recorder():
+    recorder = FlightRecorder(threshold_ms=100, size=2)
+    trace = RequestTrace()
+    trace.add("forward", 0.1)
+    trace.images.append({"width": 10, "height": 10, "bytes": 100})
+
+    for duration in [0.05, 0.2, 0.5, 0.3]:
+        recorder.record(trace, duration, "POST", "/p", "/p", 200)
+
+    # The fast request was not kept, and the oldest slow one was evicted
+    records = recorder.dump()
+    assert [record["duration_ms"] for record in records] == [500.0, 300.0]
+    assert records[1]["stages_ms"] == {"forward": 100.0}
+    assert records[0]["images"] == [{"width": 10, "height": 10, "bytes": 100}]
+    assert len(recorder.dump(limit=1)) == 1
+
+    recorder.clear()
+    assert recorder.dump() == []
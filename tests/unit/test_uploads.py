@@ -0,0 +1,139 @@
+import asyncio
+import io
+import tarfile
+import zipfile
+
+import pytest
+from PIL import Image
+
+from app.core.uploads import (
+    UnsupportedImage,
+    UploadError,
+    UploadTooLarge,
+    probe_image,
+    read_archive,
+    read_upload,
+    sniff_image_format,
+)
+
+
+def encode(image, image_format):
+    buf = io.BytesIO()
+    image.save(buf, format=image_format)
+    return buf.getvalue()
+
+
+async def chunked(data, chunk_size=10):
+    for start in range(0, len(data), chunk_size):
+        end = start + chunk_size
+        yield data[start:end]
+
+
+@pytest.mark.unit
+def test_read_zip_archive():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as archive:
+        archive.writestr("a.png", b"a")
+        archive.writestr("folder/", b"")
+        archive.writestr("folder/b.png", b"b")
+
+    assert read_archive(buf) == [("a.png", b"a"), ("folder/b.png", b"b")]
+
+
+@pytest.mark.unit
+def test_read_tar_archive():
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as archive:
+        info = tarfile.TarInfo("a.png")
+        info.size = 1
+        archive.addfile(info, io.BytesIO(b"a"))
+
+    assert read_archive(buf) == [("a.png", b"a")]
+
+
+@pytest.mark.unit
+def test_read_corrupt_archive():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as archive:
+        archive.writestr("a.png", b"a" * 100)
+    data = buf.getvalue().replace(b"a" * 100, b"b" * 100)
+    with pytest.raises(UploadError):
+        read_archive(io.BytesIO(data))
+
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as archive:
+        info = tarfile.TarInfo("a.png")
+        info.size = 100_000
+        archive.addfile(info, io.BytesIO(bytes(range(256)) * 400))
+    data = buf.getvalue()
+    with pytest.raises(UploadError):
+        read_archive(io.BytesIO(data[: len(data) // 2]))
+
+
+@pytest.mark.unit
+def test_read_non_archive(image):
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+
+    assert read_archive(buf) is None
+    assert buf.tell() == 0
+
+
+@pytest.mark.unit
+def test_read_archive_limits():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("a.png", b"a" * 100)
+        archive.writestr("b.png", b"b" * 100)
+
+    images = read_archive(buf, max_member_bytes=100)
+    assert images is not None
+    assert len(images) == 2
+    with pytest.raises(UploadTooLarge):
+        read_archive(buf, max_member_bytes=99)
+    with pytest.raises(UploadTooLarge):
+        read_archive(buf, max_total_bytes=199)
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG", "GIF", "BMP", "WEBP"])
+def test_sniff_image_format(image, image_format):
+    assert sniff_image_format(encode(image, image_format)) == image_format
+    assert sniff_image_format(b"%PDF-1.7") is None
+
+
+@pytest.mark.unit
+def test_read_upload(image):
+    data = encode(image, "PNG")
+    assert asyncio.run(read_upload(chunked(data), len(data))) == data
+
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(read_upload(chunked(data), len(data) - 1))
+
+    # Rejected from the first chunks, whatever follows
+    async def not_an_image():
+        yield b"<html><body>"
+        raise AssertionError("read past the signature")
+
+    with pytest.raises(UnsupportedImage):
+        asyncio.run(read_upload(not_an_image(), 10**6))
+    assert (
+        asyncio.run(read_upload(chunked(b"archive"), 10, check_signature=False))
+        == b"archive"
+    )
+
+
+@pytest.mark.unit
+def test_probe_image(image, monkeypatch):
+    assert probe_image(encode(image, "JPEG"), 400 * 400) == (400, 400)
+
+    with pytest.raises(UploadTooLarge):
+        probe_image(encode(image, "JPEG"), 400 * 400 - 1)
+
+    # Rejected from the header, the pixels of the bomb are never decoded
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    with pytest.raises(UploadTooLarge):
+        probe_image(encode(image, "PNG"), 10**9)
+
+    with pytest.raises(UnsupportedImage):
+        probe_image(b"\x89PNG\r\n\x1a\ntruncated", 10**9)
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import app.models as models
+from app.core.writebehind import WriteBehindFull, WriteBehindWriter
+
+DIGEST = "ab" * 32
+
+
+def image_row(filename):
+    return {
+        "filename": filename,
+        "blob_hash": DIGEST,
+        "size": 16,
+        "mime_type": "image/png",
+        "label": "mock_category",
+        "probability": 0.99,
+        "model_version": "v1",
+        "embedding": None,
+        "user_id": 1,
+    }
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "writebehind.db"
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    engine.dispose()
+    return path
+
+
+def session_factory(db_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    return engine, async_sessionmaker(engine, expire_on_commit=False)
+
+
+def test_write_behind_batches(db_path):
+    async def run():
+        engine, factory = session_factory(db_path)
+        writer = WriteBehindWriter(factory, batch_size=2, interval_ms=10_000)
+        writer.start()
+        for i in range(2):
+            await writer.put(image_row(f"{i}.png"))
+        # A full batch is written without waiting for the interval
+        for _ in range(100):
+            if writer.written == 2:
+                break
+            await asyncio.sleep(0.01)
+        await writer.put(image_row("2.png"))
+        await asyncio.sleep(0.05)
+        assert writer.stats()["pending"] == 1
+
+        # The last row is written on close
+        await writer.close()
+        async with factory() as db:
+            count = await db.scalar(
+                select(func.count()).select_from(models.ImageORM)
+            )
+            blob = await db.get(models.BlobORM, DIGEST)
+        await engine.dispose()
+        return writer.stats(), count, blob
+
+    stats, count, blob = asyncio.run(run())
+    assert count == 3
+    assert blob.refcount == 3
+    assert stats["written"] == 3
+    assert stats["flushes"] == 2
+    assert stats["pending"] == 0
+    assert stats["lost"] == 0
+
+
+def test_write_behind_backpressure(db_path):
+    async def run():
+        engine, factory = session_factory(db_path)
+        # Not started, nothing drains the queue
+        writer = WriteBehindWriter(factory, max_size=1, max_wait_ms=10)
+        await writer.put(image_row("0.png"))
+        with pytest.raises(WriteBehindFull) as exc_info:
+            await writer.put(image_row("1.png"))
+        await engine.dispose()
+        return writer, exc_info.value
+
+    writer, error = asyncio.run(run())
+    assert error.retry_after == 1
+    assert writer.rejected == 1
+    assert writer.stats()["pending"] == 1
+
+
+def test_write_behind_lost(db_path):
+    def failing_factory():
+        raise RuntimeError("database down")
+
+    async def run():
+        writer = WriteBehindWriter(
+            failing_factory, interval_ms=1, max_attempts=2
+        )
+        await writer.put(image_row("0.png"))
+        await writer.flush()
+        return writer.stats()
+
+    stats = asyncio.run(run())
+    assert stats["lost"] == 1
+    assert stats["retries"] == 1
+    assert stats["written"] == 0
+    assert stats["pending"] == 0